@@ -3,31 +3,201 @@
 SpotShadow - Versão com Autenticação Oficial do Spotify
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response
 import os
-import subprocess
-import zipfile
+import importlib
+import errno
 import threading
+import time
+import tempfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 import shutil
-import requests
+from collections import deque, OrderedDict
+from functools import partial
+from queue import Queue
 import json
 import re
+import shlex
+import signal
 import base64
-from urllib.parse import urlparse, parse_qs
+import hashlib
+import heapq
+import hmac
+import itertools
+import unicodedata
+import uuid
+import zipfile
+from urllib.parse import urlparse, parse_qs, quote
+
+class LazyModule:
+    """Módulo importado só no primeiro uso (acelera o cold start do processo web)"""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Imports pesados: só carregam quando um download/requisição externa acontece
+requests = LazyModule('requests')
+subprocess = LazyModule('subprocess')
 
 app = Flask(__name__)
 
+# Entrega de arquivos grandes: '' (Flask com Range/ETag), 'x-accel' (nginx)
+# ou 'x-sendfile' (Apache/lighttpd). Nos modos de offload o proxy envia os bytes
+SENDFILE_MODE = os.environ.get('SENDFILE_MODE', '').strip().lower()
+# Location interna do nginx que aponta para a pasta downloads/ (modo x-accel)
+SENDFILE_PREFIX = os.environ.get('SENDFILE_PREFIX', '/protected-downloads/')
+app.config['USE_X_SENDFILE'] = SENDFILE_MODE == 'x-sendfile'
+
 # Configurações do Spotify (opcionais - podem ser definidas via variáveis de ambiente)
 SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID', '')
 SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET', '')
 
+# Executáveis externos (podem ser trocados, ex.: binários falsos do teste de carga)
+SPOTDL_CMD = shlex.split(os.environ.get('SPOTDL_BIN', 'spotdl'))
+YTDLP_CMD = shlex.split(os.environ.get('YTDLP_BIN', 'yt-dlp'))
+FFMPEG_CMD = shlex.split(os.environ.get('FFMPEG_BIN', 'ffmpeg'))
+
+# Endereços do Spotify (podem apontar para um substituto local nos testes de carga)
+SPOTIFY_WEB_URL = os.environ.get('SPOTIFY_WEB_URL', 'https://open.spotify.com').rstrip('/')
+SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com').rstrip('/')
+SPOTIFY_ACCOUNTS_URL = os.environ.get('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com').rstrip('/')
+
+# Resolver em corrida: atraso antes de iniciar o SpotDL especulativamente
+RESOLVER_HEDGE_DELAY = float(os.environ.get('RESOLVER_HEDGE_DELAY', '4'))
+# Tempo máximo total do resolver
+RESOLVER_TIMEOUT = float(os.environ.get('RESOLVER_TIMEOUT', '240'))
+# Timeout de cada listagem via SpotDL (--save-file / --list)
+SPOTDL_LIST_TIMEOUT = int(os.environ.get('SPOTDL_LIST_TIMEOUT', '180'))
+# Listas do web scraping com esse tamanho provavelmente foram truncadas pelo Spotify
+WEB_SCRAPING_CAP = int(os.environ.get('WEB_SCRAPING_CAP', '100'))
+# JSON embutido maior que isso (bytes) é lido token a token, sem montar a árvore; 0 desativa
+WEB_SCRAPING_STREAM_BYTES = int(os.environ.get('WEB_SCRAPING_STREAM_BYTES', str(4 * 1024 * 1024)))
+# Tempo que um processo cancelado tem para sair (SIGTERM) antes do SIGKILL
+KILL_GRACE_SECONDS = float(os.environ.get('KILL_GRACE_SECONDS', '3'))
+
+# Escalonador justo: workers compartilhados por todos os jobs, que recebem
+# lotes de músicas alternando entre clientes (e entre os jobs de cada cliente)
+SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', '3'))
+SCHEDULER_BATCH_SIZE = int(os.environ.get('SCHEDULER_BATCH_SIZE', '10'))
+SPOTDL_UNIT_THREADS = int(os.environ.get('SPOTDL_UNIT_THREADS', '4'))
+# Novas tentativas de um lote do SpotDL que falhou (erro ou timeout), só com as
+# músicas que ele não entregou; esgotadas, elas vão para o método manual
+SPOTDL_SHARD_RETRIES = int(os.environ.get('SPOTDL_SHARD_RETRIES', '1'))
+# Tentativas por música no método manual (fila de novas tentativas com espera
+# exponencial: TRACK_RETRY_BASE_DELAY, 2x, 4x... segundos)
+TRACK_RETRY_ATTEMPTS = int(os.environ.get('TRACK_RETRY_ATTEMPTS', '3'))
+TRACK_RETRY_BASE_DELAY = float(os.environ.get('TRACK_RETRY_BASE_DELAY', '5'))
+# Peso de cada música nova na média móvel do tempo por música (ETA e prioridade)
+ETA_EMA_ALPHA = float(os.environ.get('ETA_EMA_ALPHA', '0.2'))
+
+# Cotas por cliente (IP) dentro de QUOTA_WINDOW segundos; 0 desativa a cota
+MAX_JOBS_PER_CLIENT = int(os.environ.get('MAX_JOBS_PER_CLIENT', '2'))
+QUOTA_TRACKS_PER_CLIENT = int(os.environ.get('QUOTA_TRACKS_PER_CLIENT', '2000'))
+QUOTA_BYTES_PER_CLIENT = int(os.environ.get('QUOTA_BYTES_PER_CLIENT', str(10 * 1024 ** 3)))
+QUOTA_WINDOW = int(os.environ.get('QUOTA_WINDOW', '3600'))
+
+# Lotes (POST /batch): várias playlists num job, músicas em comum baixadas uma vez
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', '20'))
+BATCH_RESOLVE_WORKERS = int(os.environ.get('BATCH_RESOLVE_WORKERS', '4'))
+# 'folders': um ZIP com uma pasta por playlist; 'per-playlist': um ZIP por playlist
+BATCH_LAYOUTS = ('folders', 'per-playlist')
+# Atrás de proxy reverso: identificar o cliente pelo X-Forwarded-For
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', '') == '1'
+# Jobs finalizados (status, ZIP e músicas) ficam disponíveis por JOB_TTL
+# segundos; acima de MAX_FINISHED_JOBS os mais antigos são esquecidos antes
+JOB_TTL = int(os.environ.get('JOB_TTL', str(6 * 3600)))
+MAX_FINISHED_JOBS = int(os.environ.get('MAX_FINISHED_JOBS', '200'))
+
+# Painel de administração (/admin); sem token o painel fica desativado
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# Processo sem imprimir nada por esse tempo aparece como travado no painel
+ADMIN_STUCK_SECONDS = int(os.environ.get('ADMIN_STUCK_SECONDS', '300'))
+# Ocupação das pastas (caches, downloads, área de trabalho) é medida no máximo
+# uma vez a cada ADMIN_USAGE_TTL segundos, não a cada atualização do painel
+ADMIN_USAGE_TTL = float(os.environ.get('ADMIN_USAGE_TTL', '30'))
+
 # Token do Spotify (cache)
 spotify_token = {
     'access_token': None,
     'expires_at': 0
 }
 
+# Extensões de áudio reconhecidas nas pastas dos jobs
+AUDIO_EXTENSIONS = {'.mp3', '.opus', '.m4a', '.ogg', '.webm', '.aac', '.flac'}
+
+# Perfis de saída: argumentos do SpotDL e do yt-dlp para cada formato.
+# 'native' mantém o áudio da fonte (opus/m4a) sem recodificar no ffmpeg,
+# que é o maior custo de CPU por música.
+OUTPUT_PROFILES = {
+    'mp3-128': {
+        'label': 'MP3 128 kbps',
+        'spotdl': ['--format', 'mp3', '--bitrate', '128k'],
+        'ytdlp': ['--extract-audio', '--audio-format', 'mp3', '--audio-quality', '128K'],
+        'ffmpeg': ['-codec:a', 'libmp3lame', '-b:a', '128k', '-id3v2_version', '3', '-f', 'mp3'],
+        'ext': '.mp3'
+    },
+    'mp3-320': {
+        'label': 'MP3 320 kbps',
+        'spotdl': ['--format', 'mp3', '--bitrate', '320k'],
+        'ytdlp': ['--extract-audio', '--audio-format', 'mp3', '--audio-quality', '320K'],
+        'ffmpeg': ['-codec:a', 'libmp3lame', '-b:a', '320k', '-id3v2_version', '3', '-f', 'mp3'],
+        'ext': '.mp3'
+    },
+    'native': {
+        'label': 'Original (opus/m4a, sem recodificar)',
+        'spotdl': ['--format', 'opus', '--bitrate', 'disable'],
+        'ytdlp': ['--format', 'bestaudio', '--extract-audio', '--audio-format', 'best'],
+        'ffmpeg': None,
+        'ext': None
+    }
+}
+DEFAULT_PROFILE = os.environ.get('DEFAULT_PROFILE', 'mp3-128')
+if DEFAULT_PROFILE not in OUTPUT_PROFILES:
+    print(f"⚠️ DEFAULT_PROFILE inválido ({DEFAULT_PROFILE}), usando mp3-128")
+    DEFAULT_PROFILE = 'mp3-128'
+
+# Pipeline em dois estágios: SpotDL/yt-dlp só baixam o áudio original (rede) e
+# um pool de ffmpeg do tamanho da CPU converte para o perfil, ligados por uma
+# fila limitada. Com SEPARATE_TRANSCODE=0 cada ferramenta converte sozinha.
+SEPARATE_TRANSCODE = os.environ.get('SEPARATE_TRANSCODE', '1') != '0'
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', str(os.cpu_count() or 2)))
+TRANSCODE_QUEUE_SIZE = int(os.environ.get('TRANSCODE_QUEUE_SIZE', '64'))
+TRANSCODE_TIMEOUT = int(os.environ.get('TRANSCODE_TIMEOUT', '300'))
+
+# Cache de músicas já baixadas, separado por perfil (cache/tracks/<perfil>/)
+CACHE_DIR = os.environ.get('CACHE_DIR', 'cache')
+# Área de trabalho dos jobs (downloads, conversões, ZIPs em montagem e .spotdl),
+# uma subpasta única por job; pode ficar em tmpfs ou num volume rápido
+SCRATCH_DIR = os.environ.get('SCRATCH_DIR', os.path.join('downloads', 'scratch'))
+TRACK_CACHE_MAX_BYTES = int(os.environ.get('TRACK_CACHE_MAX_BYTES', str(5 * 1024 ** 3)))
+# ZIPs prontos por playlist + lista de músicas + perfil (cache/archives/); 0 desativa
+ARCHIVE_CACHE_MAX_BYTES = int(os.environ.get('ARCHIVE_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+# Cache negativo: músicas que nenhuma fonte encontrou são puladas até expirar
+NEGATIVE_CACHE_TTL = int(os.environ.get('NEGATIVE_CACHE_TTL', str(7 * 24 * 3600)))
+# Falhas só por timeout podem ser passageiras: expiram antes
+NEGATIVE_CACHE_TIMEOUT_TTL = int(os.environ.get('NEGATIVE_CACHE_TIMEOUT_TTL', str(6 * 3600)))
+
+# Pré-aquecimento: playlists/álbuns mais pedidos são resolvidos de novo a cada
+# PREWARM_INTERVAL segundos e as músicas novas vão para o cache de músicas,
+# só nas horas PREWARM_HOURS ('início-fim', hora local; vazio = qualquer hora)
+# e sem downloads de usuários em andamento. PREWARM_INTERVAL=0 desativa.
+PREWARM_INTERVAL = int(os.environ.get('PREWARM_INTERVAL', '3600'))
+PREWARM_HOURS = os.environ.get('PREWARM_HOURS', '2-6')
+PREWARM_TOP = int(os.environ.get('PREWARM_TOP', '50'))
+# Pedidos (com meia-vida PREWARM_HALF_LIFE segundos) para uma playlist ser "quente"
+PREWARM_MIN_REQUESTS = float(os.environ.get('PREWARM_MIN_REQUESTS', '3'))
+PREWARM_HALF_LIFE = int(os.environ.get('PREWARM_HALF_LIFE', str(3 * 24 * 3600)))
+# Playlists sem pedidos por esse tempo deixam de ser acompanhadas
+PREWARM_FORGET_AFTER = int(os.environ.get('PREWARM_FORGET_AFTER', str(14 * 24 * 3600)))
+
 # Status global do download
 download_status = {
     'status': 'idle',
@@ -39,13 +209,908 @@ download_status = {
     'total_songs': 0
 }
 
+# Jobs de download (id -> job). Cada job tem sua própria pasta e manifesto
+jobs = {}
+jobs_lock = threading.Lock()
+
+def transcodes_separately(profile):
+    """O perfil usa o estágio de conversão próprio (pool de ffmpeg)?"""
+    return SEPARATE_TRANSCODE and bool(OUTPUT_PROFILES[profile]['ffmpeg'])
+
+def fetch_args(profile, tool):
+    """Argumentos de formato para o SpotDL/yt-dlp ('spotdl' ou 'ytdlp')
+    
+    Com conversão separada a ferramenta só baixa o áudio original (como no
+    perfil native) e o ffmpeg do pool converte depois.
+    """
+    if transcodes_separately(profile):
+        return OUTPUT_PROFILES['native'][tool]
+    return OUTPUT_PROFILES[profile][tool]
+
+def scratch_root():
+    """Pasta da área de trabalho (criada na primeira vez)"""
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    return SCRATCH_DIR
+
+def clean_scratch():
+    """Remover áreas de trabalho deixadas por uma execução anterior do processo
+    
+    Só toca no que o próprio app cria (job_* e *.spotdl), mesmo que
+    SCRATCH_DIR aponte para uma pasta compartilhada. As pastas de resultado
+    dos jobs em downloads/ também saem: os jobs não sobrevivem ao processo.
+    """
+    for folder in (SCRATCH_DIR, 'downloads'):
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if folder == 'downloads':
+                        if entry.is_dir() and re.fullmatch(r'[0-9a-f]{12}', entry.name):
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                    elif entry.is_dir() and entry.name.startswith('job_'):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    elif entry.is_file() and entry.name.endswith('.spotdl'):
+                        os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"⚠️ Erro ao limpar {folder}: {e}")
+
+def publish_path(job, name):
+    """Destino em downloads/ de um resultado do job
+    
+    Cada job publica na sua própria pasta (downloads/<id>/): dois jobs da
+    mesma playlist, em perfis diferentes, não sobrescrevem o ZIP um do outro.
+    O nome legível só aparece no arquivo, que vira o nome do download.
+    """
+    folder = os.path.join('downloads', job['id'])
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, name)
+
+def spotdl_save_path(kind, item_id):
+    """Caminho único para um .spotdl (jobs da mesma playlist não colidem)"""
+    return os.path.join(scratch_root(), f'{kind or "playlist"}_{item_id}_{uuid.uuid4().hex[:12]}.spotdl')
+
+def create_job(playlist_url, client=None, profile=DEFAULT_PROFILE, kind=None):
+    """Registrar um novo job de download com pasta e manifesto próprios"""
+    evict_finished_jobs()
+    job_id = uuid.uuid4().hex[:12]
+    kind = kind or parse_spotify_url(playlist_url)[0] or 'playlist'
+    # Nome único (mkdtemp) na área de trabalho; só o resultado vai para downloads/
+    Path('downloads').mkdir(exist_ok=True)
+    output_dir = tempfile.mkdtemp(prefix=f'job_{job_id}_', dir=scratch_root())
+    job = {
+        'id': job_id,
+        'url': playlist_url,
+        # 'playlist', 'album', 'track' (música avulsa: sem ZIP) ou 'batch'
+        'kind': kind,
+        'client': client,
+        'profile': profile,
+        'output_dir': output_dir,
+        # Onde SpotDL/yt-dlp gravam; com conversão separada é uma subpasta
+        # e só o resultado do ffmpeg chega à pasta do job
+        'fetch_dir': os.path.join(output_dir, 'fetch') if transcodes_separately(profile) else output_dir,
+        # Identificadores do Spotify por música (chave normalizada -> id/isrc)
+        'track_meta': {},
+        # Arquivos já entregues ao estágio de conversão
+        'handed_off': set(),
+        # Músicas que o próprio SpotDL entregou (decide o método manual)
+        'spotdl_delivered': 0,
+        # Músicas já no método manual (uma unidade por música, com novas tentativas)
+        'manual_songs': set(),
+        # Tentativas do método manual por música e o resultado final de cada uma
+        'track_attempts': {},
+        'outcomes': None,
+        'pending_transcodes': 0,
+        'created_at': time.time(),
+        'finished_at': None,
+        # Arquivos produzidos pelo job: {'path', 'song', 'size', 'profile'}
+        # ('profile' difere do job quando a conversão falhou e o original foi entregue)
+        'manifest': [],
+        # Mesmas entradas por caminho: duplicados detectados em O(1)
+        'manifest_index': {},
+        'manifest_lock': threading.Lock(),
+        # ZIP parcial mais recente: {'count', 'path'}
+        'partial_zip': None,
+        'partial_lock': threading.Lock(),
+        # Sinalizado por DELETE /jobs/<id>; interrompe resolução e downloads
+        'cancel_event': threading.Event(),
+        # Unidades de trabalho ainda na fila do escalonador / não concluídas
+        'units': deque(),
+        # Novas tentativas agendadas: heap de (quando, sequência, unidade)
+        'retry_units': [],
+        'queued': False,
+        'pending_units': 0,
+        # Desde quando o job espera a vez no escalonador (prioridade)
+        'waiting_since': None,
+        # Média móvel do intervalo entre músicas entregues e do tamanho delas
+        'estimate': {'started_at': None, 'last_at': None, 'interval': None, 'bytes': None},
+        'quota_exceeded': False,
+        # Lote com um ZIP por playlist: caminhos servidos em /jobs/<id>/archives/<n>
+        'archives': [],
+        'status': {
+            'job_id': job_id,
+            'status': 'downloading',
+            'progress': 'Preparando download inteligente...',
+            'zip_file': None,
+            'error_message': '',
+            'current_song': '',
+            'downloaded_songs': 0,
+            'total_songs': 0,
+            'profile': profile,
+            'kind': kind,
+            'cache_hits': 0,
+            'transcode_pending': 0,
+            # Ritmo e previsão pela média móvel (None até haver medida)
+            'tracks_per_second': None,
+            'bytes_per_second': None,
+            'eta_seconds': None,
+            'negative_cache': {'lookups': 0, 'hits': 0, 'hit_rate': None, 'skipped': 0}
+        }
+    }
+    with jobs_lock:
+        jobs[job_id] = job
+    return job
+
+def evict_finished_jobs(now=None):
+    """Esquecer os jobs finalizados há mais de JOB_TTL (ou além de MAX_FINISHED_JOBS)"""
+    now = now or time.time()
+    with jobs_lock:
+        finished = sorted((job for job in jobs.values() if job['finished_at'] is not None),
+                          key=lambda job: job['finished_at'])
+        excess = len(finished) - MAX_FINISHED_JOBS
+        evicted = [jobs.pop(job['id']) for position, job in enumerate(finished)
+                   if position < excess or now - job['finished_at'] > JOB_TTL]
+    for job in evicted:
+        discard_job_files(job)
+    if evicted:
+        print(f"🧹 {len(evicted)} jobs finalizados esquecidos")
+
+def discard_job_files(job):
+    """Remover o que o job ainda tem em disco: pasta de trabalho, ZIP parcial e resultados"""
+    with job['partial_lock']:
+        shutil.rmtree(job['output_dir'], ignore_errors=True)
+        discard_partial_zip(job)
+    shutil.rmtree(os.path.join('downloads', job['id']), ignore_errors=True)
+
+def add_to_manifest(job, file_path, song=None, profile=None):
+    """Registrar no manifesto um arquivo produzido pelo job (ignora duplicados)
+    
+    `profile`: formato real do arquivo, se não for o do job.
+    """
+    file_path = os.path.normpath(file_path)
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return None
+    
+    with job['manifest_lock']:
+        entry = job['manifest_index'].get(file_path)
+        if entry:
+            if song and not entry['song']:
+                entry['song'] = song
+            return entry
+        entry = {'path': file_path, 'song': song, 'size': size, 'profile': profile or job['profile']}
+        job['manifest'].append(entry)
+        job['manifest_index'][file_path] = entry
+        job['status']['downloaded_songs'] = len(job['manifest'])
+        record_track_timing(job, size)
+    
+    charge_client(job.get('client'), nbytes=size)
+    return entry
+
+# Intervalo médio entre músicas de todos os jobs: estimativa de quem ainda não
+# entregou nenhuma (e, sem histórico algum, DEFAULT_TRACK_SECONDS)
+track_interval_ema = {'seconds': None}
+DEFAULT_TRACK_SECONDS = 5.0
+
+def ema(previous, sample):
+    """Média móvel exponencial com peso ETA_EMA_ALPHA para a nova amostra"""
+    if previous is None:
+        return sample
+    return previous + ETA_EMA_ALPHA * (sample - previous)
+
+def start_estimate(job):
+    """Começar a medir o ritmo do job (depois do cache: acertos não contam)"""
+    job['estimate']['started_at'] = job['estimate']['last_at'] = time.time()
+    refresh_estimate(job)
+
+def record_track_timing(job, size):
+    """Atualizar a média móvel com uma música recém-entregue (com manifest_lock)"""
+    estimate = job['estimate']
+    if estimate['started_at'] is None:
+        return
+    now = time.time()
+    interval = now - estimate['last_at']
+    estimate['last_at'] = now
+    estimate['interval'] = ema(estimate['interval'], interval)
+    estimate['bytes'] = ema(estimate['bytes'], size)
+    track_interval_ema['seconds'] = ema(track_interval_ema['seconds'], interval)
+    refresh_estimate(job, now)
+
+def track_seconds(job):
+    """Segundos por música do job (média do job, geral ou o padrão)"""
+    return job['estimate']['interval'] or track_interval_ema['seconds'] or DEFAULT_TRACK_SECONDS
+
+def remaining_tracks(job):
+    """Músicas que o job ainda precisa entregar"""
+    status = job['status']
+    return max(0, status['total_songs'] - status['downloaded_songs'] - status['negative_cache']['skipped'])
+
+def refresh_estimate(job, now=None):
+    """Recalcular músicas/s, bytes/s e ETA do job a partir da média móvel
+    
+    Se a música atual já demora mais que a média, esse tempo conta como
+    intervalo: o ritmo cai e o ETA não fica parado durante um lote lento.
+    """
+    estimate = job['estimate']
+    status = job['status']
+    if estimate['started_at'] is None or status['status'] != 'downloading':
+        return
+    now = now or time.time()
+    silent = now - estimate['last_at']
+    interval = max(track_seconds(job), silent, 1e-3)
+    remaining = remaining_tracks(job)
+    
+    if estimate['interval'] is not None:
+        status['tracks_per_second'] = round(1 / interval, 3)
+        status['bytes_per_second'] = round(estimate['bytes'] / interval)
+    status['eta_seconds'] = round(max(0.0, remaining * interval - silent)) if remaining else 0
+
+def find_job(job_id):
+    """Buscar job pelo id (None se não existir)"""
+    with jobs_lock:
+        return jobs.get(job_id)
+
+# Consumo recente de cada cliente: deque de (timestamp, músicas, bytes)
+client_usage = {}
+client_usage_lock = threading.Lock()
+
+def charge_client(client, tracks=0, nbytes=0):
+    """Registrar músicas/bytes consumidos por um cliente (para as cotas)"""
+    if client is None or (not tracks and not nbytes):
+        return
+    with client_usage_lock:
+        client_usage.setdefault(client, deque()).append((time.time(), tracks, nbytes))
+
+def client_usage_totals(client):
+    """Somar o consumo do cliente na janela atual -> (músicas, bytes, início)"""
+    cutoff = time.time() - QUOTA_WINDOW
+    with client_usage_lock:
+        usage = client_usage.get(client)
+        if not usage:
+            return 0, 0, None
+        while usage and usage[0][0] < cutoff:
+            usage.popleft()
+        if not usage:
+            del client_usage[client]
+            return 0, 0, None
+        tracks = sum(item[1] for item in usage)
+        nbytes = sum(item[2] for item in usage)
+        return tracks, nbytes, usage[0][0]
+
+def quota_refusal(client):
+    """Motivo para recusar um novo job do cliente (None se estiver dentro das cotas)
+    
+    Retorna (mensagem, segundos para tentar de novo).
+    """
+    if MAX_JOBS_PER_CLIENT:
+        with jobs_lock:
+            active = sum(1 for job in jobs.values()
+                         if job['client'] == client and job['status']['status'] == 'downloading')
+        if active >= MAX_JOBS_PER_CLIENT:
+            return f'Limite de {MAX_JOBS_PER_CLIENT} downloads simultâneos atingido', 30
+    
+    tracks, nbytes, oldest = client_usage_totals(client)
+    retry_after = int(oldest + QUOTA_WINDOW - time.time()) + 1 if oldest else QUOTA_WINDOW
+    if QUOTA_TRACKS_PER_CLIENT and tracks >= QUOTA_TRACKS_PER_CLIENT:
+        return f'Cota de {QUOTA_TRACKS_PER_CLIENT} músicas atingida, tente novamente mais tarde', retry_after
+    if QUOTA_BYTES_PER_CLIENT and nbytes >= QUOTA_BYTES_PER_CLIENT:
+        return 'Cota de volume de download atingida', retry_after
+    return None
+
+def over_byte_quota(client):
+    """Cliente já passou da cota de bytes da janela atual?"""
+    if client is None or not QUOTA_BYTES_PER_CLIENT:
+        return False
+    return client_usage_totals(client)[1] >= QUOTA_BYTES_PER_CLIENT
+
+def sync_manifest_from_output_dir(job):
+    """Registrar arquivos de áudio da pasta do próprio job (listagem única, sem recursão)
+    
+    O SpotDL grava todos os arquivos direto na pasta do job (template de saída
+    sem subpastas), então uma listagem plana cobre tudo em O(tamanho do job).
+    """
+    try:
+        with os.scandir(job['output_dir']) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                    add_to_manifest(job, entry.path)
+    except FileNotFoundError:
+        pass
+    return job['manifest']
+
+def spotdl_sanitize(text):
+    """Mesma limpeza que o SpotDL aplica aos nomes de arquivo"""
+    text = "".join(char for char in text if char not in "/?\\*|<>")
+    return text.replace('"', "'").replace(":", "-").strip()
+
+def make_spotdl_line_handler(job):
+    """Callback de linha do SpotDL: registra cada música assim que termina
+    
+    O SpotDL imprime 'Downloaded "Artista - Música": url' depois de converter o
+    arquivo. Só o arquivo correspondente é registrado, pois outras threads do
+    SpotDL podem estar gravando arquivos ainda incompletos na mesma pasta.
+    Retorna o nome anunciado nas linhas de música baixada (None nas demais).
+    """
+    downloaded_re = re.compile(r'Downloaded "(.+?)":\s*(\S+)?')
+    
+    def on_line(line):
+        match = downloaded_re.search(line)
+        if not match:
+            return None
+        display_name = match.group(1)
+        # URL de onde o SpotDL baixou: a próxima vez pula a busca
+        record_resolved_url(display_name, match.group(2), 'SpotDL', track_meta(job, display_name))
+        artist, _, title = display_name.partition(' - ')
+        artist = spotdl_sanitize(artist).lower()
+        title = spotdl_sanitize(title).lower()
+        
+        with job['manifest_lock']:
+            known = job['manifest_index'].keys() | job['handed_off']
+        try:
+            with os.scandir(job['fetch_dir']) as entries:
+                for entry in entries:
+                    stem, ext = os.path.splitext(entry.name)
+                    if ext.lower() not in AUDIO_EXTENSIONS or os.path.normpath(entry.path) in known:
+                        continue
+                    stem = stem.lower()
+                    if stem.startswith(artist) and stem.endswith(title):
+                        deliver_track(job, entry.path, display_name)
+                        with job['manifest_lock']:
+                            job['spotdl_delivered'] += 1
+                        job['status']['current_song'] = f'✅ {display_name}'
+                        break
+        except FileNotFoundError:
+            pass
+        return display_name
+    
+    return on_line
+
+def build_partial_zip(job):
+    """Montar ZIP com as músicas já concluídas do job (reaproveitado se nada mudou)"""
+    with job['partial_lock']:
+        with job['manifest_lock']:
+            entries = [entry for entry in job['manifest'] if os.path.exists(entry['path'])]
+        if not entries:
+            return None
+        
+        previous = job['partial_zip']
+        if previous and previous['count'] == len(entries) and os.path.exists(previous['path']):
+            return previous['path']
+        
+        zip_path = publish_path(job, f"parcial_{len(entries)}.zip")
+        temp_path = os.path.join(job['output_dir'], '.parcial.zip')
+        # Áudio já é comprimido: ZIP_STORED evita gastar CPU à toa
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as zipf:
+            for entry in entries:
+                zipf.write(entry['path'], os.path.basename(entry['path']).replace('_', ' '))
+        publish_file(temp_path, zip_path)
+        
+        discard_partial_zip(job)
+        job['partial_zip'] = {'count': len(entries), 'path': zip_path}
+        return zip_path
+
+def discard_partial_zip(job):
+    """Remover o ZIP parcial do job (chamar com partial_lock adquirido)"""
+    previous = job['partial_zip']
+    job['partial_zip'] = None
+    if previous and os.path.exists(previous['path']):
+        try:
+            os.remove(previous['path'])
+        except OSError:
+            pass
+
+def parse_printed_filepath(stdout):
+    """Extrair o caminho final impresso por `yt-dlp --print after_move:filepath`"""
+    for line in reversed((stdout or '').strip().split('\n')):
+        line = line.strip()
+        if line and os.path.isfile(line):
+            return line
+    return None
+
+def normalize_track_key(song):
+    """Identidade normalizada de uma música: 'primeiro artista - título'
+    
+    Ignora acentos, caixa, pontuação e artistas convidados, para que
+    'A & B - Música' (resolução) e 'A, B - Música' (arquivo do SpotDL) batam.
+    """
+    artist, sep, title = (song or '').partition(' - ')
+    if not sep:
+        artist, title = '', artist
+    artist = re.split(r'\s*(?:&|,|\bfeat\.?\s|\bft\.?\s)\s*', artist, maxsplit=1)[0]
+    
+    def clean(text):
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+        return ' '.join(re.sub(r'[^\w]+', ' ', text.casefold()).split())
+    
+    return f"{clean(artist)} - {clean(title)}"
+
+def track_cache_name(song):
+    """Nome (sem extensão) da música no cache"""
+    return hashlib.sha1(normalize_track_key(song).encode('utf-8')).hexdigest()[:24]
+
+def publish_file(source, target):
+    """Mover um arquivo pronto da área de trabalho para o destino, de forma atômica
+    
+    Na mesma partição é um rename; vindo de outra (ex.: SCRATCH_DIR em
+    tmpfs) o arquivo é copiado para um temporário ao lado do destino e então
+    renomeado, então ninguém vê o destino pela metade.
+    """
+    try:
+        os.replace(source, target)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    temp_target = f"{target}.{uuid.uuid4().hex[:12]}.tmp"
+    try:
+        shutil.copyfile(source, temp_target)
+        os.replace(temp_target, target)
+    except BaseException:
+        if os.path.exists(temp_target):
+            os.remove(temp_target)
+        raise
+    os.remove(source)
+
+def link_or_copy(source, target):
+    """Hard link (instantâneo, sem espaço extra) ou cópia entre sistemas de arquivos"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+def track_cache_index(profile):
+    """Músicas em cache para o perfil: {nome no cache: caminho} (listagem única)"""
+    index = {}
+    try:
+        with os.scandir(os.path.join(CACHE_DIR, 'tracks', profile)) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in AUDIO_EXTENSIONS:
+                    index[stem] = entry.path
+    except FileNotFoundError:
+        pass
+    return index
+
+def fill_from_track_cache(job, songs):
+    """Colocar na pasta do job as músicas já em cache (no perfil do job)
+    
+    Retorna a lista de músicas que ainda precisam ser baixadas.
+    """
+    index = track_cache_index(job['profile'])
+    if not index:
+        return list(songs)
+    
+    missing = []
+    hits = 0
+    for song in songs:
+        cached = index.get(track_cache_name(song))
+        if cached:
+            target = os.path.join(job['output_dir'], spotdl_sanitize(song) + os.path.splitext(cached)[1])
+            try:
+                link_or_copy(cached, target)
+                # mtime marca uso recente (a limpeza remove os mais antigos)
+                os.utime(cached)
+                add_to_manifest(job, target, song)
+                hits += 1
+                continue
+            except OSError as e:
+                print(f"⚠️ Cache indisponível para {song}: {e}")
+        missing.append(song)
+    
+    job['status']['cache_hits'] = hits
+    if hits:
+        print(f"♻️ {hits} músicas vieram do cache ({job['profile']})")
+    return missing
+
+def store_in_track_cache(job):
+    """Guardar no cache as músicas produzidas pelo job e respeitar o limite de disco
+    
+    Cada arquivo vai para o cache do seu formato real: um original entregue
+    porque a conversão falhou fica em 'native', nunca no perfil do job.
+    """
+    with job['manifest_lock']:
+        entries = list(job['manifest'])
+    
+    stored = 0
+    profiles = set()
+    for entry in entries:
+        cache_dir = os.path.join(CACHE_DIR, 'tracks', entry['profile'])
+        song = entry['song'] or os.path.splitext(os.path.basename(entry['path']))[0]
+        target = os.path.join(cache_dir, track_cache_name(song) + os.path.splitext(entry['path'])[1].lower())
+        if os.path.exists(target) or not os.path.exists(entry['path']):
+            continue
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_target = f"{target}.{job['id']}.tmp"
+            link_or_copy(entry['path'], temp_target)
+            os.replace(temp_target, target)
+            stored += 1
+            profiles.add(entry['profile'])
+        except OSError as e:
+            print(f"⚠️ Erro ao guardar {song} no cache: {e}")
+    
+    if stored:
+        print(f"💾 {stored} músicas guardadas no cache ({', '.join(sorted(profiles))})")
+        prune_track_cache()
+
+def prune_track_cache():
+    """Remover as músicas usadas há mais tempo até caber em TRACK_CACHE_MAX_BYTES"""
+    files = []
+    for profile in OUTPUT_PROFILES:
+        try:
+            with os.scandir(os.path.join(CACHE_DIR, 'tracks', profile)) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            continue
+    
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= TRACK_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+# ZIPs prontos: uma playlist que não mudou (mesma lista de músicas) no mesmo
+# perfil é entregue com o ZIP da vez anterior, sem montar nada
+archive_cache_stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+def archive_cache_key(job, songs):
+    """Chave do ZIP: tipo e ID + perfil + hash da lista de músicas (o "snapshot")"""
+    kind, item_id = parse_spotify_url(job['url'])
+    digest = hashlib.sha1('\n'.join(songs).encode('utf-8')).hexdigest()[:16]
+    return f"{kind}_{item_id}_{job['profile']}_{digest}"
+
+def archive_cache_path(key):
+    return os.path.join(CACHE_DIR, 'archives', f'{key}.zip')
+
+def fetch_from_archive_cache(job, key, zip_name):
+    """Publicar em zip_name o ZIP em cache para a chave (False se não houver)"""
+    if not ARCHIVE_CACHE_MAX_BYTES:
+        return False
+    cached = archive_cache_path(key)
+    try:
+        temp_name = f"{zip_name}.{job['id']}.tmp"
+        link_or_copy(cached, temp_name)
+        os.replace(temp_name, zip_name)
+        # mtime marca uso recente (a limpeza remove os mais antigos)
+        os.utime(cached)
+    except FileNotFoundError:
+        archive_cache_stats['misses'] += 1
+        return False
+    except OSError as e:
+        print(f"⚠️ ZIP em cache indisponível ({key}): {e}")
+        archive_cache_stats['misses'] += 1
+        return False
+    archive_cache_stats['hits'] += 1
+    return True
+
+def store_in_archive_cache(key, zip_name):
+    """Guardar um ZIP completo no cache e respeitar ARCHIVE_CACHE_MAX_BYTES"""
+    if not ARCHIVE_CACHE_MAX_BYTES:
+        return
+    cached = archive_cache_path(key)
+    if os.path.exists(cached):
+        return
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        temp_name = f"{cached}.{os.getpid()}.tmp"
+        link_or_copy(zip_name, temp_name)
+        os.replace(temp_name, cached)
+        archive_cache_stats['stored'] += 1
+    except OSError as e:
+        print(f"⚠️ Erro ao guardar ZIP no cache: {e}")
+        return
+    prune_archive_cache()
+
+def prune_archive_cache():
+    """Remover os ZIPs usados há mais tempo até caber em ARCHIVE_CACHE_MAX_BYTES"""
+    files = []
+    try:
+        with os.scandir(os.path.join(CACHE_DIR, 'archives')) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.zip'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return
+    
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= ARCHIVE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            archive_cache_stats['evicted'] += 1
+        except OSError:
+            pass
+
+# Pequenos armazenamentos JSON persistentes em CACHE_DIR (cache negativo,
+# índice de URLs): carregados na primeira consulta, gravados de forma atômica
+def make_json_store(filename, label, seeds=None):
+    """Criar um armazenamento JSON (dict chave -> entrada) em CACHE_DIR/filename
+    
+    `seeds`: entradas iniciais, acrescentadas na leitura para as chaves que
+    o arquivo não tem.
+    """
+    return {'file': filename, 'label': label, 'lock': threading.Lock(), 'seeds': seeds or {},
+            'entries': None, 'dirty': False, 'saved_at': 0.0}
+
+def store_entries(store):
+    """Entradas do armazenamento, lidas do disco na primeira chamada
+    
+    Entradas com 'expires_at' vencido são descartadas na leitura.
+    Chamar com store['lock'] adquirido.
+    """
+    if store['entries'] is None:
+        entries = {}
+        try:
+            with open(os.path.join(CACHE_DIR, store['file']), 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠️ {store['label']} ilegível, começando vazio: {e}")
+        now = time.time()
+        store['entries'] = {key: entry for key, entry in entries.items()
+                            if entry.get('expires_at', now + 1) > now}
+        for key, entry in store['seeds'].items():
+            store['entries'].setdefault(key, dict(entry))
+    return store['entries']
+
+def flush_store(store, force=False):
+    """Gravar o armazenamento em disco (atômico; no máximo a cada 30s sem force)"""
+    with store['lock']:
+        if not store['dirty']:
+            return
+        if not force and time.time() - store['saved_at'] < 30:
+            return
+        entries = dict(store_entries(store))
+        store['dirty'] = False
+        store['saved_at'] = time.time()
+    
+    path = os.path.join(CACHE_DIR, store['file'])
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"⚠️ Erro ao gravar {store['label']}: {e}")
+
+# Cache negativo persistente: chave normalizada -> falhas por fonte.
+# Entradas: {'song', 'failures': {fonte: motivo}, 'worked': fonte|None,
+#            'unfindable': bool, 'expires_at'}
+negative_cache = make_json_store('negative.json', 'cache negativo')
+
+def negative_lookup(song, job=None):
+    """Consultar o cache negativo (None se a música não tem histórico válido)"""
+    key = normalize_track_key(song)
+    with negative_cache['lock']:
+        entries = store_entries(negative_cache)
+        entry = entries.get(key)
+        if entry and entry['expires_at'] <= time.time():
+            del entries[key]
+            negative_cache['dirty'] = True
+            entry = None
+        entry = dict(entry) if entry else None
+    
+    if job is not None:
+        with job['manifest_lock']:
+            counters = job['status']['negative_cache']
+            counters['lookups'] += 1
+            if entry:
+                counters['hits'] += 1
+            counters['hit_rate'] = round(counters['hits'] / counters['lookups'], 3)
+    return entry
+
+# Tentativas por fonte desde o início do processo (taxa de sucesso no /admin)
+source_stats = {}
+source_stats_lock = threading.Lock()
+
+def count_source(source, ok, count=1):
+    """Contabilizar tentativas de uma fonte (SpotDL, yt-dlp, URL direta...)"""
+    if count <= 0:
+        return
+    with source_stats_lock:
+        stats = source_stats.setdefault(source, {'ok': 0, 'failed': 0})
+        stats['ok' if ok else 'failed'] += count
+
+def record_source_result(song, source, ok, reason=None):
+    """Registrar o resultado de uma fonte para a música no cache negativo
+    
+    Sucesso só é guardado se a música já tinha falhas (para ir direto à
+    fonte que funcionou); músicas sem histórico não ocupam espaço.
+    """
+    count_source(source, ok)
+    key = normalize_track_key(song)
+    with negative_cache['lock']:
+        entries = store_entries(negative_cache)
+        entry = entries.get(key)
+        if ok and not entry:
+            return
+        if not entry:
+            entry = entries[key] = {'song': song, 'failures': {}, 'worked': None, 'unfindable': False}
+        if ok:
+            entry['worked'] = source
+            entry['unfindable'] = False
+            entry['failures'].pop(source, None)
+        else:
+            entry['failures'][source] = reason or 'falhou'
+            if entry['worked'] == source:
+                entry['worked'] = None
+        only_timeouts = all(reason == 'timeout' for reason in entry['failures'].values())
+        entry['expires_at'] = time.time() + (NEGATIVE_CACHE_TIMEOUT_TTL if only_timeouts and not ok
+                                             else NEGATIVE_CACHE_TTL)
+        negative_cache['dirty'] = True
+    flush_store(negative_cache)
+
+def mark_unfindable(song):
+    """Marcar a música como não encontrada em nenhuma fonte
+    
+    Não acrescenta motivo: a validade segue as falhas já registradas (curta,
+    NEGATIVE_CACHE_TIMEOUT_TTL, se todas foram timeout).
+    """
+    key = normalize_track_key(song)
+    with negative_cache['lock']:
+        entries = store_entries(negative_cache)
+        entry = entries.get(key)
+        if not entry:
+            entry = entries[key] = {'song': song, 'failures': {}, 'worked': None, 'unfindable': False,
+                                    'expires_at': time.time() + NEGATIVE_CACHE_TIMEOUT_TTL}
+        entry['unfindable'] = True
+        negative_cache['dirty'] = True
+    flush_store(negative_cache)
+
+def skip_unfindable(job, songs):
+    """Separar as músicas marcadas como introuváveis (sem gastar downloads nelas)"""
+    remaining = []
+    for song in songs:
+        entry = negative_lookup(song, job)
+        if entry and entry['unfindable']:
+            with job['manifest_lock']:
+                job['status']['negative_cache']['skipped'] += 1
+            continue
+        remaining.append(song)
+    skipped = len(songs) - len(remaining)
+    if skipped:
+        print(f"🚫 {skipped} músicas puladas (nenhuma fonte encontrou nas últimas tentativas)")
+    return remaining
+
+# Índice persistente das URLs de onde cada música foi baixada, para pular a
+# busca (ytsearch1:/scsearch1:/SpotDL) e baixar direto na próxima vez.
+# Chaves: 'id:<id do Spotify>', 'isrc:<ISRC>' e 't:<artista - título normalizado>'
+# Entradas: {'url', 'source', 'song', 'updated_at'}
+# URLs conferidas manualmente (antigo known_urls), usadas se o índice não tiver a música
+RESOLVED_URL_SEEDS = {
+    "The Weeknd - Pray For Me": "https://www.youtube.com/watch?v=XR7Ev14vUh8",
+    "The Weeknd - I Was Never There": "https://www.youtube.com/watch?v=qFLhGq0060w",
+    "Lil Peep - Falling Down": "https://www.youtube.com/watch?v=zOujzvtwZ6M"
+}
+resolved_urls = make_json_store('resolved_urls.json', 'índice de URLs', seeds={
+    f"t:{normalize_track_key(song)}": {'url': url, 'source': 'manual', 'song': song, 'updated_at': 0}
+    for song, url in RESOLVED_URL_SEEDS.items()})
+
+def track_index_keys(song, meta=None):
+    """Chaves da música no índice, da mais específica para a mais genérica"""
+    keys = []
+    if meta:
+        if meta.get('id'):
+            keys.append(f"id:{meta['id']}")
+        if meta.get('isrc'):
+            keys.append(f"isrc:{meta['isrc'].upper()}")
+    keys.append(f"t:{normalize_track_key(song)}")
+    return keys
+
+def lookup_resolved_url(song, meta=None):
+    """URL já conhecida para a música (None se nunca foi baixada)"""
+    with resolved_urls['lock']:
+        entries = store_entries(resolved_urls)
+        for key in track_index_keys(song, meta):
+            entry = entries.get(key)
+            if entry:
+                return entry['url']
+    return None
+
+def record_resolved_url(song, url, source, meta=None):
+    """Guardar a URL de onde a música foi baixada com sucesso"""
+    if not url or not url.startswith(('http://', 'https://')):
+        return
+    entry = {'url': url, 'source': source, 'song': song, 'updated_at': time.time()}
+    with resolved_urls['lock']:
+        entries = store_entries(resolved_urls)
+        for key in track_index_keys(song, meta):
+            entries[key] = entry
+        resolved_urls['dirty'] = True
+    flush_store(resolved_urls)
+
+def forget_resolved_url(song, url, meta=None):
+    """Remover a URL do índice (vídeo removido, bloqueado etc.)"""
+    with resolved_urls['lock']:
+        entries = store_entries(resolved_urls)
+        for key in track_index_keys(song, meta):
+            if entries.get(key, {}).get('url') == url:
+                del entries[key]
+                resolved_urls['dirty'] = True
+    flush_store(resolved_urls)
+
+def track_meta(job, song):
+    """Identificadores do Spotify da música no job (se a resolução os trouxe)"""
+    if job is None:
+        return None
+    return job['track_meta'].get(normalize_track_key(song))
+
+def load_track_meta(job, save_file):
+    """Preencher job['track_meta'] com id e ISRC das entradas do .spotdl"""
+    if not save_file or not os.path.exists(save_file):
+        return
+    try:
+        with open(save_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Não foi possível ler metadados de {save_file}: {e}")
+        return
+    for entry in entries:
+        for song in songs_from_spotdl_data([entry]):
+            job['track_meta'][normalize_track_key(song)] = {
+                'id': entry.get('song_id'), 'isrc': entry.get('isrc')}
+
+def parse_printed_url(stdout):
+    """Extrair a URL impressa por `yt-dlp --print after_move:webpage_url`"""
+    for line in (stdout or '').strip().split('\n'):
+        line = line.strip()
+        if line.startswith(('http://', 'https://')):
+            return line
+    return None
+
+def tool_failure_reason(result):
+    """Resumo curto do motivo de falha de uma execução do yt-dlp"""
+    if result.returncode == 0:
+        return 'nenhum arquivo produzido'
+    last_line = (result.stderr or result.stdout or '').strip().split('\n')[-1]
+    return f"código {result.returncode}: {last_line[:150]}"
+
+# URLs aceitas: playlist, álbum e música avulsa do Spotify, em open.spotify.com
+# (com /intl-xx/, /embed/ e ?si=...) ou como URI spotify:<tipo>:<id>
+SPOTIFY_URL_RE = re.compile(
+    r'^(?:https?://(?:open|play)\.spotify\.com/(?:intl-[\w-]+/)?(?:embed/)?|spotify:)'
+    r'(playlist|album|track)[/:]([A-Za-z0-9]+)')
+SPOTIFY_KIND_LABELS = {'playlist': 'playlist', 'album': 'álbum', 'track': 'música'}
+
+def parse_spotify_url(url):
+    """Tipo ('playlist', 'album' ou 'track') e ID de uma URL do Spotify
+    
+    Retorna (None, None) para URLs que não são de nenhum desses tipos.
+    """
+    match = SPOTIFY_URL_RE.match((url or '').strip())
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
 def get_spotify_access_token():
     """Obter token de acesso do Spotify usando Client Credentials"""
     global spotify_token
     
     try:
-        import time
-        
         # Verificar se as credenciais estão configuradas
         if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
             print("⚠️ Credenciais do Spotify não configuradas. Use variáveis de ambiente SPOTIFY_CLIENT_ID e SPOTIFY_CLIENT_SECRET")
@@ -63,7 +1128,7 @@ def get_spotify_access_token():
         auth_base64 = base64.b64encode(auth_bytes).decode('utf-8')
         
         # Fazer requisição para obter token
-        url = "https://accounts.spotify.com/api/token"
+        url = f"{SPOTIFY_ACCOUNTS_URL}/api/token"
         headers = {
             'Authorization': f'Basic {auth_base64}',
             'Content-Type': 'application/x-www-form-urlencoded'
@@ -109,7 +1174,7 @@ def get_spotify_playlist_official(playlist_id):
         }
         
         # Obter informações básicas da playlist
-        playlist_url = f"https://api.spotify.com/v1/playlists/{playlist_id}"
+        playlist_url = f"{SPOTIFY_API_URL}/v1/playlists/{playlist_id}"
         response = requests.get(playlist_url, headers=headers, timeout=15)
         
         if response.status_code != 200:
@@ -129,7 +1194,7 @@ def get_spotify_playlist_official(playlist_id):
         limit = 50  # Máximo por requisição
         
         while True:
-            tracks_url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
+            tracks_url = f"{SPOTIFY_API_URL}/v1/playlists/{playlist_id}/tracks"
             params = {
                 'offset': offset,
                 'limit': limit,
@@ -181,19 +1246,92 @@ def get_spotify_playlist_official(playlist_id):
         print(f"❌ Erro na API oficial: {e}")
         return None, []
 
+def get_spotify_album_official(album_id):
+    """Obter álbum completo usando API oficial do Spotify"""
+    try:
+        access_token = get_spotify_access_token()
+        if not access_token:
+            print("⚠️ Sem token de acesso, pulando API oficial")
+            return None, []
+        
+        print(f"🔍 Obtendo álbum oficial: {album_id}")
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
+        
+        response = requests.get(f"{SPOTIFY_API_URL}/v1/albums/{album_id}", headers=headers, timeout=15)
+        if response.status_code != 200:
+            print(f"❌ Erro ao obter álbum: {response.status_code}")
+            return None, []
+        
+        album_data = response.json()
+        album_name = album_data.get('name', 'Álbum')
+        # A primeira página das faixas vem junto com o álbum; as demais via 'next'
+        page = album_data.get('tracks', {})
+        all_songs = []
+        while True:
+            for track in page.get('items', []):
+                artist_names = [artist.get('name', '') for artist in track.get('artists', []) if artist.get('name')]
+                if track.get('name') and artist_names:
+                    all_songs.append(f"{' & '.join(artist_names)} - {track['name']}")
+            
+            next_url = page.get('next')
+            if not next_url:
+                break
+            response = requests.get(next_url, headers=headers, timeout=15)
+            if response.status_code != 200:
+                print(f"❌ Erro ao obter faixas do álbum: {response.status_code}")
+                break
+            page = response.json()
+        
+        print(f"✅ Álbum: {album_name} ({len(all_songs)} músicas)")
+        return album_name, all_songs
+        
+    except Exception as e:
+        print(f"❌ Erro na API oficial: {e}")
+        return None, []
+
+def get_spotify_track_official(track_id):
+    """Obter uma música avulsa usando API oficial do Spotify"""
+    try:
+        access_token = get_spotify_access_token()
+        if not access_token:
+            print("⚠️ Sem token de acesso, pulando API oficial")
+            return None, []
+        
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
+        response = requests.get(f"{SPOTIFY_API_URL}/v1/tracks/{track_id}", headers=headers, timeout=15)
+        if response.status_code != 200:
+            print(f"❌ Erro ao obter música: {response.status_code}")
+            return None, []
+        
+        track = response.json()
+        artist_names = [artist.get('name', '') for artist in track.get('artists', []) if artist.get('name')]
+        if not track.get('name') or not artist_names:
+            return None, []
+        song_title = f"{' & '.join(artist_names)} - {track['name']}"
+        print(f"✅ Música: {song_title}")
+        return song_title, [song_title]
+        
+    except Exception as e:
+        print(f"❌ Erro na API oficial: {e}")
+        return None, []
+
 def get_all_songs_spotdl_enhanced(playlist_url):
     """Usar SpotDL de forma mais robusta para extrair TODAS as músicas"""
     try:
-        playlist_id = playlist_url.split('/')[-1].split('?')[0]
+        playlist_id = parse_spotify_url(playlist_url)[1]
         print(f"🔄 Usando SpotDL aprimorado para extrair TODAS as músicas...")
         
-        # Comando SpotDL mais robusto - usar caminho compatível com Windows
-        import tempfile
-        temp_dir = tempfile.gettempdir()
-        temp_file = os.path.join(temp_dir, f'playlist_{playlist_id}.spotdl')
+        # Nome único na área de trabalho (outro job da mesma playlist não colide)
+        temp_file = spotdl_save_path('playlist', playlist_id)
         
         list_cmd = [
-            'spotdl',
+            *SPOTDL_CMD,
             playlist_url,
             '--save-file', temp_file,
             '--print-errors'
@@ -203,7 +1341,7 @@ def get_all_songs_spotdl_enhanced(playlist_url):
         print(f"🎵 Executando: {' '.join(list_cmd)}")
         
         # Executar com timeout menor mas múltiplas tentativas
-        result = subprocess.run(list_cmd, capture_output=True, text=True, timeout=120)
+        result = run_tool(list_cmd, 120)
         
         print(f"📊 SpotDL retornou código: {result.returncode}")
         if result.stdout:
@@ -273,7 +1411,7 @@ def get_all_songs_spotdl_enhanced(playlist_url):
 def get_playlist_name_from_url(playlist_url):
     """Obter nome da playlist do Spotify usando métodos avançados"""
     try:
-        playlist_id = playlist_url.split('/')[-1].split('?')[0]
+        playlist_id = parse_spotify_url(playlist_url)[1]
         
         # Tentar oEmbed primeiro (mais confiável)
         playlist_name, _ = get_spotify_tracks_oembed(playlist_id)
@@ -314,7 +1452,7 @@ def get_spotify_tracks_oembed(playlist_id):
         print(f"🔍 Tentando oEmbed para playlist: {playlist_id}")
         
         # oEmbed endpoint
-        oembed_url = f"https://open.spotify.com/oembed?url=https://open.spotify.com/playlist/{playlist_id}"
+        oembed_url = f"{SPOTIFY_WEB_URL}/oembed?url=https://open.spotify.com/playlist/{playlist_id}"
         
         response = requests.get(oembed_url, timeout=10)
         
@@ -454,13 +1592,13 @@ def extract_songs_aggressive(html_content):
 def get_spotify_tracks_web(playlist_url):
     """Extrair músicas via web scraping avançado"""
     try:
-        playlist_id = playlist_url.split('/')[-1].split('?')[0]
+        playlist_id = parse_spotify_url(playlist_url)[1]
         print(f"🔍 Tentando web scraping para playlist: {playlist_id}")
         
         # Tentar diferentes URLs
         urls = [
-            f"https://open.spotify.com/playlist/{playlist_id}",
-            f"https://open.spotify.com/embed/playlist/{playlist_id}",
+            f"{SPOTIFY_WEB_URL}/playlist/{playlist_id}",
+            f"{SPOTIFY_WEB_URL}/embed/playlist/{playlist_id}",
         ]
         
         headers = {
@@ -513,70 +1651,202 @@ def get_spotify_tracks_web(playlist_url):
     
     return None, []
 
-def extract_songs_from_json(data):
-    """Extrair músicas de estrutura JSON"""
-    songs = []
+# Chaves por onde as músicas são procuradas nos JSON embutidos das páginas
+TRACK_CONTAINER_KEYS = frozenset(['tracks', 'items', 'track', 'entities', 'playlists'])
+
+def playlist_name_candidate(name):
+    """Nome plausível de playlist (descarta nomes curtos, do Spotify e URLs)"""
+    return isinstance(name, str) and len(name) > 3 and 'Spotify' not in name and not name.startswith('http')
+
+def song_from_track(name, artists):
+    """'Artista & Artista - Música' a partir de um objeto de música, ou None"""
+    if not isinstance(name, str) or not name or not artists or not isinstance(artists, list):
+        return None
+    artist_names = []
+    for artist in artists:
+        if isinstance(artist, dict) and isinstance(artist.get('name'), str):
+            artist_names.append(artist['name'])
+        elif isinstance(artist, str):
+            artist_names.append(artist)
+    if not artist_names:
+        return None
+    return f"{' & '.join(artist_names)} - {name}"
+
+def extract_playlist_data(data):
+    """Nome da playlist e músicas de uma estrutura JSON, numa única passada
     
-    def search_tracks(obj, path=""):
+    Percurso iterativo (pilha explícita, sem recursão) em pré-ordem: o nome é
+    o primeiro 'name' plausível em qualquer lugar da árvore e as músicas são
+    os objetos com 'name' e 'artists' alcançados só por TRACK_CONTAINER_KEYS.
+    """
+    playlist_name = None
+    songs = []
+    seen = set()
+    # (objeto, alcançado só por chaves de música?)
+    stack = [(data, True)]
+    while stack:
+        obj, on_track_path = stack.pop()
+        if not on_track_path and playlist_name is not None:
+            # Fora do caminho das músicas e com o nome já achado: nada a ver aqui
+            continue
         if isinstance(obj, dict):
-            # Procurar por estruturas de track
-            if 'name' in obj and 'artists' in obj:
-                name = obj.get('name', '')
-                artists = obj.get('artists', [])
-                
-                if name and artists:
-                    artist_names = []
-                    for artist in artists:
-                        if isinstance(artist, dict) and 'name' in artist:
-                            artist_names.append(artist['name'])
-                        elif isinstance(artist, str):
-                            artist_names.append(artist)
-                    
-                    if artist_names:
-                        song_title = f"{' & '.join(artist_names)} - {name}"
-                        if song_title not in songs:
-                            songs.append(song_title)
-            
-            # Continuar procurando recursivamente
-            for key, value in obj.items():
-                if key in ['tracks', 'items', 'track', 'entities', 'playlists']:
-                    search_tracks(value, f"{path}.{key}")
-        
+            name = obj.get('name')
+            if playlist_name is None and playlist_name_candidate(name):
+                playlist_name = name
+            if on_track_path and 'artists' in obj:
+                song = song_from_track(name, obj['artists'])
+                if song and song not in seen:
+                    seen.add(song)
+                    songs.append(song)
+            # Invertido: a pilha devolve os filhos na ordem original (pré-ordem)
+            for key, value in reversed(list(obj.items())):
+                if isinstance(value, (dict, list)):
+                    stack.append((value, on_track_path and key in TRACK_CONTAINER_KEYS))
         elif isinstance(obj, list):
-            for item in obj:
-                search_tracks(item, path)
-    
-    search_tracks(data)
-    return songs
+            for value in reversed(obj):
+                if isinstance(value, (dict, list)):
+                    stack.append((value, on_track_path))
+    return playlist_name, songs
+
+def extract_songs_from_json(data):
+    """Extrair músicas de estrutura JSON"""
+    return extract_playlist_data(data)[1]
 
 def extract_playlist_name(data):
     """Extrair nome da playlist de estrutura JSON"""
-    def search_name(obj):
-        if isinstance(obj, dict):
-            if 'name' in obj and isinstance(obj['name'], str):
-                name = obj['name']
-                # Filtrar nomes que não são de playlist
-                if len(name) > 3 and 'Spotify' not in name and not name.startswith('http'):
-                    return name
-            
-            for value in obj.values():
-                result = search_name(value)
-                if result:
-                    return result
+    return extract_playlist_data(data)[0]
+
+# Tokens JSON para a leitura incremental (espaços à esquerda são pulados)
+_JSON_TOKEN_RE = re.compile(
+    r'\s*(?:([{}\[\],:])|("(?:[^"\\]|\\.)*")|(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?|true|false|null))')
+
+def _json_string(token):
+    # Sem escapes (o caso comum) não precisa passar pelo decodificador
+    return token[1:-1] if '\\' not in token else json.loads(token)
+
+def stream_playlist_data(text, pos=0):
+    """Mesmo resultado de extract_playlist_data, lendo o JSON direto do texto
+    
+    O valor que começa em text[pos:] é percorrido token a token sem montar a
+    árvore: por objeto aberto só ficam o 'name' e os artistas, então um blob
+    de vários MB não vira centenas de milhares de dicts em memória. Retorna
+    (nome, músicas, posição logo após o valor).
+    """
+    stack = []
+    counter = 0
+    best_name = None
+    found = []
+    key = None
+    expect_key = False
+    
+    def scalar(value):
+        top = stack[-1]
+        if top['map']:
+            if key == 'name':
+                top['name'] = value
+        elif top['artists_of'] is not None and isinstance(value, str):
+            top['artists_of']['artists'].append(value)
+    
+    while True:
+        match = _JSON_TOKEN_RE.match(text, pos)
+        if not match:
+            raise ValueError(f'JSON inválido na posição {pos}')
+        pos = match.end()
+        punct, string, literal = match.groups()
         
-        elif isinstance(obj, list):
-            for item in obj:
-                result = search_name(item)
-                if result:
-                    return result
+        if string is not None:
+            if expect_key:
+                key = _json_string(string)
+                expect_key = False
+            elif not stack:
+                return None, [], pos
+            else:
+                scalar(_json_string(string))
+        elif literal is not None:
+            if not stack:
+                return None, [], pos
+            scalar(json.loads(literal))
+        elif punct in '{[':
+            parent = stack[-1] if stack else None
+            if parent is None:
+                on_track_path = True
+            elif parent['map']:
+                on_track_path = parent['path'] and key in TRACK_CONTAINER_KEYS
+            else:
+                on_track_path = parent['path']
+            if punct == '{':
+                stack.append({'map': True, 'index': counter, 'path': on_track_path,
+                              'name': None, 'artists': None, 'key': key})
+                counter += 1
+                expect_key = True
+            else:
+                artists_of = parent if parent is not None and parent['map'] and key == 'artists' else None
+                if artists_of is not None:
+                    artists_of['artists'] = []
+                stack.append({'map': False, 'path': on_track_path, 'artists_of': artists_of, 'key': key})
+        elif punct in '}]':
+            frame = stack.pop()
+            key = frame['key']
+            if frame['map']:
+                name = frame['name']
+                if playlist_name_candidate(name) and (best_name is None or frame['index'] < best_name[0]):
+                    best_name = (frame['index'], name)
+                if frame['path'] and frame['artists']:
+                    song = song_from_track(name, frame['artists'])
+                    if song:
+                        found.append((frame['index'], song))
+                # Artista como objeto: só o nome interessa à música que o contém
+                parent = stack[-1] if stack else None
+                if parent is not None and not parent['map'] and parent['artists_of'] is not None \
+                        and isinstance(name, str):
+                    parent['artists_of']['artists'].append(name)
+            if not stack:
+                break
+        elif punct == ',':
+            expect_key = stack[-1]['map']
+    
+    # Pré-ordem, como no percurso da árvore (objetos fecham depois dos filhos)
+    songs = []
+    seen = set()
+    for _, song in sorted(found):
+        if song not in seen:
+            seen.add(song)
+            songs.append(song)
+    return (best_name[1] if best_name else None), songs, pos
+
+# Onde começam os JSON embutidos nas páginas: __NEXT_DATA__, Spotify.Entity,
+# estados iniciais e, por último, objetos "tracks"/listas "items" soltos
+EMBEDDED_JSON_ANCHORS = [
+    re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>'),
+    re.compile(r'Spotify\.Entity\s*=\s*'),
+    re.compile(r'window\.__INITIAL_STATE__\s*=\s*'),
+    re.compile(r'window\.__NEXT_DATA__\s*=\s*'),
+    re.compile(r'"tracks":\s*(?=\{)'),
+    re.compile(r'"items":\s*(?=\[)'),
+]
+_WHITESPACE_RE = re.compile(r'\s*')
+_json_decoder = json.JSONDecoder()
+
+def extract_embedded_json(text, pos):
+    """Nome, músicas e fim do valor JSON que começa em text[pos:]
     
-    return search_name(data)
+    O valor é lido direto do texto da página (raw_decode), sem copiar o
+    trecho; páginas maiores que WEB_SCRAPING_STREAM_BYTES usam a leitura
+    incremental. Levanta ValueError se não houver JSON válido ali.
+    """
+    pos = _WHITESPACE_RE.match(text, pos).end()
+    if WEB_SCRAPING_STREAM_BYTES and len(text) - pos > WEB_SCRAPING_STREAM_BYTES:
+        return stream_playlist_data(text, pos)
+    data, end = _json_decoder.raw_decode(text, pos)
+    name, songs = extract_playlist_data(data)
+    return name, songs, end
 
 def get_playlist_fast_web_scraping(playlist_url):
     """Extrair músicas rapidamente via web scraping direto (MUITO MAIS RÁPIDO que SpotDL)"""
     try:
-        playlist_id = playlist_url.split('/')[-1].split('?')[0]
-        print(f"⚡ Extração rápida via web scraping para: {playlist_id}")
+        kind, playlist_id = parse_spotify_url(playlist_url)
+        kind = kind or 'playlist'
+        print(f"⚡ Extração rápida via web scraping para {SPOTIFY_KIND_LABELS[kind]}: {playlist_id}")
         
         # Headers para simular navegador
         headers = {
@@ -591,8 +1861,8 @@ def get_playlist_fast_web_scraping(playlist_url):
         
         # Tentar múltiplas URLs (embed às vezes tem dados mais acessíveis)
         urls_to_try = [
-            f"https://open.spotify.com/embed/playlist/{playlist_id}",
-            f"https://open.spotify.com/playlist/{playlist_id}",
+            f"{SPOTIFY_WEB_URL}/embed/{kind}/{playlist_id}",
+            f"{SPOTIFY_WEB_URL}/{kind}/{playlist_id}",
         ]
         
         songs = []
@@ -612,39 +1882,23 @@ def get_playlist_fast_web_scraping(playlist_url):
                 
                 # Procurar por dados JSON embutidos no HTML
                 # Spotify usa vários padrões: __NEXT_DATA__, Spotify.Entity, etc.
-                json_patterns = [
-                    r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>',
-                    r'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>',
-                    r'Spotify\.Entity\s*=\s*({.*?});',
-                    r'window\.__INITIAL_STATE__\s*=\s*({.*?});',
-                    r'window\.__NEXT_DATA__\s*=\s*({.*?});',
-                    r'"tracks":\s*({.*?})',
-                    r'"items":\s*\[(.*?)\]',
-                ]
-                
-                for pattern in json_patterns:
-                    matches = re.findall(pattern, html_content, re.DOTALL)
-                    for match in matches:
-                        try:
-                            # Limpar o match se necessário
-                            match_clean = match.strip()
-                            if not match_clean or len(match_clean) < 10:
-                                continue
-                                
-                            data = json.loads(match_clean)
-                            # Procurar por tracks na estrutura
-                            found_songs = extract_songs_from_json(data)
-                            if found_songs:
-                                songs = found_songs
-                                # Tentar extrair nome da playlist
-                                playlist_name = extract_playlist_name(data) or playlist_name
-                                print(f"✅ Web scraping extraiu {len(songs)} músicas em <1 segundo!")
-                                return playlist_name, songs
-                        except json.JSONDecodeError as e:
-                            # Tentar extrair JSON parcialmente se falhar
+                # Cada blob é lido uma vez só: trechos dentro de um blob já lido
+                # (os "tracks"/"items" dele) não são decodificados de novo
+                parsed_spans = []
+                for anchor in EMBEDDED_JSON_ANCHORS:
+                    for match in anchor.finditer(html_content):
+                        if any(start <= match.start() < end for start, end in parsed_spans):
                             continue
-                        except Exception as e:
+                        try:
+                            found_name, found_songs, end = extract_embedded_json(html_content, match.end())
+                        except ValueError:
                             continue
+                        parsed_spans.append((match.start(), end))
+                        if found_songs:
+                            songs = found_songs
+                            playlist_name = found_name or playlist_name
+                            print(f"✅ Web scraping extraiu {len(songs)} músicas em <1 segundo!")
+                            return playlist_name, songs
                 
                 # Método alternativo: procurar por padrões de texto no HTML
                 # Spotify renderiza as músicas no HTML
@@ -686,185 +1940,498 @@ def get_playlist_fast_web_scraping(playlist_url):
         
     except Exception as e:
         print(f"❌ Erro no web scraping rápido: {e}")
-        import traceback
         traceback.print_exc()
         return None, []
 
-def get_playlist_info_complete(playlist_url):
-    """Obter informações completas da playlist usando múltiplos métodos (OTIMIZADO PARA VELOCIDADE)"""
-    try:
-        playlist_id = playlist_url.split('/')[-1].split('?')[0]
-        print(f"🔍 Playlist ID: {playlist_id}")
-        
-        # Obter nome da playlist via oEmbed (sempre funciona e é rápido)
-        playlist_name = "Playlist"
-        try:
-            oembed_url = f"https://open.spotify.com/oembed?url=https://open.spotify.com/playlist/{playlist_id}"
-            response = requests.get(oembed_url, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                playlist_name = data.get('title', 'Playlist')
-                print(f"✅ Nome da playlist: {playlist_name}")
-        except Exception as e:
-            print(f"⚠️ Erro ao obter nome via oEmbed: {e}")
-        
-        # MÉTODO 1: Web scraping rápido (PRIMEIRA OPÇÃO - MUITO RÁPIDO)
-        # Nota: Pode falhar se Spotify usar JavaScript pesado, mas vale tentar primeiro
-        print("⚡ Tentando extração rápida via web scraping...")
-        playlist_name_ws, songs_ws = get_playlist_fast_web_scraping(playlist_url)
-        if songs_ws:
-            print(f"✅ Web scraping extraiu {len(songs_ws)} músicas instantaneamente!")
-            return playlist_name_ws or playlist_name, songs_ws
-        else:
-            print("⚠️ Web scraping não funcionou (Spotify pode estar usando JavaScript dinâmico)")
-        
-        # MÉTODO 2: Tentar API oficial do Spotify (se credenciais disponíveis)
-        if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
-            print("🔍 Tentando API oficial do Spotify...")
-            playlist_name_api, songs_api = get_spotify_playlist_official(playlist_id)
-            if songs_api:
-                print(f"✅ API oficial extraiu {len(songs_api)} músicas!")
-                return playlist_name_api or playlist_name, songs_api
-        
-        # MÉTODO 3: SpotDL (método principal agora que web scraping falhou)
-        print("🎵 Usando SpotDL para extrair músicas da playlist...")
-        print("⏳ Isso pode levar 30-60 segundos para playlists pequenas, 2-3 minutos para grandes...")
-        
-        # Usar caminho compatível com Windows
-        import tempfile
-        temp_dir = tempfile.gettempdir()
-        temp_file = os.path.join(temp_dir, f'playlist_{playlist_id}.spotdl')
-        
-        # Comando SpotDL otimizado - usar --save-file para apenas listar (mais rápido)
-        cmd = [
-            'spotdl',
-            playlist_url,
-            '--save-file', temp_file,
-            '--print-errors'
-        ]
-        
-        print(f"🔄 Executando SpotDL para listar músicas: spotdl {playlist_url} --save-file [temp]")
-        
+class OperationCancelled(Exception):
+    """Operação interrompida porque outra estratégia/usuário a cancelou"""
+    pass
+
+# Saída de subprocessos: só as últimas linhas ficam em memória.
+# spotdl/yt-dlp podem imprimir dezenas de milhares de linhas (e barras de
+# progresso com \r) em playlists grandes; quem precisa de dados da saída
+# usa on_line para consumi-los enquanto o processo roda.
+OUTPUT_TAIL_LINES = int(os.environ.get('OUTPUT_TAIL_LINES', '200'))
+OUTPUT_MAX_LINE = 4096
+OUTPUT_CHUNK_SIZE = 64 * 1024
+_LINE_BREAK_RE = re.compile(rb'[\r\n]')
+
+def pump_output(stream, tail, on_line=None, label='processo', activity=None):
+    """Ler um pipe em blocos, quebrando em linhas (\\n ou \\r)
+    
+    Guarda apenas as últimas linhas em `tail` (deque com maxlen) e entrega
+    cada linha para on_line assim que ela chega. Com activity (dict), cada
+    bloco lido atualiza activity['last_output_at'].
+    """
+    pending = b''
+    
+    def emit(raw):
+        line = raw[:OUTPUT_MAX_LINE].decode('utf-8', errors='replace').strip()
+        if not line:
+            return
+        tail.append(line)
+        if on_line is not None:
+            try:
+                on_line(line)
+            except Exception as e:
+                print(f"⚠️ Erro ao processar saída de {label}: {e}")
+    
+    while True:
+        chunk = stream.read1(OUTPUT_CHUNK_SIZE)
+        if not chunk:
+            break
+        if activity is not None:
+            activity['last_output_at'] = time.time()
+        pending += chunk
+        parts = _LINE_BREAK_RE.split(pending)
+        pending = parts.pop()
+        # Linha sem quebra nenhuma (ex.: saída binária) não pode crescer sem limite
+        if len(pending) > OUTPUT_MAX_LINE:
+            pending = pending[:OUTPUT_MAX_LINE]
+        for raw in parts:
+            emit(raw)
+    
+    if pending:
+        emit(pending)
+    stream.close()
+
+# Processos externos em execução (pid -> info), para cancelamento e supervisão
+running_processes = {}
+running_processes_lock = threading.Lock()
+
+def kill_process_tree(proc):
+    """Encerrar o processo e todos os filhos dele (ex.: ffmpeg do spotdl)
+    
+    Cada ferramenta roda no próprio grupo de processos, então o grupo inteiro
+    recebe SIGTERM e, se não sair em KILL_GRACE_SECONDS, SIGKILL.
+    """
+    if os.name != 'posix':
+        proc.kill()
+        proc.wait()
+        return
+    
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass
+    try:
+        proc.wait(timeout=KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        pass
+    reap_process_group(proc)
+    proc.wait()
+
+def reap_process_group(proc):
+    """Matar o que restou do grupo de processos (filhos órfãos do líder)"""
+    if os.name != 'posix':
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def cancel_job(job):
+    """Cancelar o job: sinaliza as etapas e mata já os processos dele"""
+    job['cancel_event'].set()
+    job['status']['progress'] = '🛑 Cancelando download...'
+    
+    with running_processes_lock:
+        procs = [info['proc'] for info in running_processes.values()
+                 if info['job_id'] == job['id']]
+    for proc in procs:
         try:
-            # Timeout aumentado para playlists grandes
-            timeout_list = 180  # 3 minutos (SpotDL pode ser lento mas funciona)
-            
-            # Executar SpotDL
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_list)
-            
-            print(f"📊 SpotDL retornou código: {result.returncode}")
-            if result.stderr:
-                print(f"⚠️ SpotDL stderr: {result.stderr[:300]}")
-            if result.stdout:
-                print(f"📝 SpotDL stdout: {result.stdout[:300]}")
-            
-            print(f"📊 SpotDL código: {result.returncode}")
-            
-            if os.path.exists(temp_file):
-                with open(temp_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    
-                try:
-                    playlist_data = json.loads(content)
-                    
-                    songs = []
-                    for song_data in playlist_data:
-                        if isinstance(song_data, dict):
-                            name = song_data.get('name', '')
-                            artists = song_data.get('artists', [])
-                            
-                            if name and artists:
-                                artist_names = []
-                                for artist in artists:
-                                    if isinstance(artist, dict):
-                                        artist_names.append(artist.get('name', ''))
-                                    elif isinstance(artist, str):
-                                        artist_names.append(artist)
-                                
-                                if artist_names:
-                                    song_title = f"{' & '.join(artist_names)} - {name}"
-                                    songs.append(song_title)
-                    
-                    os.remove(temp_file)
-                    
-                    if songs:
-                        print(f"✅ SpotDL extraiu {len(songs)} músicas!")
-                        return playlist_name, songs
-                        
-                except json.JSONDecodeError:
-                    print("❌ Arquivo SpotDL não é JSON válido")
-            
-        except subprocess.TimeoutExpired:
-            print("⏰ SpotDL timeout após 3 minutos")
-            print("💡 Playlist pode ser muito grande ou SpotDL está lento")
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
+            kill_process_tree(proc)
         except Exception as e:
-            print(f"❌ Erro SpotDL: {e}")
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
-        
-        # Tentar método alternativo: usar spotdl para listar músicas (sem --preload para ser mais rápido)
-        print("🔄 Tentando método alternativo do SpotDL (--list)...")
-        try:
-            cmd_list = [
-                'spotdl',
-                playlist_url,
-                '--list'
-                # Removido --preload para ser mais rápido
-            ]
-            
-            print(f"🔄 Executando: {' '.join(cmd_list)}")
-            result_list = subprocess.run(cmd_list, capture_output=True, text=True, timeout=180)
+            print(f"⚠️ Erro ao encerrar processo {proc.pid}: {e}")
+
+def run_tool(cmd, timeout, cancel_event=None, on_line=None, merge_stderr=False,
+             tail_lines=OUTPUT_TAIL_LINES, job=None):
+    """Executar comando externo com timeout, cancelamento e memória limitada
+    
+    on_line recebe cada linha do stdout (e do stderr, se merge_stderr=True)
+    enquanto o processo roda. O CompletedProcess retornado traz apenas as
+    últimas `tail_lines` linhas de cada saída.
+    
+    Com job, o processo fica registrado no job e é encerrado (com toda a
+    árvore de processos) quando o job é cancelado.
+    """
+    if job is not None and cancel_event is None:
+        cancel_event = job['cancel_event']
+    if cancel_event is not None and cancel_event.is_set():
+        raise OperationCancelled(f"{os.path.basename(cmd[0])} cancelado")
+    
+    proc = subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+        # Grupo próprio: timeout/cancelamento alcançam também os filhos
+        start_new_session=(os.name == 'posix')
+    )
+    label = os.path.basename(cmd[0])
+    started_at = time.time()
+    info = {
+        'proc': proc,
+        'job_id': job['id'] if job is not None else None,
+        'cmd': label,
+        'started_at': started_at,
+        'last_output_at': started_at
+    }
+    with running_processes_lock:
+        running_processes[proc.pid] = info
+    out_tail = deque(maxlen=tail_lines)
+    err_tail = deque(maxlen=tail_lines)
+    
+    readers = [threading.Thread(target=pump_output, args=(proc.stdout, out_tail, on_line, label, info),
+                                daemon=True)]
+    if not merge_stderr:
+        readers.append(threading.Thread(target=pump_output, args=(proc.stderr, err_tail, None, label, info),
+                                        daemon=True))
+    for reader in readers:
+        reader.start()
+    deadline = time.monotonic() + timeout
+    
+    try:
+        while True:
+            try:
+                proc.wait(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise OperationCancelled(f"{label} cancelado")
+                if time.monotonic() >= deadline:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+        # Líder terminou: filhos que ficaram para trás não sobrevivem a ele
+        reap_process_group(proc)
+    except BaseException:
+        kill_process_tree(proc)
+        raise
+    finally:
+        with running_processes_lock:
+            running_processes.pop(proc.pid, None)
+        for reader in readers:
+            reader.join(timeout=5)
+    
+    if cancel_event is not None and cancel_event.is_set():
+        # Processo morto pelo cancel_job enquanto esperávamos
+        raise OperationCancelled(f"{label} cancelado")
+    return subprocess.CompletedProcess(cmd, proc.returncode, '\n'.join(out_tail), '\n'.join(err_tail))
+
+def songs_from_spotdl_data(playlist_data):
+    """Converter o conteúdo de um arquivo .spotdl em lista 'Artista - Música'"""
+    songs = []
+    for song_data in playlist_data:
+        if isinstance(song_data, dict):
+            name = song_data.get('name', '')
+            artists = song_data.get('artists', [])
             
-            if result_list.returncode == 0 and result_list.stdout:
-                # Parsear saída do spotdl --list
-                lines = result_list.stdout.strip().split('\n')
-                songs = []
+            if name and artists:
+                artist_names = []
+                for artist in artists:
+                    if isinstance(artist, dict):
+                        artist_names.append(artist.get('name', ''))
+                    elif isinstance(artist, str):
+                        artist_names.append(artist)
                 
-                for line in lines:
-                    line = line.strip()
-                    if line and ' - ' in line:
-                        # Formato esperado: "Artista - Nome da Música"
-                        songs.append(line)
-                
-                if songs:
-                    print(f"✅ SpotDL (--list) extraiu {len(songs)} músicas!")
-                    return playlist_name, songs
-            else:
-                print(f"⚠️ SpotDL --list retornou código {result_list.returncode}")
-                if result_list.stderr:
-                    print(f"Erro: {result_list.stderr[:200]}")
-        except Exception as e:
-            print(f"❌ Erro no método alternativo: {e}")
+                if artist_names:
+                    songs.append(f"{' & '.join(artist_names)} - {name}")
+    return songs
+
+def list_songs_spotdl_savefile(playlist_url, cancel_event=None, keep_file=False):
+    """Listar músicas com `spotdl --save-file` (lento, mas confiável)
+    
+    Com keep_file=True o arquivo .spotdl é preservado e retornado junto com a
+    lista, para que o download use os metadados já resolvidos.
+    """
+    kind, playlist_id = parse_spotify_url(playlist_url)
+    
+    # Nome único na área de trabalho (outro job da mesma playlist não colide)
+    temp_file = spotdl_save_path(kind, playlist_id)
+    
+    # Comando SpotDL otimizado - usar --save-file para apenas listar (mais rápido)
+    cmd = [
+        *SPOTDL_CMD,
+        playlist_url,
+        '--save-file', temp_file,
+        '--print-errors'
+    ]
+    
+    print(f"🔄 Executando SpotDL para listar músicas: spotdl {playlist_url} --save-file [temp]")
+    
+    saved_file = None
+    try:
+        # Timeout aumentado para playlists grandes
+        result = run_tool(cmd, SPOTDL_LIST_TIMEOUT, cancel_event)
         
-        # Se todos os métodos falharam, retornar erro
-        print(f"❌ Não foi possível extrair músicas da playlist '{playlist_name}'")
-        print("💡 Possíveis soluções:")
-        print("   1. Verifique se a playlist é pública no Spotify")
-        print("   2. Verifique se o SpotDL está instalado: pip install spotdl")
-        print("   3. Verifique se a URL da playlist está correta")
-        print("   4. Para playlists grandes, pode demorar mais (tente novamente)")
-        print("   5. Configure credenciais do Spotify (SPOTIFY_CLIENT_ID e SPOTIFY_CLIENT_SECRET) para método mais rápido")
+        print(f"📊 SpotDL retornou código: {result.returncode}")
+        if result.stderr:
+            print(f"⚠️ SpotDL stderr: {result.stderr[:300]}")
+        if result.stdout:
+            print(f"📝 SpotDL stdout: {result.stdout[:300]}")
         
-        return playlist_name, []
+        if os.path.exists(temp_file):
+            with open(temp_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+            
+            try:
+                songs = songs_from_spotdl_data(json.loads(content))
+                if songs:
+                    print(f"✅ SpotDL extraiu {len(songs)} músicas!")
+                    if keep_file:
+                        saved_file = temp_file
+                return (songs, saved_file) if keep_file else songs
+            except json.JSONDecodeError:
+                print("❌ Arquivo SpotDL não é JSON válido")
         
+        return ([], None) if keep_file else []
+    
+    except subprocess.TimeoutExpired:
+        print(f"⏰ SpotDL timeout após {SPOTDL_LIST_TIMEOUT}s")
+        print("💡 Playlist pode ser muito grande ou SpotDL está lento")
+        return ([], None) if keep_file else []
+    finally:
+        if temp_file != saved_file and os.path.exists(temp_file):
+            try:
+                os.remove(temp_file)
+            except:
+                pass
+
+def list_songs_spotdl_list(playlist_url, cancel_event=None):
+    """Listar músicas com `spotdl --list` (método alternativo do SpotDL)"""
+    cmd_list = [
+        *SPOTDL_CMD,
+        playlist_url,
+        '--list'
+    ]
+    
+    print(f"🔄 Executando: {' '.join(cmd_list)}")
+    songs = []
+    
+    def collect(line):
+        # Formato esperado: "Artista - Nome da Música"
+        if ' - ' in line:
+            songs.append(line)
+    
+    try:
+        result_list = run_tool(cmd_list, SPOTDL_LIST_TIMEOUT, cancel_event, on_line=collect)
+    except subprocess.TimeoutExpired:
+        print(f"⏰ SpotDL --list timeout após {SPOTDL_LIST_TIMEOUT}s")
+        return []
+    
+    if result_list.returncode == 0:
+        if songs:
+            print(f"✅ SpotDL (--list) extraiu {len(songs)} músicas!")
+        return songs
+    
+    print(f"⚠️ SpotDL --list retornou código {result_list.returncode}")
+    if result_list.stderr:
+        print(f"Erro: {result_list.stderr[:200]}")
+    return []
+
+def validate_songs(songs):
+    """Limpar e validar a lista de músicas retornada por uma estratégia"""
+    valid = []
+    seen = set()
+    for song in songs or []:
+        if not isinstance(song, str):
+            continue
+        song = song.strip()
+        # Toda entrada útil tem o formato "Artista - Música"
+        if ' - ' not in song or len(song) < 5 or len(song) > 300:
+            continue
+        if song in seen:
+            continue
+        seen.add(song)
+        valid.append(song)
+    return valid
+
+def _strategy_web(playlist_url, playlist_id, cancel_event):
+    name, songs = get_playlist_fast_web_scraping(playlist_url)
+    # Páginas públicas truncam playlists longas: resultado no limite é parcial
+    partial = len(songs) >= WEB_SCRAPING_CAP
+    return {'name': name, 'songs': songs, 'partial': partial}
+
+def _strategy_api(playlist_url, playlist_id, cancel_event):
+    official = {
+        'playlist': get_spotify_playlist_official,
+        'album': get_spotify_album_official,
+        'track': get_spotify_track_official,
+    }[parse_spotify_url(playlist_url)[0] or 'playlist']
+    name, songs = official(playlist_id)
+    return {'name': name, 'songs': songs}
+
+def _strategy_spotdl(playlist_url, playlist_id, cancel_event):
+    songs, save_file = list_songs_spotdl_savefile(playlist_url, cancel_event, keep_file=True)
+    if save_file and cancel_event.is_set():
+        # Outra estratégia venceu enquanto o SpotDL terminava
+        discard_save_file(save_file)
+        raise OperationCancelled("spotdl cancelado")
+    if not songs:
+        if cancel_event.is_set():
+            raise OperationCancelled("spotdl cancelado")
+        print("🔄 Tentando método alternativo do SpotDL (--list)...")
+        songs = list_songs_spotdl_list(playlist_url, cancel_event)
+    return {'name': None, 'songs': songs, 'save_file': save_file}
+
+def discard_save_file(save_file):
+    """Remover um arquivo .spotdl que não será usado no download"""
+    if save_file and os.path.exists(save_file):
+        try:
+            os.remove(save_file)
+        except OSError:
+            pass
+
+def _discard_losing_result(future):
+    """Callback para estratégias que terminam depois da corrida decidida"""
+    try:
+        discard_save_file(future.result().get('save_file'))
+    except Exception:
+        pass
+
+def get_playlist_name_oembed(playlist_id, timeout=5, kind='playlist'):
+    """Obter apenas o nome da playlist (ou do álbum/música) via oEmbed (rápido)"""
+    try:
+        oembed_url = f"{SPOTIFY_WEB_URL}/oembed?url=https://open.spotify.com/{kind}/{playlist_id}"
+        response = requests.get(oembed_url, timeout=timeout)
+        if response.status_code == 200:
+            playlist_name = response.json().get('title')
+            if playlist_name:
+                print(f"✅ Nome da playlist: {playlist_name}")
+            return playlist_name
     except Exception as e:
-        print(f"❌ Erro geral ao obter informações da playlist: {e}")
-        import traceback
-        traceback.print_exc()
-        return "Playlist", []
+        print(f"⚠️ Erro ao obter nome via oEmbed: {e}")
+    return None
 
-def download_song_multi_source(song_title, output_dir):
-    """Baixar música usando múltiplas fontes"""
+def resolve_playlist(playlist_url, job_cancel=None):
+    """Resolver a playlist com estratégias em corrida (primeiro resultado válido vence)
+    
+    Web scraping e API oficial começam juntos; o SpotDL (caro) só começa após
+    RESOLVER_HEDGE_DELAY segundos, ou antes disso se as estratégias baratas
+    falharem todas. O primeiro resultado completo e válido é aceito e as
+    demais estratégias são canceladas. job_cancel (evento do job) interrompe
+    a corrida inteira com OperationCancelled. Álbuns e músicas avulsas passam
+    pela mesma corrida (cada estratégia usa o endpoint do tipo da URL).
+    """
+    kind, playlist_id = parse_spotify_url(playlist_url)
+    kind = kind or 'playlist'
+    print(f"🔍 {SPOTIFY_KIND_LABELS[kind].capitalize()} ID: {playlist_id}")
+    
+    cancel_event = threading.Event()
+    hedge_event = threading.Event()
+    
+    cheap = [('web scraping', _strategy_web)]
+    if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+        cheap.append(('API oficial', _strategy_api))
+    
+    def run_strategy(name, func, hedged):
+        if hedged:
+            # Esperar o atraso de hedge (ou até as baratas falharem)
+            hedge_event.wait(RESOLVER_HEDGE_DELAY)
+            if cancel_event.is_set():
+                raise OperationCancelled(name)
+            print(f"🎵 Iniciando {name} especulativamente...")
+        return func(playlist_url, playlist_id, cancel_event)
+    
+    executor = ThreadPoolExecutor(max_workers=len(cheap) + 2, thread_name_prefix='resolver')
+    name_future = executor.submit(get_playlist_name_oembed, playlist_id, kind=kind)
+    futures = {executor.submit(run_strategy, name, func, False): name for name, func in cheap}
+    cheap_pending = set(futures)
+    futures[executor.submit(run_strategy, 'SpotDL', _strategy_spotdl, True)] = 'SpotDL'
+    
+    winner = None
+    fallback = None
+    deadline = time.monotonic() + RESOLVER_TIMEOUT
+    pending = set(futures)
+    
+    try:
+        while pending and winner is None:
+            if job_cancel is not None and job_cancel.is_set():
+                discard_save_file(fallback and fallback.get('save_file'))
+                raise OperationCancelled("resolução cancelada")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"⏰ Resolver excedeu {RESOLVER_TIMEOUT}s")
+                break
+            done, pending = wait(pending, timeout=min(remaining, 0.5), return_when=FIRST_COMPLETED)
+            for future in done:
+                strategy = futures[future]
+                cheap_pending.discard(future)
+                try:
+                    outcome = future.result()
+                except OperationCancelled:
+                    continue
+                except Exception as e:
+                    print(f"❌ Estratégia {strategy} falhou: {e}")
+                    continue
+                
+                songs = validate_songs(outcome.get('songs'))
+                if not songs:
+                    print(f"⚠️ {strategy} não retornou músicas válidas")
+                    discard_save_file(outcome.get('save_file'))
+                    continue
+                
+                candidate = {
+                    'name': outcome.get('name'),
+                    'songs': songs,
+                    'source': strategy,
+                    'save_file': outcome.get('save_file')
+                }
+                if outcome.get('partial'):
+                    print(f"⚠️ {strategy} retornou lista possivelmente parcial ({len(songs)} músicas)")
+                    if not fallback or len(songs) > len(fallback['songs']):
+                        fallback = candidate
+                    continue
+                
+                winner = candidate
+                break
+            
+            if not cheap_pending:
+                # Estratégias baratas terminaram sem vencedor: liberar o SpotDL já
+                hedge_event.set()
+    finally:
+        cancel_event.set()
+        hedge_event.set()
+        # Estratégias perdedoras que ainda terminarem não podem deixar .spotdl órfão
+        for future in pending:
+            future.add_done_callback(_discard_losing_result)
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    result = winner or fallback
+    if winner and fallback:
+        discard_save_file(fallback.get('save_file'))
+    
+    playlist_name = None
+    try:
+        playlist_name = name_future.result(timeout=1)
+    except Exception:
+        pass
+    
+    if not result:
+        return {'name': playlist_name or "Playlist", 'songs': [], 'source': None, 'save_file': None}
+    
+    print(f"🏁 {result['source']} venceu a corrida com {len(result['songs'])} músicas")
+    result['name'] = playlist_name or result['name'] or "Playlist"
+    return result
+
+def manual_output_template(output_dir, song_title):
+    """Template de saída do yt-dlp com o nome da música ('Artista - Título', como o SpotDL)
+    
+    Os downloads do método manual gravam ao mesmo tempo na mesma pasta; com o
+    título do vídeo, duas músicas diferentes podiam sobrescrever uma à outra.
+    """
+    name = spotdl_sanitize(song_title).replace('%', '%%') or track_cache_name(song_title)
+    return os.path.join(output_dir, f'{name}.%(ext)s')
+
+def download_song_multi_source(song_title, output_dir, job=None, retry=False):
+    """Baixar música usando múltiplas fontes
+    
+    Retorna o caminho do arquivo baixado (impresso pelo yt-dlp) ou False.
+    Com retry=True (nova tentativa da fila) o cache negativo não pula a
+    música nem as fontes que acabaram de falhar.
+    """
     try:
         print(f"🎵 Baixando: {song_title}")
+        # Mesmo formato em todas as fontes: o do perfil do job
+        profile_args = fetch_args(job['profile'] if job else DEFAULT_PROFILE, 'ytdlp')
+        output_template = manual_output_template(output_dir, song_title)
         
         # Lista de fontes alternativas para tentar
         sources = [
@@ -872,12 +2439,12 @@ def download_song_multi_source(song_title, output_dir):
             {
                 'name': 'SoundCloud',
                 'cmd': [
-                    'yt-dlp',
+                    *YTDLP_CMD,
                     f'scsearch1:{song_title}',
-                    '--extract-audio',
-                    '--audio-format', 'mp3',
-                    '--audio-quality', '128K',
-                    '--output', f'{output_dir}/%(title)s.%(ext)s',
+                    *profile_args,
+                    '--output', output_template,
+                    '--print', 'after_move:webpage_url',
+                    '--print', 'after_move:filepath',
                     '--no-playlist',
                     '--quiet'
                 ]
@@ -886,12 +2453,12 @@ def download_song_multi_source(song_title, output_dir):
             {
                 'name': 'Bandcamp',
                 'cmd': [
-                    'yt-dlp',
+                    *YTDLP_CMD,
                     f'bcsearch1:{song_title}',
-                    '--extract-audio',
-                    '--audio-format', 'mp3',
-                    '--audio-quality', '128K',
-                    '--output', f'{output_dir}/%(title)s.%(ext)s',
+                    *profile_args,
+                    '--output', output_template,
+                    '--print', 'after_move:webpage_url',
+                    '--print', 'after_move:filepath',
                     '--no-playlist',
                     '--quiet'
                 ]
@@ -900,12 +2467,12 @@ def download_song_multi_source(song_title, output_dir):
             {
                 'name': 'YouTube (VPN)',
                 'cmd': [
-                    'yt-dlp',
+                    *YTDLP_CMD,
                     f'ytsearch1:{song_title} audio',
-                    '--extract-audio',
-                    '--audio-format', 'mp3',
-                    '--audio-quality', '96K',
-                    '--output', f'{output_dir}/%(title)s.%(ext)s',
+                    *profile_args,
+                    '--output', output_template,
+                    '--print', 'after_move:webpage_url',
+                    '--print', 'after_move:filepath',
                     '--no-playlist',
                     '--quiet',
                     '--geo-bypass',
@@ -915,297 +2482,1284 @@ def download_song_multi_source(song_title, output_dir):
             }
         ]
         
+        # Histórico da música: pular se nenhuma fonte encontrou, ou ir direto
+        # à fonte que funcionou, sem repetir as que já falharam
+        history = None if retry else negative_lookup(song_title)
+        if history and history['unfindable']:
+            print(f"🚫 Pulando (cache negativo): {song_title} - {history['failures']}")
+            return False
+        if history:
+            sources = ([source for source in sources if source['name'] == history['worked']] +
+                       [source for source in sources
+                        if source['name'] != history['worked'] and source['name'] not in history['failures']])
+        
+        # URL já conhecida (índice): baixar direto, sem nenhuma busca
+        direct = try_direct_download(song_title, output_dir, job)
+        if direct:
+            record_source_result(song_title, 'URL direta', True)
+            return direct
+        
         for source in sources:
             try:
                 print(f"🔄 Tentando {source['name']} para: {song_title}")
                 
-                result = subprocess.run(
-                    source['cmd'], 
-                    capture_output=True, 
-                    text=True, 
-                    timeout=120
-                )
+                result = run_tool(source['cmd'], 120, job=job)
                 
-                if result.returncode == 0:
+                file_path = parse_printed_filepath(result.stdout) if result.returncode == 0 else None
+                if file_path:
                     print(f"✅ Sucesso com {source['name']}: {song_title}")
-                    return True
-                else:
-                    print(f"❌ {source['name']} falhou: {result.stderr[:100]}")
+                    record_source_result(song_title, source['name'], True)
+                    record_resolved_url(song_title, parse_printed_url(result.stdout), source['name'],
+                                        track_meta(job, song_title))
+                    return file_path
+                print(f"❌ {source['name']} falhou para {song_title}: {tool_failure_reason(result)}")
+                record_source_result(song_title, source['name'], False, tool_failure_reason(result))
                     
             except subprocess.TimeoutExpired:
                 print(f"⏰ Timeout no {source['name']}")
+                record_source_result(song_title, source['name'], False, 'timeout')
                 continue
+            except OperationCancelled:
+                raise
             except Exception as e:
                 print(f"❌ Erro no {source['name']}: {e}")
                 continue
         
-        # Se todas as fontes falharam, tentar download direto de URL conhecida
-        print(f"🔄 Tentando download direto para: {song_title}")
-        return try_direct_download(song_title, output_dir)
-            
+        # Nenhuma fonte encontrou: próximos jobs pulam a música até expirar
+        mark_unfindable(song_title)
+        return False
+    
+    except OperationCancelled:
+        raise
     except Exception as e:
         print(f"❌ Erro geral: {song_title} - {e}")
         return False
 
-def try_direct_download(song_title, output_dir):
-    """Tentar download direto de URLs conhecidas"""
+def try_direct_download(song_title, output_dir, job=None):
+    """Baixar direto da URL registrada no índice para a música
+    
+    Retorna o caminho do arquivo, None se não há URL conhecida ou False se a
+    URL falhou (nesse caso ela sai do índice e a falha vai para o cache negativo).
+    """
+    meta = track_meta(job, song_title)
+    url = lookup_resolved_url(song_title, meta)
+    if not url:
+        return None
+    
     try:
-        # URLs diretas conhecidas para as músicas da playlist de teste
-        known_urls = {
-            "The Weeknd - Pray For Me": "https://www.youtube.com/watch?v=XR7Ev14vUh8",
-            "The Weeknd - I Was Never There": "https://www.youtube.com/watch?v=qFLhGq0060w", 
-            "Lil Peep - Falling Down": "https://www.youtube.com/watch?v=zOujzvtwZ6M"
-        }
+        print(f"🎯 Usando URL conhecida para: {song_title}")
         
-        if song_title in known_urls:
-            url = known_urls[song_title]
-            print(f"🎯 Usando URL direta para: {song_title}")
-            
-            cmd = [
-                'yt-dlp',
-                url,
-                '--extract-audio',
-                '--audio-format', 'mp3',
-                '--audio-quality', '96K',
-                '--output', f'{output_dir}/%(title)s.%(ext)s',
-                '--quiet',
-                '--ignore-errors'
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=180)
-            
-            if result.returncode == 0:
-                print(f"✅ Sucesso com URL direta: {song_title}")
-                return True
+        output_template = manual_output_template(output_dir, song_title)
+        cmd = [
+            *YTDLP_CMD,
+            url,
+            *fetch_args(job['profile'] if job else DEFAULT_PROFILE, 'ytdlp'),
+            '--output', output_template,
+            '--print', 'after_move:filepath',
+            '--no-playlist',
+            '--quiet',
+            '--ignore-errors'
+        ]
         
-        return False
+        result = run_tool(cmd, 180, job=job)
         
+        file_path = parse_printed_filepath(result.stdout)
+        if result.returncode == 0 and file_path:
+            print(f"✅ Sucesso com URL direta: {song_title}")
+            return file_path
+        reason = tool_failure_reason(result)
+        print(f"⚠️ URL conhecida falhou para {song_title}: {reason}")
+    
+    except subprocess.TimeoutExpired:
+        print(f"⏰ Timeout na URL direta: {song_title}")
+        reason = 'timeout'
+    except OperationCancelled:
+        raise
     except Exception as e:
         print(f"❌ Erro no download direto: {e}")
-        return False
+        reason = str(e)
+    
+    forget_resolved_url(song_title, url, meta)
+    record_source_result(song_title, 'URL direta', False, reason)
+    return False
+
+# Escalonador: fila por cliente (round-robin) com os jobs que têm trabalho pendente
+scheduler_cond = threading.Condition()
+scheduler_queues = OrderedDict()
+# Desde quando cada cliente com fila espera ser atendido (prioridade entre clientes)
+scheduler_client_since = {}
+scheduler_threads = []
+
+def enqueue_job(job):
+    """Pôr o job na fila do seu cliente, se ainda não estiver (com scheduler_cond adquirido)"""
+    if job['queued']:
+        return
+    job['queued'] = True
+    job['waiting_since'] = time.time()
+    if job['client'] not in scheduler_queues:
+        scheduler_queues[job['client']] = deque()
+        scheduler_client_since[job['client']] = job['waiting_since']
+    scheduler_queues[job['client']].append(job)
+
+def submit_units(job, units):
+    """Enfileirar unidades de trabalho (rótulo, função) de um job no escalonador"""
+    start_scheduler()
+    with scheduler_cond:
+        job['units'].extend(units)
+        job['pending_units'] += len(units)
+        enqueue_job(job)
+        scheduler_cond.notify_all()
+
+retry_sequence = itertools.count()
+
+def schedule_retry(job, unit, delay):
+    """Agendar uma unidade para daqui a `delay` segundos (fila de novas tentativas)
+    
+    A unidade já conta como pendente, então wait_for_units espera por ela.
+    """
+    with scheduler_cond:
+        heapq.heappush(job['retry_units'], (time.time() + delay, next(retry_sequence), unit))
+        job['pending_units'] += 1
+        enqueue_job(job)
+        scheduler_cond.notify_all()
+
+def next_retry_delay():
+    """Segundos até a próxima nova tentativa agendada (None se não houver)"""
+    due = [job['retry_units'][0][0] for queue in scheduler_queues.values()
+           for job in queue if job['retry_units']]
+    if not due:
+        return None
+    return max(0.05, min(due) - time.time())
+
+def response_ratio(job, now, waiting_since=None):
+    """Prioridade do job: (espera + trabalho restante) / trabalho restante
+    
+    O trabalho restante vem da média móvel do job (músicas que faltam ×
+    segundos por música). Jobs curtos sobem rápido; os longos também sobem
+    enquanto esperam, então nenhum fica parado indefinidamente. A espera é a
+    do job ou, entre clientes, a do cliente (`waiting_since`).
+    """
+    work = max(1, remaining_tracks(job)) * track_seconds(job)
+    return (now - (waiting_since or job['waiting_since']) + work) / work
+
+def next_unit():
+    """Próxima unidade a executar (chamar com scheduler_cond adquirido)
+    
+    Primeiro o cliente, depois o job: cada cliente concorre com o seu job de
+    melhor prioridade, medida pela espera do cliente (quem tem vários jobs
+    não ganha mais workers por isso). Dentro do cliente vai o job de maior
+    response_ratio. Empates seguem o rodízio entre clientes.
+    """
+    now = time.time()
+    best = None
+    for client, queue in list(scheduler_queues.items()):
+        runnable = []
+        for job in list(queue):
+            retries = job['retry_units']
+            while retries and retries[0][0] <= now:
+                job['units'].append(heapq.heappop(retries)[2])
+            if job['units']:
+                runnable.append(job)
+            elif not retries:
+                # Unidades descartadas por cancelamento
+                queue.remove(job)
+                job['queued'] = False
+        if not queue:
+            del scheduler_queues[client]
+            scheduler_client_since.pop(client, None)
+            continue
+        if not runnable:
+            continue
+        ratio = max(response_ratio(job, now, scheduler_client_since[client]) for job in runnable)
+        if best is None or ratio > best[0]:
+            best = (ratio, client, queue, runnable)
+    if best is None:
+        return None
+    
+    _, client, queue, runnable = best
+    job = max(runnable, key=lambda job: response_ratio(job, now))
+    unit = job['units'].popleft()
+    job['waiting_since'] = now
+    queue.remove(job)
+    if job['units'] or job['retry_units']:
+        queue.append(job)
+    else:
+        job['queued'] = False
+    if queue:
+        scheduler_client_since[client] = now
+        scheduler_queues.move_to_end(client)
+    else:
+        del scheduler_queues[client]
+        scheduler_client_since.pop(client, None)
+    return job, unit
+
+def scheduler_worker():
+    """Worker compartilhado: executa unidades de qualquer job, uma por vez"""
+    while True:
+        with scheduler_cond:
+            item = next_unit()
+            while item is None:
+                scheduler_cond.wait(timeout=next_retry_delay())
+                item = next_unit()
+        
+        job, (label, func) = item
+        started = None
+        try:
+            if job['cancel_event'].is_set():
+                pass
+            elif over_byte_quota(job['client']):
+                job['quota_exceeded'] = True
+            else:
+                with pipeline_lock:
+                    pipeline_stats['fetch']['active'] += 1
+                started = time.monotonic()
+                func()
+        except OperationCancelled:
+            pass
+        except Exception as e:
+            print(f"❌ Erro em {label} (job {job['id']}): {e}")
+        finally:
+            if started is not None:
+                with pipeline_lock:
+                    pipeline_stats['fetch']['active'] -= 1
+                record_stage('fetch', time.monotonic() - started)
+            with scheduler_cond:
+                job['pending_units'] -= 1
+                scheduler_cond.notify_all()
+
+def start_scheduler():
+    """Iniciar os workers do escalonador (uma única vez)"""
+    with scheduler_cond:
+        while len(scheduler_threads) < max(1, SCHEDULER_WORKERS):
+            thread = threading.Thread(target=scheduler_worker, daemon=True,
+                                      name=f'scheduler-{len(scheduler_threads)}')
+            scheduler_threads.append(thread)
+            thread.start()
+
+def wait_for_units(job):
+    """Esperar todas as unidades do job terminarem (ou o job ser cancelado)"""
+    with scheduler_cond:
+        while job['pending_units'] > 0:
+            if job['cancel_event'].is_set() and (job['units'] or job['retry_units']):
+                # Unidades ainda na fila não precisam passar por um worker
+                job['pending_units'] -= len(job['units']) + len(job['retry_units'])
+                job['units'].clear()
+                job['retry_units'].clear()
+                continue
+            scheduler_cond.wait(timeout=1)
+    if job['cancel_event'].is_set():
+        raise OperationCancelled("download cancelado")
+
+# Métricas de cada estágio do pipeline (para ajustar workers separadamente)
+pipeline_stats = {
+    'fetch': {'completed': 0, 'busy_seconds': 0.0, 'active': 0},
+    'transcode': {'completed': 0, 'failed': 0, 'busy_seconds': 0.0, 'active': 0}
+}
+pipeline_lock = threading.Lock()
+
+# Fila limitada entre os estágios: se o ffmpeg não acompanhar, a leitura da
+# saída do SpotDL bloqueia e os downloads desaceleram (backpressure)
+transcode_queue = Queue(maxsize=max(1, TRANSCODE_QUEUE_SIZE))
+transcode_threads = []
+
+def record_stage(stage, seconds, ok=True):
+    """Contabilizar um item concluído em um estágio do pipeline"""
+    with pipeline_lock:
+        stats = pipeline_stats[stage]
+        stats['busy_seconds'] += seconds
+        stats['completed' if ok else 'failed'] += 1
+
+def pipeline_snapshot():
+    """Métricas por estágio: workers, ocupação, tempo médio por item e fila"""
+    uptime = max(1.0, time.time() - STARTED_AT)
+    workers = {'fetch': max(1, SCHEDULER_WORKERS), 'transcode': max(1, TRANSCODE_WORKERS)}
+    snapshot = {}
+    with pipeline_lock:
+        for stage, stats in pipeline_stats.items():
+            done = stats['completed'] + stats.get('failed', 0)
+            snapshot[stage] = dict(stats,
+                                   workers=workers[stage],
+                                   busy_seconds=round(stats['busy_seconds'], 1),
+                                   avg_seconds=round(stats['busy_seconds'] / done, 2) if done else None,
+                                   utilization=round(stats['busy_seconds'] / (workers[stage] * uptime), 3))
+    snapshot['transcode']['queued'] = transcode_queue.qsize()
+    snapshot['transcode']['separate'] = SEPARATE_TRANSCODE
+    return snapshot
+
+def deliver_track(job, file_path, song=None):
+    """Entregar um arquivo baixado: direto ao manifesto ou ao estágio de conversão"""
+    if not transcodes_separately(job['profile']):
+        add_to_manifest(job, file_path, song)
+        return
+    
+    file_path = os.path.normpath(file_path)
+    with job['manifest_lock']:
+        if file_path in job['handed_off']:
+            return
+        job['handed_off'].add(file_path)
+    with scheduler_cond:
+        job['pending_transcodes'] += 1
+        job['status']['transcode_pending'] = job['pending_transcodes']
+    start_transcoders()
+    transcode_queue.put((job, file_path, song))
+
+def transcode_track(job, source, song):
+    """Converter um arquivo baixado para o perfil do job (estágio de CPU)"""
+    profile = OUTPUT_PROFILES[job['profile']]
+    stem = os.path.splitext(os.path.basename(source))[0]
+    target = os.path.join(job['output_dir'], stem + profile['ext'])
+    # Nome temporário único: duas fontes com o mesmo nome não escrevem juntas
+    temp_target = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+    cmd = [
+        *FFMPEG_CMD,
+        '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', source,
+        '-vn', '-map_metadata', '0',
+        # Um núcleo por conversão: o paralelismo vem do tamanho do pool
+        '-threads', '1',
+        *profile['ffmpeg'],
+        temp_target
+    ]
+    
+    with pipeline_lock:
+        pipeline_stats['transcode']['active'] += 1
+    started = time.monotonic()
+    ok = False
+    try:
+        result = run_tool(cmd, TRANSCODE_TIMEOUT, job=job)
+        ok = result.returncode == 0 and os.path.exists(temp_target)
+        if not ok:
+            print(f"⚠️ ffmpeg falhou para {os.path.basename(source)}: {result.stdout[-200:]}")
+    except subprocess.TimeoutExpired:
+        print(f"⏰ ffmpeg timeout para {os.path.basename(source)}")
+    finally:
+        with pipeline_lock:
+            pipeline_stats['transcode']['active'] -= 1
+        record_stage('transcode', time.monotonic() - started, ok)
+    
+    if ok:
+        os.replace(temp_target, target)
+        os.remove(source)
+        add_to_manifest(job, target, song)
+        return
+    
+    # Melhor entregar no formato original do que perder a música (marcado
+    # como 'native' no manifesto: não entra no cache do perfil do job)
+    if os.path.exists(temp_target):
+        os.remove(temp_target)
+    fallback = os.path.join(job['output_dir'], os.path.basename(source))
+    os.replace(source, fallback)
+    add_to_manifest(job, fallback, song, profile='native')
+
+def transcode_worker():
+    """Worker do pool de conversão: um ffmpeg por vez"""
+    while True:
+        job, source, song = transcode_queue.get()
+        try:
+            if not job['cancel_event'].is_set():
+                transcode_track(job, source, song)
+        except OperationCancelled:
+            pass
+        except Exception as e:
+            print(f"❌ Erro ao converter {source} (job {job['id']}): {e}")
+        finally:
+            with scheduler_cond:
+                job['pending_transcodes'] -= 1
+                job['status']['transcode_pending'] = job['pending_transcodes']
+                scheduler_cond.notify_all()
+
+def start_transcoders():
+    """Iniciar o pool de conversão (uma única vez)"""
+    with pipeline_lock:
+        while len(transcode_threads) < max(1, TRANSCODE_WORKERS):
+            thread = threading.Thread(target=transcode_worker, daemon=True,
+                                      name=f'transcode-{len(transcode_threads)}')
+            transcode_threads.append(thread)
+            thread.start()
+
+def drain_pipeline(job):
+    """Fim dos downloads: encaminhar arquivos não anunciados e esperar as conversões
+    
+    Retorna o manifesto (músicas prontas na pasta do job).
+    """
+    if job['fetch_dir'] != job['output_dir']:
+        with job['manifest_lock']:
+            handed_off = set(job['handed_off'])
+        try:
+            with os.scandir(job['fetch_dir']) as entries:
+                for entry in entries:
+                    if (entry.is_file() and os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS
+                            and os.path.normpath(entry.path) not in handed_off):
+                        deliver_track(job, entry.path)
+        except FileNotFoundError:
+            pass
+    
+    with scheduler_cond:
+        while job['pending_transcodes'] > 0:
+            scheduler_cond.wait(timeout=1)
+    if job['cancel_event'].is_set():
+        raise OperationCancelled("download cancelado")
+    return sync_manifest_from_output_dir(job)
+
+def run_spotdl_unit(job, shard):
+    """Baixar um lote de músicas com o SpotDL (saída direto na pasta do job)
+    
+    shard: {'name', 'index', 'songs', 'attempt'} e a entrada do SpotDL:
+    'entries' (metadados já resolvidos, gravados num .spotdl do lote),
+    'queries' (ex.: a URL da música) ou, sem nenhum dos dois, as próprias
+    músicas como consulta de texto. Se o processo falhar, só as músicas não
+    entregues voltam à fila (retry_shard).
+    """
+    if shard.get('entries') is not None:
+        batch_file = os.path.join(job['output_dir'], f".lote_{shard['index']}_{shard['attempt']}.spotdl")
+        with open(batch_file, 'w', encoding='utf-8') as f:
+            json.dump(shard['entries'], f)
+        queries = [batch_file]
+    else:
+        queries = shard.get('queries') or shard['songs']
+    count = len(shard['songs'])
+    
+    cmd = [
+        *SPOTDL_CMD,
+        *queries,
+        # Template plano: tudo direto na pasta do job, sem subpastas
+        '--output', os.path.join(job['fetch_dir'], '{artists} - {title}.{output-ext}'),
+        *fetch_args(job['profile'], 'spotdl'),
+        '--threads', str(SPOTDL_UNIT_THREADS),
+        '--print-errors'
+    ]
+    # Cada música concluída entra no manifesto assim que o SpotDL a anuncia
+    handler = make_spotdl_line_handler(job)
+    announced = set()
+    
+    def on_line(line):
+        display_name = handler(line)
+        if display_name:
+            announced.add(normalize_track_key(display_name))
+    
+    try:
+        result = run_tool(cmd, max(300, 60 * count), on_line=on_line, merge_stderr=True, job=job)
+        failed = result.returncode != 0
+        if failed:
+            print(f"⚠️ SpotDL retornou código {result.returncode} ({shard['name']}, job {job['id']})")
+            if result.stdout:
+                print(f"Output SpotDL: {result.stdout[-500:]}")
+    except subprocess.TimeoutExpired:
+        print(f"⏰ Timeout do SpotDL ({shard['name']}, job {job['id']})")
+        failed = True
+    finally:
+        delivered = sum(1 for song in shard['songs'] if normalize_track_key(song) in announced)
+        count_source('SpotDL', True, delivered)
+        count_source('SpotDL', False, count - delivered)
+    
+    if failed:
+        left = [song for song in shard['songs'] if normalize_track_key(song) not in announced]
+        if left:
+            retry_shard(job, shard, left)
+
+def retry_shard(job, shard, left):
+    """Repor na fila as músicas não entregues de um lote que falhou
+    
+    Até SPOTDL_SHARD_RETRIES novas tentativas no SpotDL (só com `left`);
+    depois, cada música vira uma unidade do método manual. O resto da
+    playlist não é tocado.
+    """
+    if job['cancel_event'].is_set():
+        return
+    if shard['attempt'] < SPOTDL_SHARD_RETRIES:
+        wanted = {normalize_track_key(song) for song in left}
+        retry = dict(shard, songs=left, attempt=shard['attempt'] + 1)
+        if shard.get('entries') is not None:
+            retry['entries'] = [entry for entry in shard['entries']
+                                if any(normalize_track_key(song) in wanted
+                                       for song in songs_from_spotdl_data([entry]))]
+        print(f"🔁 {shard['name']}: tentativa {retry['attempt'] + 1} com {len(left)} músicas não entregues")
+        submit_units(job, [(f"{shard['name']} (tentativa {retry['attempt'] + 1})",
+                            partial(run_spotdl_unit, job, retry))])
+        return
+    
+    print(f"🔄 {shard['name']}: {len(left)} músicas vão para o método manual")
+    with job['manifest_lock']:
+        job['manual_songs'].update(left)
+    total_songs = job['status']['total_songs']
+    offset = shard['index'] * max(1, SCHEDULER_BATCH_SIZE)
+    submit_units(job, [(song, partial(run_track_unit, job, song, offset + index, total_songs))
+                       for index, song in enumerate(left)])
+
+def build_spotdl_units(job, songs, save_file=None):
+    """Dividir a playlist em lotes de SCHEDULER_BATCH_SIZE músicas para o SpotDL
+    
+    Com o .spotdl da resolução, cada lote vira um .spotdl menor com os
+    metadados já resolvidos (só das músicas em `songs`). Sem ele, e para as
+    músicas que ele não tem, cada música vai como consulta de texto.
+    
+    Músicas com URL no índice levam a URL em 'download_url': o SpotDL baixa
+    direto dela, sem busca, com as mesmas tags e capa de um download normal.
+    """
+    batch_size = max(1, SCHEDULER_BATCH_SIZE)
+    shards = []
+    if save_file and os.path.exists(save_file):
+        with open(save_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        wanted = {normalize_track_key(song) for song in songs}
+        entries = [entry for entry in entries
+                   if any(normalize_track_key(song) in wanted for song in songs_from_spotdl_data([entry]))]
+        known = 0
+        for position, entry in enumerate(entries):
+            song = songs_from_spotdl_data([entry])[0]
+            known_url = lookup_resolved_url(song, track_meta(job, song))
+            if known_url:
+                entries[position] = dict(entry, download_url=known_url)
+                known += 1
+        if known:
+            print(f"🎯 {known} músicas com URL conhecida (sem busca)")
+        for start in range(0, len(entries), batch_size):
+            chunk = entries[start:start + batch_size]
+            shards.append({'songs': songs_from_spotdl_data(chunk), 'entries': chunk})
+        # Músicas que o .spotdl não tem (ex.: lote com playlists que o SpotDL
+        # não resolveu) vão como consulta de texto, não direto ao método manual
+        covered = {normalize_track_key(song) for shard in shards for song in shard['songs']}
+        songs = [song for song in songs if normalize_track_key(song) not in covered]
+    for start in range(0, len(songs), batch_size):
+        shards.append({'songs': songs[start:start + batch_size]})
+    
+    for index, shard in enumerate(shards):
+        shard.update(name=f'SpotDL lote {index + 1}/{len(shards)}', index=index, attempt=0)
+    return [(shard['name'], partial(run_spotdl_unit, job, shard)) for shard in shards]
+
+def run_track_unit(job, song, index, total_songs, attempt=1):
+    """Baixar uma música pelas fontes alternativas (método manual)
+    
+    Se a falha parecer passageira, a música volta à fila do escalonador
+    depois de TRACK_RETRY_BASE_DELAY × 2^(tentativa-1) segundos, até
+    TRACK_RETRY_ATTEMPTS tentativas.
+    """
+    with job['manifest_lock']:
+        job['track_attempts'][song] = attempt
+    job['status']['current_song'] = f'{index+1}/{total_songs}: {song[:50]}...'
+    file_path = download_song_multi_source(song, job['fetch_dir'], job, retry=attempt > 1)
+    if file_path:
+        deliver_track(job, file_path, song)
+        print(f"✅ [{index+1}/{total_songs}] {song}")
+        return
+    
+    if attempt < TRACK_RETRY_ATTEMPTS and not job['quota_exceeded'] and retryable_failure(song):
+        delay = TRACK_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+        print(f"🔁 Nova tentativa em {delay:g}s ({attempt + 1}/{TRACK_RETRY_ATTEMPTS}): {song}")
+        schedule_retry(job, (song, partial(run_track_unit, job, song, index, total_songs, attempt + 1)), delay)
+
+def retryable_failure(song):
+    """A última falha da música pode ser passageira (timeout, erro do yt-dlp)?
+    
+    Busca sem resultado ('nenhum arquivo produzido') não muda com o tempo.
+    """
+    entry = negative_lookup(song)
+    if not entry:
+        return True
+    return any(reason == 'timeout' or reason.startswith('código')
+               for reason in entry['failures'].values())
+
+def delivered_keys(job):
+    """Chaves normalizadas das músicas que já estão no manifesto do job
+    
+    Arquivos registrados sem música (listagem da pasta) usam o nome do
+    arquivo, que o SpotDL grava como 'Artistas - Título'.
+    """
+    with job['manifest_lock']:
+        entries = list(job['manifest'])
+    return {normalize_track_key(entry['song'] or os.path.splitext(os.path.basename(entry['path']))[0])
+            for entry in entries}
+
+def record_track_outcomes(job, songs, cached, skipped):
+    """Resultado de cada música esperada: cache, baixada, pulada ou falhou
+    
+    A lista completa fica em /jobs/<id>/tracks ('outcomes') e as contagens
+    em status['tracks'].
+    """
+    delivered = delivered_keys(job)
+    counts = {'expected': len(songs), 'cached': 0, 'downloaded': 0, 'skipped': 0, 'failed': 0, 'retried': 0}
+    outcomes = []
+    for song in songs:
+        attempts = job['track_attempts'].get(song, 0)
+        item = {'song': song, 'attempts': attempts}
+        if song in cached:
+            item['outcome'] = 'cached'
+        elif song in skipped:
+            item['outcome'] = 'skipped'
+        elif normalize_track_key(song) in delivered:
+            item['outcome'] = 'downloaded'
+        else:
+            item['outcome'] = 'failed'
+            entry = negative_lookup(song)
+            item['reasons'] = entry['failures'] if entry else {}
+        counts[item['outcome']] += 1
+        if attempts > 1:
+            counts['retried'] += 1
+        outcomes.append(item)
+    job['outcomes'] = outcomes
+    job['status']['tracks'] = counts
+
+def charge_track_quota(job, total_songs):
+    """Cobrar a cota de músicas do cliente: a playlist inteira de uma vez"""
+    if QUOTA_TRACKS_PER_CLIENT and job['client'] is not None:
+        used_tracks = client_usage_totals(job['client'])[0]
+        if used_tracks + total_songs > QUOTA_TRACKS_PER_CLIENT:
+            raise Exception(f'Cota de músicas excedida: restam {max(0, QUOTA_TRACKS_PER_CLIENT - used_tracks)} '
+                            f'de {QUOTA_TRACKS_PER_CLIENT}, a playlist tem {total_songs}.')
+    charge_client(job['client'], tracks=total_songs)
 
-def download_playlist_smart(playlist_url):
+def fetch_songs(job, songs, save_file, title):
+    """Baixar (ou tirar do cache) as músicas do job até o manifesto ficar completo
+    
+    Cobra a cota de músicas, aproveita cache, cache negativo e índice de URLs,
+    distribui os lotes do SpotDL (e, se ele não entregar nada, o método manual)
+    pelo escalonador e espera o estágio de conversão. Retorna os acertos de cache.
+    """
+    status = job['status']
+    total_songs = len(songs)
+    charge_track_quota(job, total_songs)
+    
+    print(f"📋 Total de músicas: {total_songs} (perfil {job['profile']})")
+    
+    # Músicas já baixadas antes no mesmo perfil não são baixadas de novo
+    not_cached = fill_from_track_cache(job, songs)
+    cache_hits = total_songs - len(not_cached)
+    # ...e as que nenhuma fonte encontrou recentemente não são tentadas
+    missing = skip_unfindable(job, not_cached)
+    
+    # Ids do Spotify por música: chaves do índice de URLs já conhecidas
+    load_track_meta(job, save_file)
+    
+    # MÉTODO 1: SpotDL em lotes, escalonados de forma justa com os outros jobs
+    print("🎵 Baixando com SpotDL em lotes...")
+    try:
+        if save_file and os.path.exists(save_file):
+            print(f"♻️ Reutilizando metadados resolvidos: {save_file}")
+        if job['kind'] == 'track' and missing:
+            # Música avulsa: um único download direto pela URL, sem lotes
+            # (com URL conhecida, 'url|url do Spotify' pula a busca do SpotDL)
+            known_url = lookup_resolved_url(missing[0], track_meta(job, missing[0]))
+            shard = {'name': 'SpotDL música', 'index': 0, 'attempt': 0, 'songs': missing[:1],
+                     'queries': [f"{known_url}|{job['url']}" if known_url else job['url']]}
+            units = [(missing[0], partial(run_spotdl_unit, job, shard))]
+        else:
+            units = build_spotdl_units(job, missing, save_file) if missing else []
+        print(f"⚙️ {len(units)} lotes de até {SCHEDULER_BATCH_SIZE} músicas, {SCHEDULER_WORKERS} workers compartilhados")
+        
+        if total_songs > 100:
+            status['progress'] = f'📊 Playlist GRANDE detectada ({total_songs} músicas). Baixando em {len(units)} lotes...'
+        else:
+            status['progress'] = f'Encontradas {total_songs} músicas em "{title}". Baixando com SpotDL...'
+        
+        start_estimate(job)
+        submit_units(job, units)
+        wait_for_units(job)
+        
+    except OperationCancelled:
+        raise
+    except Exception as e:
+        print(f"⚠️ Erro no SpotDL em lotes: {e}")
+        traceback.print_exc()
+        # Continuar para verificar se algum arquivo foi baixado
+    
+    # Registrar no manifesto o que o SpotDL gravou (depois de convertido)
+    manifest = drain_pipeline(job)
+    
+    print(f"🔍 Arquivos no manifesto: {len(manifest)}")
+    if manifest:
+        print(f"📁 Primeiro arquivo: {manifest[0]['path']}")
+    
+    # Contabilidade por música: as esperadas que o SpotDL não entregou vão
+    # para o método manual (uma unidade por música, com novas tentativas); as
+    # de lotes que falharam já passaram por ele
+    delivered = delivered_keys(job)
+    manual = [song for song in missing
+              if song not in job['manual_songs'] and normalize_track_key(song) not in delivered]
+    if manual and not job['quota_exceeded']:
+        if job['spotdl_delivered']:
+            print(f"🔄 {len(manual)} músicas não vieram do SpotDL, tentando pelo método manual...")
+        else:
+            print("🔄 SpotDL não baixou arquivos, usando método manual...")
+        status['progress'] = f'Encontradas {total_songs} músicas em "{title}". Baixando {len(manual)} manualmente...'
+        
+        job['manual_songs'].update(manual)
+        submit_units(job, [(song, partial(run_track_unit, job, song, index, total_songs))
+                           for index, song in enumerate(manual)])
+        wait_for_units(job)
+        drain_pipeline(job)
+    
+    if job['cancel_event'].is_set():
+        raise OperationCancelled("download cancelado")
+    not_cached_set = set(not_cached)
+    record_track_outcomes(job, songs, cached={song for song in songs if song not in not_cached_set},
+                          skipped=not_cached_set.difference(missing))
+    return cache_hits
+
+def completion_message(job, done, total, cache_hits):
+    """Mensagem final de um job concluído (cache, puladas e cota)"""
+    message = f'✅ Download concluído! {done} de {total} músicas baixadas.'
+    if cache_hits:
+        message += f' ({cache_hits} do cache)'
+    if job['status']['negative_cache']['skipped']:
+        message += f" {job['status']['negative_cache']['skipped']} puladas por não terem sido encontradas antes."
+    failed = job['status'].get('tracks', {}).get('failed')
+    if failed:
+        message += f' {failed} falharam em todas as fontes.'
+    if job['quota_exceeded']:
+        message += ' Cota de volume atingida: as demais músicas foram puladas.'
+    return message
+
+def nothing_downloaded_error(job, total):
+    """Erro de um job que terminou sem nenhuma música"""
+    if job['quota_exceeded']:
+        return Exception('Cota de volume de download atingida. Tente novamente mais tarde.')
+    skipped = job['status']['negative_cache']['skipped']
+    if skipped:
+        return Exception(f'Nenhuma música foi baixada. {skipped} de {total} não foram encontradas '
+                         f'em nenhuma fonte nas últimas tentativas.')
+    return Exception(f'Nenhuma música foi baixada. Todas as {total} músicas falharam.')
+
+def safe_archive_name(name):
+    """Nome de arquivo/pasta seguro a partir do nome da playlist"""
+    return "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+
+def download_playlist_smart(playlist_url, job=None):
     """Download inteligente usando Spotify público + YouTube"""
-    global download_status
+    if job is None:
+        job = create_job(playlist_url)
+    status = job['status']
+    output_dir = job['output_dir']
+    cancel_event = job['cancel_event']
     
+    save_file = None
     try:
-        download_status['status'] = 'downloading'
-        download_status['progress'] = 'Obtendo informações da playlist...'
-        download_status['current_song'] = ''
-        download_status['downloaded_songs'] = 0
-        download_status['total_songs'] = 0
-        
-        # Extrair ID da playlist
-        playlist_id = playlist_url.split('/')[-1].split('?')[0]
-        playlist_name = f"playlist_{playlist_id}"
-        output_dir = f"downloads/{playlist_name}"
-        
-        # Limpar diretório anterior
-        if os.path.exists(output_dir):
-            shutil.rmtree(output_dir)
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        status['status'] = 'downloading'
+        status['progress'] = 'Obtendo informações da playlist...'
+        status['current_song'] = ''
+        status['downloaded_songs'] = 0
+        status['total_songs'] = 0
+        
+        # Extrair tipo e ID (playlist, álbum ou música)
+        kind = job['kind']
+        playlist_id = parse_spotify_url(playlist_url)[1]
+        label = SPOTIFY_KIND_LABELS[kind]
+        
+        # Pasta exclusiva do job (nunca compartilhada com outros downloads)
+        Path(job['fetch_dir']).mkdir(parents=True, exist_ok=True)
         
         # Obter lista de músicas e nome da playlist
-        download_status['progress'] = 'Analisando playlist do Spotify...'
+        status['progress'] = f'Analisando {label} do Spotify...'
         
-        # MÉTODO 1: Tentar usar SpotDL diretamente para baixar (mais eficiente)
-        print("🎵 Tentando baixar diretamente com SpotDL...")
-        download_status['progress'] = 'Baixando playlist com SpotDL...'
+        # Resolver a playlist UMA vez: a lista (e o .spotdl, se houver) é
+        # reaproveitada pelo download, sem nova resolução no Spotify
+        info = resolve_playlist(playlist_url, cancel_event)
+        playlist_name_real = info['name']
+        songs = info['songs']
+        save_file = info.get('save_file')
         
-        try:
-            # Primeiro, obter lista de músicas para mostrar progresso
-            playlist_name_real, songs = get_playlist_info_complete(playlist_url)
-            
-            if not songs:
-                raise Exception('Não foi possível obter informações da playlist. Verifique se ela é pública e se o SpotDL está instalado corretamente.')
-            
-            # Garantir que temos um nome para a playlist
-            if not playlist_name_real:
-                playlist_name_real = f"playlist_{playlist_id}"
-            
-            download_status['total_songs'] = len(songs)
-            total_songs = len(songs)
-            
-            # Ajustar configurações baseado no tamanho da playlist
-            if total_songs > 100:
-                # Playlist grande: mais threads e timeout maior
-                spotdl_threads = '12'
-                timeout_seconds = 7200  # 2 horas para playlists grandes
-                download_status['progress'] = f'📊 Playlist GRANDE detectada ({total_songs} músicas). Otimizando para velocidade máxima...'
-                print(f"🚀 Modo otimizado para playlist grande: {total_songs} músicas")
-            elif total_songs > 50:
-                # Playlist média: threads médias
-                spotdl_threads = '10'
-                timeout_seconds = 3600  # 1 hora
-                download_status['progress'] = f'Encontradas {total_songs} músicas em "{playlist_name_real}". Baixando com SpotDL...'
-            else:
-                # Playlist pequena: configuração padrão
-                spotdl_threads = '8'
-                timeout_seconds = 1800  # 30 minutos
-                download_status['progress'] = f'Encontradas {total_songs} músicas em "{playlist_name_real}". Baixando com SpotDL...'
-            
-            print(f"📋 Playlist: {playlist_name_real}")
-            print(f"📋 Total de músicas: {total_songs}")
-            print(f"⚙️ Configuração: {spotdl_threads} threads, timeout: {timeout_seconds}s")
-            
-            # Tentar baixar com SpotDL diretamente (otimizado para velocidade)
-            cmd_download = [
-                'spotdl',
-                playlist_url,
-                '--output', output_dir,
-                '--format', 'mp3',
-                '--bitrate', '128k',
-                '--threads', spotdl_threads,  # Threads ajustadas dinamicamente
-                '--print-errors'  # Para debug
-                # Removido --preload para ser mais rápido
-            ]
-            
-            print(f"🔄 Executando SpotDL download: {' '.join(cmd_download)}")
-            if total_songs > 100:
-                download_status['progress'] = f'Baixando {total_songs} músicas com SpotDL (playlist grande - pode levar 10-20 minutos)...'
-            else:
-                download_status['progress'] = 'Baixando músicas com SpotDL (isso pode levar alguns minutos)...'
-            
-            result_dl = subprocess.run(cmd_download, capture_output=True, text=True, timeout=timeout_seconds)
+        if not songs:
+            raise Exception(f'Não foi possível obter informações da {label}. Verifique se ela é pública e se o SpotDL está instalado corretamente.')
+        
+        if kind == 'track':
+            # Páginas de música avulsa podem listar recomendações: só a primeira vale
+            songs = songs[:1]
+            playlist_name_real = songs[0]
+        
+        # Garantir que temos um nome para a playlist
+        if not playlist_name_real:
+            playlist_name_real = f"{kind}_{playlist_id}"
+        
+        total_songs = len(songs)
+        status['total_songs'] = total_songs
+        
+        print(f"📋 {label.capitalize()}: {playlist_name_real}")
+        safe_name = safe_archive_name(playlist_name_real)
+        
+        # Playlist sem mudanças desde um pedido anterior no mesmo perfil: o
+        # ZIP daquela vez é entregue direto, sem baixar nem compactar nada
+        archive_key = archive_cache_key(job, songs) if kind != 'track' else None
+        if archive_key:
+            zip_name = publish_path(job, f"{safe_name}.zip")
+            if fetch_from_archive_cache(job, archive_key, zip_name):
+                charge_track_quota(job, total_songs)
+                charge_client(job['client'], nbytes=os.path.getsize(zip_name))
+                shutil.rmtree(output_dir, ignore_errors=True)
+                print(f"📦 ZIP já pronto no cache: {archive_key}")
+                status['archive_cache'] = 'hit'
+                status['downloaded_songs'] = total_songs
+                status['cache_hits'] = total_songs
+                status['tracks'] = {'expected': total_songs, 'cached': total_songs, 'downloaded': 0,
+                                    'skipped': 0, 'failed': 0, 'retried': 0}
+                status['status'] = 'completed'
+                status['progress'] = f'✅ Download concluído! {total_songs} de {total_songs} músicas (ZIP já pronto).'
+                status['zip_file'] = zip_name
+                return
+            status['archive_cache'] = 'miss'
+        
+        cache_hits = fetch_songs(job, songs, save_file, playlist_name_real)
+        
+        # O ZIP é montado apenas a partir do manifesto do job
+        with job['manifest_lock']:
+            audio_files = [entry['path'] for entry in job['manifest']]
+        
+        if audio_files:
+            status['current_song'] = 'Finalizando...'
             
-            if result_dl.returncode == 0:
-                print("✅ SpotDL executou com sucesso!")
-                if result_dl.stdout:
-                    print(f"📝 SpotDL output: {result_dl.stdout[:300]}")
+            if kind == 'track':
+                # Música avulsa: o próprio arquivo é o resultado, sem ZIP
+                # (link temporário + os.replace: outro job com a mesma música
+                # nunca vê um arquivo pela metade)
+                zip_name = publish_path(job, f"{safe_name}{os.path.splitext(audio_files[0])[1]}")
+                temp_name = f"{zip_name}.{job['id']}.tmp"
+                link_or_copy(audio_files[0], temp_name)
+                os.replace(temp_name, zip_name)
             else:
-                print(f"⚠️ SpotDL retornou código {result_dl.returncode}")
-                if result_dl.stderr:
-                    print(f"Erro SpotDL: {result_dl.stderr[:500]}")
-                if result_dl.stdout:
-                    print(f"Output SpotDL: {result_dl.stdout[:300]}")
-                # Continuar para verificar se algum arquivo foi baixado mesmo assim
+                status['progress'] = f'Criando ZIP com {len(audio_files)} músicas...'
                 
-        except Exception as e:
-            print(f"⚠️ Erro no SpotDL direto: {e}")
-            import traceback
-            traceback.print_exc()
-            # Continuar para verificar se algum arquivo foi baixado
-        
-        # Verificar arquivos baixados (SpotDL pode salvar em subdiretórios)
-        mp3_files = list(Path(output_dir).rglob('*.mp3'))
-        
-        # Se não encontrou, verificar também no diretório atual
-        if not mp3_files:
-            mp3_files = list(Path('downloads').rglob('*.mp3'))
-        
-        print(f"🔍 Arquivos MP3 encontrados: {len(mp3_files)}")
-        if mp3_files:
-            print(f"📁 Primeiro arquivo: {mp3_files[0]}")
-        
-        # Se SpotDL não baixou nada, usar método manual
-        if not mp3_files:
-            print("🔄 SpotDL não baixou arquivos, usando método manual paralelo...")
-            download_status['progress'] = 'Baixando músicas manualmente (paralelo)...'
-            
-            # Reutilizar lista de músicas já obtida (evitar executar SpotDL novamente)
-            if 'songs' not in locals() or not songs:
-                playlist_name_real, songs = get_playlist_info_complete(playlist_url)
-            else:
-                # Reutilizar nome da playlist já obtido
-                if 'playlist_name_real' not in locals():
-                    playlist_name_real = f"playlist_{playlist_id}"
-            
-            if not songs:
-                raise Exception('Não foi possível obter informações da playlist. Verifique se ela é pública.')
-            
-            if not playlist_name_real:
-                playlist_name_real = f"playlist_{playlist_id}"
-            
-            download_status['total_songs'] = len(songs)
-            download_status['progress'] = f'Encontradas {len(songs)} músicas em "{playlist_name_real}". Baixando manualmente...'
-            
-            print(f"📋 Playlist: {playlist_name_real}")
-            print(f"📋 Total de músicas: {len(songs)}")
-            
-            # Downloads paralelos para acelerar (ajustado dinamicamente)
-            from concurrent.futures import ThreadPoolExecutor, as_completed
-            
-            successful_downloads = 0
-            total_songs = len(songs)
-            
-            # Ajustar número de workers baseado no tamanho da playlist
-            if total_songs > 100:
-                max_workers = 10  # Mais workers para playlists grandes
-                print(f"🚀 Modo turbo ativado para playlist grande!")
-            elif total_songs > 50:
-                max_workers = 8   # Workers médios para playlists médias
-            else:
-                max_workers = 4   # Workers padrão para playlists pequenas
+                # Criar ZIP com nome da playlist/álbum: montado na área de
+                # trabalho e publicado de uma vez (o nome antigo pode ser um
+                # link para um ZIP do cache, que não pode ser sobrescrito)
+                zip_name = publish_path(job, f"{safe_name}.zip")
+                temp_name = os.path.join(output_dir, '.resultado.zip')
+                with zipfile.ZipFile(temp_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    for file_path in audio_files:
+                        # Nome mais limpo
+                        clean_name = os.path.basename(file_path).replace('_', ' ')
+                        zipf.write(file_path, clean_name)
+                publish_file(temp_name, zip_name)
+                
+                # Só ZIPs completos vão para o cache (nenhuma música faltando)
+                if archive_key and len(audio_files) == len(songs):
+                    store_in_archive_cache(archive_key, zip_name)
             
-            def download_with_status(song, index):
-                """Download com atualização de status"""
-                try:
-                    download_status['current_song'] = f'{index+1}/{total_songs}: {song[:50]}...'
-                    if download_song_multi_source(song, output_dir):
-                        return True
-                    return False
-                except Exception as e:
-                    print(f"❌ Erro ao baixar {song}: {e}")
-                    return False
+            # Próximos jobs no mesmo perfil reaproveitam estas músicas
+            store_in_track_cache(job)
             
-            # Executar downloads em paralelo (workers ajustados dinamicamente)
-            print(f"🚀 Iniciando downloads paralelos de {total_songs} músicas...")
-            download_status['progress'] = f'Baixando {total_songs} músicas em paralelo ({max_workers} simultâneos - mais rápido!)...'
+            # Limpar pasta temporária (e o ZIP parcial, agora substituído pelo completo)
+            with job['partial_lock']:
+                shutil.rmtree(output_dir)
+                discard_partial_zip(job)
             
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # Submeter todos os downloads
-                future_to_song = {
-                    executor.submit(download_with_status, song, i): (song, i) 
-                    for i, song in enumerate(songs)
-                }
-                
-                # Processar conforme completam
-                for future in as_completed(future_to_song):
-                    song, index = future_to_song[future]
-                    try:
-                        if future.result():
-                            successful_downloads += 1
-                            download_status['downloaded_songs'] = successful_downloads
-                            print(f"✅ [{successful_downloads}/{total_songs}] {song}")
-                    except Exception as e:
-                        print(f"❌ Erro no download de {song}: {e}")
+            status['status'] = 'completed'
+            status['progress'] = completion_message(job, len(audio_files), len(songs), cache_hits)
+            status['zip_file'] = zip_name
+            status['current_song'] = ''
             
-            # Verificar novamente após downloads manuais
-            mp3_files = list(Path(output_dir).rglob('*.mp3'))
+        else:
+            raise nothing_downloaded_error(job, len(songs))
+    
+    except OperationCancelled:
+        print(f"🛑 Job {job['id']} cancelado")
+        # Processos já foram encerrados; liberar pasta e ZIP parcial do job
+        with job['partial_lock']:
+            shutil.rmtree(output_dir, ignore_errors=True)
+            discard_partial_zip(job)
+        status['status'] = 'cancelled'
+        status['progress'] = '🛑 Download cancelado.'
+        status['current_song'] = ''
+    except Exception as e:
+        status['status'] = 'error'
+        status['error_message'] = str(e)
+        status['progress'] = f'❌ Erro: {str(e)}'
+        status['current_song'] = ''
+    finally:
+        job['finished_at'] = time.time()
+        discard_save_file(save_file)
+        flush_store(negative_cache, force=True)
+        flush_store(resolved_urls, force=True)
+
+def merge_save_files(job, save_files):
+    """Juntar os .spotdl das playlists do lote num só, sem músicas repetidas"""
+    merged = []
+    seen = set()
+    for save_file in save_files:
+        if not save_file or not os.path.exists(save_file):
+            continue
+        try:
+            with open(save_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignorando {save_file}: {e}")
+            continue
+        for entry in entries:
+            songs = songs_from_spotdl_data([entry])
+            if not songs or normalize_track_key(songs[0]) in seen:
+                continue
+            seen.add(normalize_track_key(songs[0]))
+            merged.append(entry)
+    
+    if not merged:
+        return None
+    merged_file = os.path.join(job['output_dir'], '.uniao.spotdl')
+    with open(merged_file, 'w', encoding='utf-8') as f:
+        json.dump(merged, f)
+    return merged_file
+
+def download_batch(urls, job, layout='folders'):
+    """Baixar várias playlists num só job, cada música em comum uma vez só
+    
+    As playlists são resolvidas ao mesmo tempo, a união das músicas (sem
+    repetidas) passa pelo mesmo fluxo de um job comum e, no fim, o ZIP é
+    montado a partir do conjunto compartilhado: uma pasta por playlist
+    (layout 'folders') ou um ZIP por playlist ('per-playlist').
+    """
+    status = job['status']
+    output_dir = job['output_dir']
+    cancel_event = job['cancel_event']
+    
+    save_files = []
+    try:
+        status['progress'] = f'Analisando {len(urls)} links do Spotify...'
+        Path(job['fetch_dir']).mkdir(parents=True, exist_ok=True)
         
-        # Verificar arquivos baixados (se ainda não foi verificado)
-        if 'mp3_files' not in locals():
-            mp3_files = list(Path(output_dir).rglob('*.mp3'))
+        # Cada link tem sua própria corrida de estratégias; todas ao mesmo tempo
+        with ThreadPoolExecutor(max_workers=max(1, min(len(urls), BATCH_RESOLVE_WORKERS)),
+                                thread_name_prefix='batch') as executor:
+            infos = list(executor.map(lambda url: resolve_playlist(url, cancel_event), urls))
         
-        if mp3_files:
-            download_status['progress'] = f'Criando ZIP com {len(mp3_files)} músicas...'
-            download_status['current_song'] = 'Finalizando...'
-            
-            # Criar ZIP com nome da playlist
-            safe_name = "".join(c for c in playlist_name_real if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            zip_name = f"downloads/{safe_name}.zip"
-            with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for file_path in mp3_files:
-                    # Nome mais limpo
-                    clean_name = file_path.name.replace('_', ' ')
-                    zipf.write(file_path, clean_name)
-            
-            # Limpar pasta temporária
-            shutil.rmtree(output_dir)
-            
-            download_status['status'] = 'completed'
-            download_status['progress'] = f'✅ Download concluído! {len(mp3_files)} de {len(songs)} músicas baixadas.'
-            download_status['zip_file'] = zip_name
-            download_status['current_song'] = ''
-            
+        playlists = []
+        union = []
+        seen = set()
+        for url, info in zip(urls, infos):
+            save_files.append(info.get('save_file'))
+            kind, item_id = parse_spotify_url(url)
+            songs = info['songs'][:1] if kind == 'track' else info['songs']
+            if not songs:
+                print(f"⚠️ Nenhuma música obtida de {url}")
+                continue
+            name = songs[0] if kind == 'track' else (info['name'] or f"{kind}_{item_id}")
+            playlists.append({'url': url, 'name': name, 'songs': songs})
+            for song in songs:
+                key = normalize_track_key(song)
+                if key not in seen:
+                    seen.add(key)
+                    union.append(song)
+        
+        if not playlists:
+            raise Exception('Não foi possível obter informações de nenhum dos links. Verifique se são públicos.')
+        
+        total_tracks = sum(len(playlist['songs']) for playlist in playlists)
+        status['total_songs'] = len(union)
+        status['batch'] = {'playlists': len(playlists), 'tracks': total_tracks, 'unique': len(union)}
+        print(f"📚 Lote: {len(playlists)} playlists, {total_tracks} músicas, {len(union)} únicas "
+              f"({total_tracks - len(union)} repetidas baixadas uma vez só)")
+        
+        save_file = merge_save_files(job, save_files)
+        cache_hits = fetch_songs(job, union, save_file, f'{len(playlists)} playlists')
+        
+        # Arquivo de cada música (pela chave normalizada) no conjunto compartilhado
+        with job['manifest_lock']:
+            by_key = {normalize_track_key(entry['song'] or os.path.splitext(os.path.basename(entry['path']))[0]):
+                      entry['path'] for entry in job['manifest']}
+        if not by_key:
+            raise nothing_downloaded_error(job, len(union))
+        
+        status['current_song'] = 'Finalizando...'
+        status['progress'] = f'Criando ZIP do lote com {len(by_key)} músicas...'
+        
+        # Nomes únicos: duas playlists com o mesmo nome não se misturam
+        names = []
+        for playlist in playlists:
+            base = safe_archive_name(playlist['name']) or 'playlist'
+            name, n = base, 2
+            while name in names:
+                name, n = f'{base} ({n})', n + 1
+            names.append(name)
+        
+        def write_playlist(zipf, playlist, folder=''):
+            written = 0
+            for song in playlist['songs']:
+                file_path = by_key.get(normalize_track_key(song))
+                if file_path:
+                    zipf.write(file_path, folder + os.path.basename(file_path).replace('_', ' '))
+                    written += 1
+            return written
+        
+        archives = []
+        if layout == 'per-playlist':
+            for index, (playlist, name) in enumerate(zip(playlists, names)):
+                zip_name = publish_path(job, f"{name}.zip")
+                temp_name = os.path.join(output_dir, f'.resultado_{index}.zip')
+                with zipfile.ZipFile(temp_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    written = write_playlist(zipf, playlist)
+                publish_file(temp_name, zip_name)
+                job['archives'].append(zip_name)
+                archives.append({'name': playlist['name'], 'url': f"/jobs/{job['id']}/archives/{index}",
+                                 'songs': len(playlist['songs']), 'files': written})
         else:
-            raise Exception(f'Nenhuma música foi baixada. Todas as {len(songs)} músicas falharam.')
-            
+            zip_name = publish_path(job, 'lote.zip')
+            temp_name = os.path.join(output_dir, '.resultado.zip')
+            with zipfile.ZipFile(temp_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for playlist, name in zip(playlists, names):
+                    archives.append({'name': playlist['name'], 'folder': name,
+                                     'songs': len(playlist['songs']), 'files': write_playlist(zipf, playlist, f'{name}/')})
+            publish_file(temp_name, zip_name)
+            status['zip_file'] = zip_name
+        
+        # Próximos jobs no mesmo perfil reaproveitam estas músicas
+        store_in_track_cache(job)
+        
+        with job['partial_lock']:
+            shutil.rmtree(output_dir)
+            discard_partial_zip(job)
+        
+        status['archives'] = archives
+        status['status'] = 'completed'
+        status['progress'] = completion_message(job, len(by_key), len(union), cache_hits)
+        status['current_song'] = ''
+    
+    except OperationCancelled:
+        print(f"🛑 Lote {job['id']} cancelado")
+        with job['partial_lock']:
+            shutil.rmtree(output_dir, ignore_errors=True)
+            discard_partial_zip(job)
+        status['status'] = 'cancelled'
+        status['progress'] = '🛑 Download cancelado.'
+        status['current_song'] = ''
     except Exception as e:
-        download_status['status'] = 'error'
-        download_status['error_message'] = str(e)
-        download_status['progress'] = f'❌ Erro: {str(e)}'
-        download_status['current_song'] = ''
+        status['status'] = 'error'
+        status['error_message'] = str(e)
+        status['progress'] = f'❌ Erro: {str(e)}'
+        status['current_song'] = ''
+    finally:
+        job['finished_at'] = time.time()
+        for save_file in save_files:
+            discard_save_file(save_file)
+        flush_store(negative_cache, force=True)
+        flush_store(resolved_urls, force=True)
+
+# Popularidade por playlist/álbum ('<tipo>:<id>'), para o pré-aquecimento.
+# Entradas: {'url', 'kind', 'score' (pedidos com decaimento), 'requests',
+#            'profiles': {perfil: pedidos}, 'last_requested', 'last_prewarmed',
+#            'tracks', 'new_tracks', 'expires_at'}
+playlist_popularity = make_json_store('popularity.json', 'popularidade das playlists')
+prewarm_stats = {'cycles': 0, 'last_cycle': None, 'playlists': 0, 'tracks': 0, 'errors': 0}
+prewarm_thread = None
+prewarm_lock = threading.Lock()
+
+def decayed_score(entry, now):
+    """Pedidos da playlist com meia-vida PREWARM_HALF_LIFE"""
+    elapsed = max(0.0, now - entry['last_requested'])
+    return entry['score'] * 0.5 ** (elapsed / max(1, PREWARM_HALF_LIFE))
+
+def record_playlist_request(url, profile):
+    """Contar um pedido da playlist/álbum (músicas avulsas não são pré-aquecidas)"""
+    kind, item_id = parse_spotify_url(url)
+    if kind not in ('playlist', 'album'):
+        return
+    now = time.time()
+    with playlist_popularity['lock']:
+        entries = store_entries(playlist_popularity)
+        entry = entries.setdefault(f'{kind}:{item_id}', {
+            'url': url, 'kind': kind, 'score': 0.0, 'requests': 0, 'profiles': {},
+            'last_requested': now, 'last_prewarmed': None, 'tracks': None, 'new_tracks': None})
+        entry['score'] = decayed_score(entry, now) + 1
+        entry['requests'] += 1
+        entry['profiles'][profile] = entry['profiles'].get(profile, 0) + 1
+        entry['last_requested'] = now
+        entry['expires_at'] = now + PREWARM_FORGET_AFTER
+        playlist_popularity['dirty'] = True
+    flush_store(playlist_popularity)
+    start_prewarmer()
+
+def hot_playlists(now=None):
+    """Playlists quentes que não foram pré-aquecidas no último intervalo, das mais pedidas"""
+    now = now or time.time()
+    with playlist_popularity['lock']:
+        entries = store_entries(playlist_popularity)
+        hot = [(decayed_score(entry, now), key, dict(entry)) for key, entry in entries.items()
+               # Margem: pedidos seguidos já decaíram uma fração ínfima
+               if decayed_score(entry, now) >= PREWARM_MIN_REQUESTS * 0.99
+               and (entry['last_prewarmed'] or 0) + PREWARM_INTERVAL <= now]
+    hot.sort(key=lambda item: item[0], reverse=True)
+    return [(key, entry) for _, key, entry in hot[:PREWARM_TOP]]
+
+def prewarm_off_peak():
+    """Fora do horário de pico: dentro de PREWARM_HOURS e sem downloads de usuários"""
+    if PREWARM_HOURS:
+        try:
+            start, end = (int(part) % 24 for part in PREWARM_HOURS.split('-', 1))
+        except ValueError:
+            start, end = 2, 6
+        hour = time.localtime().tm_hour
+        # Faixas que passam da meia-noite ('22-6') também valem
+        if not (start <= hour < end if start <= end else hour >= start or hour < end):
+            return False
+    with jobs_lock:
+        return not any(job['client'] is not None and job['status']['status'] == 'downloading'
+                       for job in jobs.values())
+
+def prewarm_playlist(key, entry):
+    """Resolver a playlist de novo e baixar para o cache só as músicas que faltam"""
+    # Perfil mais pedido: é nele que os próximos pedidos vão procurar no cache
+    profile = max(entry['profiles'], key=entry['profiles'].get) if entry['profiles'] else DEFAULT_PROFILE
+    if profile not in OUTPUT_PROFILES:
+        profile = DEFAULT_PROFILE
+    job = create_job(entry['url'], None, profile)
+    job['status']['prewarm'] = True
+    save_file = None
+    new_songs = []
+    try:
+        info = resolve_playlist(entry['url'], job['cancel_event'])
+        save_file = info.get('save_file')
+        songs = info['songs']
+        if not songs:
+            raise Exception('playlist não resolvida')
+        
+        cached = track_cache_index(profile)
+        new_songs = [song for song in songs if track_cache_name(song) not in cached]
+        job['status']['total_songs'] = len(new_songs)
+        print(f"🔥 Pré-aquecendo {key} ({profile}): {len(new_songs)} de {len(songs)} músicas fora do cache")
+        
+        if new_songs:
+            Path(job['fetch_dir']).mkdir(parents=True, exist_ok=True)
+            fetch_songs(job, new_songs, save_file, info['name'])
+            store_in_track_cache(job)
+        
+        with playlist_popularity['lock']:
+            stored = store_entries(playlist_popularity).get(key)
+            if stored:
+                stored['last_prewarmed'] = time.time()
+                stored['tracks'] = len(songs)
+                stored['new_tracks'] = len(new_songs)
+                playlist_popularity['dirty'] = True
+        prewarm_stats['playlists'] += 1
+        prewarm_stats['tracks'] += len(job['manifest'])
+        job['status']['status'] = 'completed'
+        job['status']['progress'] = f'🔥 Pré-aquecimento concluído: {len(job["manifest"])} músicas no cache.'
+    except Exception as e:
+        prewarm_stats['errors'] += 1
+        print(f"⚠️ Pré-aquecimento de {key} falhou: {e}")
+        job['status']['status'] = 'error'
+        job['status']['error_message'] = str(e)
+    finally:
+        job['finished_at'] = time.time()
+        shutil.rmtree(job['output_dir'], ignore_errors=True)
+        discard_save_file(save_file)
+        flush_store(playlist_popularity, force=True)
+        flush_store(negative_cache, force=True)
+        flush_store(resolved_urls, force=True)
+
+def prewarm_worker():
+    """Laço do pré-aquecimento: a cada intervalo, as playlists quentes fora do pico"""
+    while True:
+        time.sleep(min(PREWARM_INTERVAL, 600))
+        if not prewarm_off_peak():
+            continue
+        candidates = hot_playlists()
+        if not candidates:
+            continue
+        prewarm_stats['cycles'] += 1
+        prewarm_stats['last_cycle'] = time.time()
+        for key, entry in candidates:
+            # Usuários chegaram: o resto fica para o próximo ciclo
+            if not prewarm_off_peak():
+                break
+            prewarm_playlist(key, entry)
+
+def start_prewarmer():
+    """Iniciar a thread de pré-aquecimento (uma única vez; PREWARM_INTERVAL=0 desativa)"""
+    global prewarm_thread
+    if PREWARM_INTERVAL <= 0:
+        return
+    with prewarm_lock:
+        if prewarm_thread is None:
+            prewarm_thread = threading.Thread(target=prewarm_worker, daemon=True, name='prewarm')
+            prewarm_thread.start()
+
+# Dependências externas verificadas uma única vez (ver probe_dependencies)
+STARTED_AT = time.time()
+dependency_status = {
+    'checked': False,
+    'checked_at': None,
+    'tools': {}
+}
+dependency_probe_lock = threading.Lock()
+dependency_probe_thread = None
+
+def probe_tool(cmd, version_args):
+    """Verificar se uma ferramenta existe e obter a primeira linha da versão"""
+    path = shutil.which(cmd[0])
+    if not path:
+        return {'available': False, 'path': None, 'version': None}
+    
+    try:
+        result = run_tool(cmd + version_args, 30)
+        output = (result.stdout or result.stderr).strip()
+        version = output.split('\n')[0][:120] if output else None
+        return {'available': result.returncode == 0, 'path': path, 'version': version}
+    except Exception as e:
+        return {'available': False, 'path': path, 'version': None, 'error': str(e)}
+
+def probe_dependencies():
+    """Verificar ffmpeg, spotdl e yt-dlp (executado uma vez, em segundo plano)"""
+    tools = {
+        'ffmpeg': probe_tool(FFMPEG_CMD, ['-version']),
+        'spotdl': probe_tool(SPOTDL_CMD, ['--version']),
+        'yt-dlp': probe_tool(YTDLP_CMD, ['--version'])
+    }
+    dependency_status['tools'] = tools
+    dependency_status['checked_at'] = time.time()
+    dependency_status['checked'] = True
+    
+    for name, info in tools.items():
+        if info['available']:
+            print(f"✅ {name}: {info['version']}")
+        else:
+            print(f"❌ {name} indisponível")
+
+def start_dependency_probe():
+    """Disparar a verificação de dependências sem bloquear a inicialização"""
+    global dependency_probe_thread
+    with dependency_probe_lock:
+        if dependency_probe_thread is None:
+            dependency_probe_thread = threading.Thread(target=probe_dependencies, daemon=True)
+            dependency_probe_thread.start()
+
+def content_disposition(download_name):
+    """Cabeçalho Content-Disposition com nome ASCII e UTF-8 (RFC 6266)"""
+    ascii_name = download_name.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(download_name)}"
+
+def serve_download(file_path, download_name=None, mimetype=None):
+    """Entregar arquivo com suporte a Range, ETag e offload para o proxy
+    
+    Downloads interrompidos podem ser retomados via Range (If-Range usa o
+    ETag). Com SENDFILE_MODE=x-accel o nginx envia o arquivo com sendfile e
+    cuida dos Ranges; o Python só responde cabeçalhos.
+    """
+    download_name = download_name or os.path.basename(file_path)
+    stat = os.stat(file_path)
+    
+    if SENDFILE_MODE == 'x-accel':
+        root = os.path.abspath('downloads')
+        abs_path = os.path.abspath(file_path)
+        if os.path.commonpath([root, abs_path]) == root:
+            etag = f"{int(stat.st_mtime)}-{stat.st_size}"
+            response = Response(status=200, mimetype=mimetype or 'application/octet-stream')
+            response.set_etag(etag)
+            response.last_modified = stat.st_mtime
+            if request.if_none_match.contains(etag):
+                response.status_code = 304
+                return response
+            relative = os.path.relpath(abs_path, root).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = SENDFILE_PREFIX.rstrip('/') + '/' + quote(relative)
+            response.headers['Content-Disposition'] = content_disposition(download_name)
+            response.headers['Accept-Ranges'] = 'bytes'
+            return response
+        print(f"⚠️ {file_path} fora de downloads/, servindo sem X-Accel-Redirect")
+    
+    # send_file trata Range/If-Range/If-None-Match (conditional) e, com
+    # USE_X_SENDFILE, delega o envio ao servidor web via X-Sendfile
+    return send_file(
+        os.path.abspath(file_path),
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=True,
+        max_age=0
+    )
 
 @app.route('/')
 def index():
@@ -1215,6 +3769,24 @@ def index():
 def get_token():
     return jsonify({'token': 'smart-token'})
 
+@app.route('/profiles')
+def profiles():
+    """Perfis de saída disponíveis (o padrão vem primeiro)"""
+    names = [DEFAULT_PROFILE] + [name for name in OUTPUT_PROFILES if name != DEFAULT_PROFILE]
+    return jsonify({'default': DEFAULT_PROFILE,
+                    'profiles': [{'id': name, 'label': OUTPUT_PROFILES[name]['label']} for name in names]})
+
+# Verificação de cota + criação do job são atômicas (sem corrida entre POSTs)
+admission_lock = threading.Lock()
+
+def client_id():
+    """Identificar o cliente da requisição (IP, ou X-Forwarded-For atrás de proxy)"""
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get('X-Forwarded-For', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.remote_addr or 'desconhecido'
+
 @app.route('/download', methods=['POST'])
 def download():
     global download_status
@@ -1222,42 +3794,394 @@ def download():
     data = request.get_json()
     playlist_url = data.get('url', '').strip()
     
-    if not playlist_url or 'spotify.com/playlist/' not in playlist_url:
-        return jsonify({'error': 'URL inválida. Use uma URL de playlist do Spotify.'}), 400
-    
-    if download_status['status'] == 'downloading':
-        return jsonify({'error': 'Já existe um download em andamento'}), 400
-    
-    # Resetar status
-    download_status = {
-        'status': 'downloading',
-        'progress': 'Preparando download inteligente...',
-        'zip_file': None,
-        'error_message': '',
-        'current_song': '',
-        'downloaded_songs': 0,
-        'total_songs': 0
-    }
+    if not parse_spotify_url(playlist_url)[0]:
+        return jsonify({'error': 'URL inválida. Use uma URL de playlist, álbum ou música do Spotify.'}), 400
+    
+    profile = data.get('profile') or DEFAULT_PROFILE
+    if profile not in OUTPUT_PROFILES:
+        return jsonify({'error': f"Perfil de saída inválido. Use: {', '.join(OUTPUT_PROFILES)}"}), 400
+    
+    # Vários jobs rodam juntos; cada cliente é limitado pelas próprias cotas
+    client = client_id()
+    with admission_lock:
+        refusal = quota_refusal(client)
+        if refusal:
+            message, retry_after = refusal
+            response = jsonify({'error': message})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+        job = create_job(playlist_url, client, profile)
+    
+    # O status global (legado) passa a apontar para o job mais recente
+    download_status = job['status']
+    record_playlist_request(playlist_url, profile)
     
     # Iniciar download em thread separada
-    thread = threading.Thread(target=download_playlist_smart, args=(playlist_url,))
+    thread = threading.Thread(target=download_playlist_smart, args=(playlist_url, job))
     thread.daemon = True
     thread.start()
     
-    return jsonify({'message': 'Download inteligente iniciado'})
+    return jsonify({'message': 'Download inteligente iniciado', 'job_id': job['id']})
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Baixar várias playlists (ou álbuns/músicas) num só job, sem repetir músicas"""
+    global download_status
+    
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls:
+        return jsonify({'error': 'Envie "urls" com uma lista de links do Spotify.'}), 400
+    # Links repetidos no pedido contam uma vez
+    urls = list(dict.fromkeys(str(url).strip() for url in urls if str(url).strip()))
+    invalid = [url for url in urls if not parse_spotify_url(url)[0]]
+    if invalid:
+        return jsonify({'error': 'URLs inválidas. Use URLs de playlist, álbum ou música do Spotify.',
+                        'invalid': invalid}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({'error': f'No máximo {BATCH_MAX_URLS} links por lote.'}), 400
+    
+    layout = data.get('layout') or 'folders'
+    if layout not in BATCH_LAYOUTS:
+        return jsonify({'error': f"Layout inválido. Use: {', '.join(BATCH_LAYOUTS)}"}), 400
+    profile = data.get('profile') or DEFAULT_PROFILE
+    if profile not in OUTPUT_PROFILES:
+        return jsonify({'error': f"Perfil de saída inválido. Use: {', '.join(OUTPUT_PROFILES)}"}), 400
+    
+    client = client_id()
+    with admission_lock:
+        refusal = quota_refusal(client)
+        if refusal:
+            message, retry_after = refusal
+            response = jsonify({'error': message})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+        job = create_job(urls[0], client, profile, kind='batch')
+    job['status']['urls'] = urls
+    job['status']['layout'] = layout
+    download_status = job['status']
+    for url in urls:
+        record_playlist_request(url, profile)
+    
+    thread = threading.Thread(target=download_batch, args=(urls, job, layout))
+    thread.daemon = True
+    thread.start()
+    
+    return jsonify({'message': f'Lote com {len(urls)} links iniciado', 'job_id': job['id']})
 
 @app.route('/status')
 def status():
+    job_id = request.args.get('job')
+    if job_id:
+        job = find_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job não encontrado'}), 404
+        refresh_estimate(job)
+        return jsonify(job['status'])
     return jsonify(download_status)
 
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def job_cancel(job_id):
+    """Cancelar um job em andamento (processos, pasta e ZIP parcial são liberados)"""
+    job = find_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    if job['status']['status'] != 'downloading':
+        return jsonify({'error': 'Job já finalizado', 'status': job['status']['status']}), 409
+    
+    cancel_job(job)
+    return jsonify({'job_id': job_id, 'status': 'cancelling'}), 202
+
+@app.route('/jobs/<job_id>/tracks')
+def job_tracks(job_id):
+    """Listar as músicas que o job já concluiu (disponíveis para download)"""
+    job = find_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    
+    with job['manifest_lock']:
+        entries = list(job['manifest'])
+    
+    tracks = []
+    for index, entry in enumerate(entries):
+        if not os.path.exists(entry['path']):
+            continue
+        tracks.append({
+            'index': index,
+            'name': os.path.basename(entry['path']),
+            'song': entry['song'],
+            'size': entry['size'],
+            'url': f"/jobs/{job_id}/tracks/{index}"
+        })
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status']['status'],
+        'total_songs': job['status']['total_songs'],
+        'tracks': tracks,
+        # Resultado por música esperada (quando o download termina)
+        'outcomes': job['outcomes']
+    })
+
+@app.route('/jobs/<job_id>/tracks/<int:index>')
+def job_track_file(job_id, index):
+    """Baixar uma música concluída do job, mesmo com o job ainda em andamento"""
+    job = find_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    
+    with job['manifest_lock']:
+        entry = job['manifest'][index] if 0 <= index < len(job['manifest']) else None
+    
+    if not entry:
+        return jsonify({'error': 'Música não encontrada'}), 404
+    if not os.path.exists(entry['path']):
+        # Job finalizado: as músicas agora estão apenas no ZIP
+        return jsonify({'error': 'Arquivo não está mais disponível, baixe o ZIP'}), 410
+    return serve_download(entry['path'])
+
+@app.route('/jobs/<job_id>/partial-zip')
+def job_partial_zip(job_id):
+    """Baixar ZIP com o subconjunto de músicas já concluídas"""
+    job = find_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    
+    if (job['status']['status'] == 'completed' and job['status']['zip_file']
+            and job['status']['zip_file'].endswith('.zip')):
+        return serve_download(job['status']['zip_file'], mimetype='application/zip')
+    
+    zip_path = build_partial_zip(job)
+    if not zip_path:
+        return jsonify({'error': 'Nenhuma música concluída ainda'}), 404
+    return serve_download(zip_path, download_name='parcial.zip', mimetype='application/zip')
+
+@app.route('/jobs/<job_id>/archives/<int:index>')
+def job_archive(job_id, index):
+    """Baixar o ZIP de uma das playlists de um lote (layout 'per-playlist')"""
+    job = find_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    if job['status']['status'] != 'completed' or not 0 <= index < len(job['archives']):
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+    zip_path = job['archives'][index]
+    if not os.path.exists(zip_path):
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+    return serve_download(zip_path, mimetype='application/zip')
+
 @app.route('/download-zip')
 def download_zip():
-    if download_status['status'] == 'completed' and download_status['zip_file']:
-        zip_path = download_status['zip_file']
+    job = find_job(request.args.get('job', ''))
+    job_status = job['status'] if job else download_status
+    if job_status['status'] == 'completed' and job_status['zip_file']:
+        zip_path = job_status['zip_file']
         if os.path.exists(zip_path):
-            return send_file(zip_path, as_attachment=True, download_name=os.path.basename(zip_path))
+            # Música avulsa: o arquivo de áudio é entregue sem ZIP
+            mimetype = 'application/zip' if zip_path.endswith('.zip') else None
+            return serve_download(zip_path, mimetype=mimetype)
     return jsonify({'error': 'Arquivo não encontrado'}), 404
 
+@app.route('/healthz')
+def healthz():
+    """Saúde do processo: dependências (verificadas uma vez) e jobs ativos"""
+    start_dependency_probe()
+    
+    with jobs_lock:
+        active_jobs = sum(1 for job in jobs.values() if job['status']['status'] == 'downloading')
+    
+    tools = dependency_status['tools']
+    if not dependency_status['checked']:
+        state = 'starting'
+    elif all(tools.get(name, {}).get('available') for name in ('ffmpeg', 'spotdl')):
+        # yt-dlp só é usado no método manual: sem ele o serviço continua útil
+        state = 'ok'
+    else:
+        state = 'degraded'
+    
+    return jsonify({
+        'status': state,
+        'uptime_seconds': round(time.time() - STARTED_AT, 1),
+        'active_jobs': active_jobs,
+        'pipeline': pipeline_snapshot(),
+        'archive_cache': archive_cache_stats,
+        'prewarm': dict(prewarm_stats, enabled=PREWARM_INTERVAL > 0, hours=PREWARM_HOURS),
+        'dependencies': tools,
+        'dependencies_checked_at': dependency_status['checked_at']
+    }), 503 if state == 'degraded' else 200
+
+# Última medida de cada pasta: caminho -> (quando, {'files', 'bytes'})
+directory_usage_cache = {}
+directory_usage_lock = threading.Lock()
+
+def directory_usage(path):
+    """Arquivos e bytes dentro de uma pasta (recursivo; 0 se não existir)
+    
+    A medida é reaproveitada por ADMIN_USAGE_TTL segundos: percorrer um cache
+    grande a cada atualização do painel custaria uma varredura do disco.
+    """
+    with directory_usage_lock:
+        cached = directory_usage_cache.get(path)
+        if cached and time.monotonic() - cached[0] < ADMIN_USAGE_TTL:
+            return cached[1]
+    files = total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except OSError:
+                pass
+    usage = {'files': files, 'bytes': total}
+    with directory_usage_lock:
+        directory_usage_cache[path] = (time.monotonic(), usage)
+    return usage
+
+def job_overview(job, now, processes):
+    """Resumo de um job para o painel: progresso, ritmo, ETA e processos"""
+    refresh_estimate(job, now)
+    status = job['status']
+    done = status['downloaded_songs']
+    total = status['total_songs']
+    ended = job['finished_at'] or now
+    elapsed = max(0.001, ended - job['created_at'])
+    rate = done / (elapsed / 60)
+    
+    if status['status'] != 'downloading':
+        phase = status['status']
+    elif not total:
+        phase = 'resolving'
+    elif processes or job['pending_units'] > len(job['units']):
+        phase = 'running'
+    elif job['units']:
+        phase = 'queued'
+    else:
+        phase = 'finishing'
+    
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'url': job['url'],
+        'client': job['client'],
+        'profile': job['profile'],
+        'phase': phase,
+        'progress': status['progress'],
+        'current_song': status['current_song'],
+        'downloaded_songs': done,
+        'total_songs': total,
+        'cache_hits': status['cache_hits'],
+        'units_queued': len(job['units']),
+        'units_pending': job['pending_units'],
+        'units_retrying': len(job['retry_units']),
+        'transcode_pending': job['pending_transcodes'],
+        'elapsed_seconds': round(elapsed, 1),
+        'tracks_per_minute': round(rate, 2),
+        'tracks_per_second': status['tracks_per_second'],
+        'bytes_per_second': status['bytes_per_second'],
+        'eta_seconds': status['eta_seconds'] if status['status'] == 'downloading' else None,
+        'priority': round(response_ratio(job, now), 2) if job['queued'] else None,
+        'processes': processes
+    }
+
+def admin_snapshot():
+    """Tudo o que o painel mostra: jobs, filas, workers, fontes, caches e disco"""
+    now = time.time()
+    with running_processes_lock:
+        procs = [dict(info) for info in running_processes.values()]
+    by_job = {}
+    for info in procs:
+        runtime = now - info['started_at']
+        silent = now - info['last_output_at']
+        by_job.setdefault(info['job_id'], []).append({
+            'pid': info['proc'].pid,
+            'cmd': info['cmd'],
+            'runtime_seconds': round(runtime, 1),
+            'silent_seconds': round(silent, 1),
+            'stuck': silent >= ADMIN_STUCK_SECONDS
+        })
+    
+    with jobs_lock:
+        all_jobs = list(jobs.values())
+    with scheduler_cond:
+        overviews = [job_overview(job, now, by_job.get(job['id'], [])) for job in all_jobs]
+        queues = {str(client): sum(len(job['units']) for job in queue)
+                  for client, queue in scheduler_queues.items()}
+    overviews.sort(key=lambda item: item['elapsed_seconds'], reverse=True)
+    grouped = {'active': [], 'queued': [], 'finished': []}
+    for item in overviews:
+        if item['phase'] in ('resolving', 'running', 'finishing'):
+            grouped['active'].append(item)
+        elif item['phase'] == 'queued':
+            grouped['queued'].append(item)
+        else:
+            grouped['finished'].append(item)
+    
+    with source_stats_lock:
+        sources = {}
+        for source, stats in source_stats.items():
+            attempts = stats['ok'] + stats['failed']
+            sources[source] = dict(stats, success_rate=round(stats['ok'] / attempts, 3) if attempts else None)
+    
+    stores = {}
+    for store in (negative_cache, resolved_urls, playlist_popularity):
+        with store['lock']:
+            stores[store['file']] = len(store_entries(store))
+    
+    disk = {}
+    for name, path in (('downloads', 'downloads'), ('cache', CACHE_DIR), ('scratch', SCRATCH_DIR)):
+        try:
+            usage = shutil.disk_usage(path)
+            disk[name] = {'path': path, 'total': usage.total, 'used': usage.used, 'free': usage.free}
+        except OSError:
+            disk[name] = None
+    
+    return {
+        'generated_at': now,
+        'uptime_seconds': round(now - STARTED_AT, 1),
+        'jobs': grouped,
+        'scheduler': {'workers': len(scheduler_threads), 'queued_units_by_client': queues},
+        'pipeline': pipeline_snapshot(),
+        'processes': sum(len(items) for items in by_job.values()),
+        'stuck_processes': sum(1 for items in by_job.values() for item in items if item['stuck']),
+        'background_processes': by_job.get(None, []),
+        'sources': sources,
+        'caches': {
+            'tracks': {'max_bytes': TRACK_CACHE_MAX_BYTES, **directory_usage(os.path.join(CACHE_DIR, 'tracks'))},
+            'archives': {'max_bytes': ARCHIVE_CACHE_MAX_BYTES, **directory_usage(os.path.join(CACHE_DIR, 'archives')),
+                         **archive_cache_stats},
+            'stores': stores
+        },
+        'downloads': directory_usage('downloads'),
+        'scratch': directory_usage(SCRATCH_DIR),
+        'disk': disk,
+        'prewarm': prewarm_stats
+    }
+
+def admin_authorized():
+    """Token do painel em 'Authorization: Bearer <token>' ou ?token="""
+    supplied = request.args.get('token', '')
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        supplied = header[7:].strip()
+    return hmac.compare_digest(supplied.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+@app.route('/admin')
+def admin_page():
+    """Painel de administração (os dados vêm de /admin/api)"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Painel desativado (defina ADMIN_TOKEN)'}), 404
+    if not admin_authorized():
+        return jsonify({'error': 'Token inválido'}), 401
+    return render_template('admin.html', stuck_seconds=ADMIN_STUCK_SECONDS)
+
+@app.route('/admin/api')
+def admin_api():
+    """Jobs ativos, na fila e finalizados, workers, fontes, caches e disco"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Painel desativado (defina ADMIN_TOKEN)'}), 404
+    if not admin_authorized():
+        return jsonify({'error': 'Token inválido'}), 401
+    return jsonify(admin_snapshot())
+
 @app.route('/favicon.png')
 def favicon():
     if os.path.exists('favicon.png'):
@@ -1272,6 +4196,8 @@ def logo():
 
 if __name__ == '__main__':
     Path('downloads').mkdir(exist_ok=True)
+    # Áreas de trabalho de jobs da execução anterior não têm mais dono
+    clean_scratch()
     port = int(os.environ.get('PORT', 5000))
     host = os.environ.get('HOST', '0.0.0.0')
     
@@ -1280,4 +4206,9 @@ if __name__ == '__main__':
     print("📊 Extrai TODAS as músicas da playlist (sem limite)")
     print(f"🌐 Servidor iniciando na porta {port}")
     
+    # Verificar ffmpeg/spotdl/yt-dlp em segundo plano (resultado em /healthz)
+    start_dependency_probe()
+    # Playlists populares são atualizadas no cache fora do horário de pico
+    start_prewarmer()
+    
     app.run(debug=False, host=host, port=port)
\ No newline at end of file
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Benchmark offline dos resolvers de playlist
+
+Mede, por estratégia e por fixture, o tempo de extração, o pico de memória
+(tracemalloc) e a precisão/recall em relação ao gabarito. Nenhum acesso à
+rede é feito: sockets são bloqueados e requests.get é servido pelas fixtures.
+
+Uso:
+    python benchmarks/bench_resolvers.py
+    python benchmarks/bench_resolvers.py --sizes 10 100 --repeat 5
+    python benchmarks/bench_resolvers.py --json resultado.json
+    python benchmarks/bench_resolvers.py --compare base.json --threshold 0.2
+"""
+
+import argparse
+import gc
+import json
+import os
+import re
+import socket
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from benchmarks import fixtures  # noqa: E402
+
+# Blocos JSON embutidos nas páginas (os mesmos que o web scraping procura)
+EMBEDDED_JSON_RES = [
+    re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL),
+    re.compile(r'Spotify\.Entity\s*=\s*({.*?});</script>', re.DOTALL),
+]
+
+
+def block_network():
+    """Garantir que nada no benchmark acesse a rede"""
+    def blocked(*args, **kwargs):
+        raise OSError("rede desativada durante os benchmarks")
+    socket.socket.connect = blocked
+    socket.create_connection = blocked
+
+
+class FakeResponse:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def serve_pages(pages):
+    """Substituto de requests.get que responde com as páginas da fixture"""
+    def fake_get(url, *args, **kwargs):
+        if '/embed/' in url and 'embed' in pages:
+            return FakeResponse(pages['embed'])
+        if '/playlist/' in url and '/embed/' not in url and 'playlist' in pages:
+            return FakeResponse(pages['playlist'])
+        return FakeResponse('', 404)
+    return fake_get
+
+
+def _embedded_json(html):
+    for pattern in EMBEDDED_JSON_RES:
+        match = pattern.search(html)
+        if match:
+            return json.loads(match.group(1))
+    return {}
+
+
+def _embedded_json_start(html):
+    for pattern in EMBEDDED_JSON_RES:
+        match = pattern.search(html)
+        if match:
+            return match.start(1)
+    return len(html)
+
+
+def _stream(html):
+    # Sem blob embutido não há o que ler (a página de embed, por exemplo)
+    start = _embedded_json_start(html)
+    return app.stream_playlist_data(html, start)[1] if start < len(html) else []
+
+
+def _quiet(func, *args):
+    """Executar sem os prints do app (que distorcem o tempo medido)"""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return func(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+# Estratégias: nome -> (tipo de entrada, função(fixture, página) -> músicas)
+STRATEGIES = {
+    'extract_songs_from_json': ('page', lambda fx, html: app.extract_songs_from_json(_embedded_json(html))),
+    # Leitura incremental: token a token, sem montar a árvore do JSON
+    'stream_playlist_data': ('page', lambda fx, html: _stream(html)),
+    'extract_songs_from_html': ('page', lambda fx, html: app.extract_songs_from_html(html)),
+    'extract_songs_aggressive': ('page', lambda fx, html: _quiet(app.extract_songs_aggressive, html)),
+    'get_playlist_fast_web_scraping': ('fixture', lambda fx, html: _scrape(fx)),
+    'songs_from_spotdl_data': ('save_file', lambda fx, html: app.songs_from_spotdl_data(json.loads(fx['save_file']))),
+}
+
+
+def _scrape(fixture):
+    original = app.requests.get
+    app.requests.get = serve_pages(fixture['pages'])
+    try:
+        _, songs = _quiet(app.get_playlist_fast_web_scraping, 'https://open.spotify.com/playlist/benchmark')
+        return songs
+    finally:
+        app.requests.get = original
+
+
+def accuracy(found, expected):
+    """Precisão e recall da lista extraída em relação ao gabarito"""
+    if expected is None:
+        return None, None
+    found_set = set(found)
+    expected_set = set(expected)
+    hits = len(found_set & expected_set)
+    precision = hits / len(found_set) if found_set else 0.0
+    recall = hits / len(expected_set) if expected_set else 0.0
+    return precision, recall
+
+
+def measure(func, repeat):
+    """Melhor tempo em `repeat` execuções + pico de memória em uma execução extra"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def run(fixture_list, strategy_names, repeat):
+    results = []
+    for fixture in fixture_list:
+        for name in strategy_names:
+            kind, func = STRATEGIES[name]
+            if kind == 'page':
+                targets = [(page_kind, html) for page_kind, html in fixture['pages'].items()]
+            elif kind == 'save_file':
+                if not fixture['save_file']:
+                    continue
+                targets = [('spotdl', None)]
+            else:
+                targets = [('web', None)]
+
+            for target, html in targets:
+                elapsed, peak, songs = measure(lambda: func(fixture, html), repeat)
+                precision, recall = accuracy(songs or [], fixture['expected'])
+                row = {
+                    'fixture': fixture['id'],
+                    'size': fixture['size'],
+                    'strategy': name,
+                    'input': target,
+                    'seconds': elapsed,
+                    'peak_bytes': peak,
+                    'found': len(songs or []),
+                    'precision': precision,
+                    'recall': recall,
+                }
+                results.append(row)
+                print(format_row(row), flush=True)
+    return results
+
+
+def format_row(row):
+    pct = lambda v: '   -  ' if v is None else f"{v * 100:5.1f}%"
+    return (f"{row['fixture']:<18} {row['strategy']:<31} {row['input']:<9} "
+            f"{row['seconds'] * 1000:10.2f} ms {row['peak_bytes'] / 1024 / 1024:9.2f} MiB "
+            f"{row['found']:>6} {pct(row['precision'])} {pct(row['recall'])}")
+
+
+def compare(results, baseline_path, threshold):
+    """Comparar com resultados anteriores; retorna lista de regressões"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['fixture'], r['strategy'], r['input']): r for r in json.load(f)}
+
+    regressions = []
+    for row in results:
+        base = baseline.get((row['fixture'], row['strategy'], row['input']))
+        if not base:
+            continue
+        key = f"{row['fixture']}/{row['strategy']}/{row['input']}"
+        if base['seconds'] > 0 and row['seconds'] > base['seconds'] * (1 + threshold):
+            regressions.append(f"⏱️ {key}: {base['seconds'] * 1000:.2f} ms -> {row['seconds'] * 1000:.2f} ms")
+        if base['peak_bytes'] > 0 and row['peak_bytes'] > base['peak_bytes'] * (1 + threshold):
+            regressions.append(f"🧠 {key}: {base['peak_bytes']} -> {row['peak_bytes']} bytes")
+        if base['recall'] is not None and row['recall'] is not None and row['recall'] < base['recall'] - 0.01:
+            regressions.append(f"🎯 {key}: recall {base['recall']:.3f} -> {row['recall']:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline dos resolvers de playlist')
+    parser.add_argument('--sizes', type=int, nargs='+', default=fixtures.DEFAULT_SIZES,
+                        help='tamanhos das playlists sintéticas')
+    parser.add_argument('--strategies', nargs='+', choices=sorted(STRATEGIES), default=list(STRATEGIES),
+                        help='estratégias a medir')
+    parser.add_argument('--repeat', type=int, default=3, help='execuções por medição (vale a melhor)')
+    parser.add_argument('--no-recorded', action='store_true', help='ignorar fixtures gravadas')
+    parser.add_argument('--json', help='salvar resultados neste arquivo')
+    parser.add_argument('--compare', help='arquivo JSON de uma execução anterior para comparar')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='piora relativa tolerada antes de acusar regressão (padrão 20%%)')
+    args = parser.parse_args()
+
+    block_network()
+
+    fixture_list = fixtures.synthetic_fixtures(args.sizes)
+    if not args.no_recorded:
+        fixture_list += fixtures.recorded_fixtures()
+
+    print(f"{'fixture':<18} {'estratégia':<31} {'entrada':<9} {'tempo':>13} {'pico mem':>13} "
+          f"{'achou':>6} {'prec.':>6} {'recall':>6}")
+    results = run(fixture_list, args.strategies, max(1, args.repeat))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Resultados salvos em {args.json}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print("❌ Regressões encontradas:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print("✅ Nenhuma regressão em relação à base")
+
+
+if __name__ == '__main__':
+    main()
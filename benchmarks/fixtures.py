@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Fixtures offline para os benchmarks dos resolvers de playlist
+
+Gera (de forma determinística) páginas no formato das páginas públicas do
+Spotify e arquivos .spotdl, com a lista de músicas esperada (gabarito), para
+playlists de 10 a 10.000 músicas. Páginas reais podem ser gravadas com
+`python benchmarks/fixtures.py record <url>` e entram automaticamente nos
+benchmarks (o gabarito vem do .spotdl gravado junto, se existir).
+"""
+
+import json
+import os
+import random
+import sys
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+RECORDED_DIR = os.path.join(FIXTURES_DIR, 'recorded')
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+_WORDS = [
+    'Amor', 'Noite', 'Saudade', 'Coração', 'Estrada', 'Lua', 'Fogo', 'Mar',
+    'Sonho', 'Cidade', 'Chuva', 'Vento', 'Tempo', 'Luz', 'Sombra', 'Desejo',
+    'Falling', 'Down', 'Never', 'There', 'Pray', 'Night', 'Blue', 'Gold',
+]
+_ARTISTS = [
+    'Leonardo', 'Leandro', 'Marília Mendonça', 'The Weeknd', 'Lil Peep',
+    'Anitta', 'Jorge & Mateus', 'Gusttavo Lima', 'Ludmilla', 'Kendrick Lamar',
+    'Henrique & Juliano', 'Zé Neto & Cristiano', 'Billie Eilish', 'Djavan',
+]
+
+
+def make_tracks(size, seed=42):
+    """Gerar `size` músicas determinísticas: [{'name', 'artists': [..]}]"""
+    rng = random.Random(seed + size)
+    tracks = []
+    for i in range(size):
+        name = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(1, 4)))
+        name = f"{name} {i}"
+        artists = rng.sample(_ARTISTS, rng.choice([1, 1, 1, 2, 3]))
+        tracks.append({'name': name, 'artists': artists})
+    return tracks
+
+
+def expected_songs(tracks):
+    """Gabarito no mesmo formato que o app usa: 'Artista & Artista - Música'"""
+    return [f"{' & '.join(track['artists'])} - {track['name']}" for track in tracks]
+
+
+def _compact(data):
+    # Páginas reais usam JSON compacto (sem espaços), o que importa para os regex
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def playlist_page(tracks, name='Playlist de Benchmark'):
+    """Página open.spotify.com/playlist com `Spotify.Entity` no formato da Web API"""
+    items = []
+    for i, track in enumerate(tracks):
+        items.append({
+            'added_at': '2024-01-01T00:00:00Z',
+            'track': {
+                'name': track['name'],
+                'artists': [{'name': artist, 'type': 'artist'} for artist in track['artists']],
+                'duration_ms': 180000 + i,
+                'uri': f'spotify:track:{i:022d}',
+            },
+        })
+    entity = {
+        'name': name,
+        'description': 'Gerada para benchmarks',
+        'type': 'playlist',
+        'tracks': {'total': len(tracks), 'items': items},
+    }
+    return (
+        '<!DOCTYPE html><html><head><title>' + name + ' - playlist by Spotify | Spotify</title></head>'
+        '<body><div id="main"></div>'
+        '<script>Spotify = {}; Spotify.Entity = ' + _compact(entity) + ';</script>'
+        '</body></html>'
+    )
+
+
+def embed_page(tracks, name='Playlist de Benchmark'):
+    """Página open.spotify.com/embed/playlist com trackList (title/subtitle)"""
+    track_list = [
+        {
+            'uri': f'spotify:track:{i:022d}',
+            'title': track['name'],
+            'subtitle': ', '.join(track['artists']),
+            'duration': 180000 + i,
+        }
+        for i, track in enumerate(tracks)
+    ]
+    data = {
+        'props': {
+            'pageProps': {
+                'state': {
+                    'data': {
+                        'entity': {'type': 'playlist', 'name': name, 'trackList': track_list}
+                    }
+                }
+            }
+        }
+    }
+    return (
+        '<!DOCTYPE html><html><head><title>' + name + '</title></head><body>'
+        '<script id="__NEXT_DATA__" type="application/json">' + _compact(data) + '</script>'
+        '</body></html>'
+    )
+
+
+def spotdl_save_file(tracks):
+    """Conteúdo de um arquivo .spotdl (lista de dicts de música)"""
+    return json.dumps([
+        {
+            'name': track['name'],
+            'artists': track['artists'],
+            'artist': track['artists'][0],
+            'album_name': 'Álbum',
+            'song_id': f'{i:022d}',
+            'isrc': f'BRXXX{i:07d}',
+            'url': f'https://open.spotify.com/track/{i:022d}',
+        }
+        for i, track in enumerate(tracks)
+    ], ensure_ascii=False)
+
+
+def synthetic_fixtures(sizes=None):
+    """Fixtures sintéticas: [{'id', 'size', 'pages': {...}, 'save_file', 'expected'}]"""
+    fixtures = []
+    for size in sizes or DEFAULT_SIZES:
+        tracks = make_tracks(size)
+        fixtures.append({
+            'id': f'sintetica_{size}',
+            'size': size,
+            'pages': {
+                'playlist': playlist_page(tracks),
+                'embed': embed_page(tracks),
+            },
+            'save_file': spotdl_save_file(tracks),
+            'expected': expected_songs(tracks),
+        })
+    return fixtures
+
+
+def recorded_fixtures():
+    """Fixtures gravadas em fixtures/recorded/<id>/ (páginas reais do Spotify)"""
+    fixtures = []
+    if not os.path.isdir(RECORDED_DIR):
+        return fixtures
+    
+    for fixture_id in sorted(os.listdir(RECORDED_DIR)):
+        folder = os.path.join(RECORDED_DIR, fixture_id)
+        if not os.path.isdir(folder):
+            continue
+        pages = {}
+        for kind in ('playlist', 'embed'):
+            path = os.path.join(folder, f'{kind}.html')
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    pages[kind] = f.read()
+        
+        save_file = None
+        expected = None
+        save_path = os.path.join(folder, 'playlist.spotdl')
+        if os.path.exists(save_path):
+            with open(save_path, encoding='utf-8') as f:
+                save_file = f.read()
+            expected = expected_songs([
+                {'name': song['name'], 'artists': song['artists']}
+                for song in json.loads(save_file)
+            ])
+        
+        fixtures.append({
+            'id': f'gravada_{fixture_id}',
+            'size': len(expected) if expected else None,
+            'pages': pages,
+            'save_file': save_file,
+            'expected': expected,
+        })
+    return fixtures
+
+
+def record(playlist_url):
+    """Gravar páginas reais de uma playlist (precisa de rede)"""
+    import requests
+    
+    playlist_id = playlist_url.split('/')[-1].split('?')[0]
+    folder = os.path.join(RECORDED_DIR, playlist_id)
+    os.makedirs(folder, exist_ok=True)
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+    }
+    urls = {
+        'playlist': f'https://open.spotify.com/playlist/{playlist_id}',
+        'embed': f'https://open.spotify.com/embed/playlist/{playlist_id}',
+    }
+    for kind, url in urls.items():
+        response = requests.get(url, headers=headers, timeout=15)
+        with open(os.path.join(folder, f'{kind}.html'), 'w', encoding='utf-8') as f:
+            f.write(response.text)
+        print(f"💾 {kind}: {len(response.text)} caracteres ({response.status_code})")
+    
+    print(f"💡 Para o gabarito, gere o .spotdl: spotdl {playlist_url} --save-file {os.path.join(folder, 'playlist.spotdl')}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'record':
+        record(sys.argv[2])
+    else:
+        print("Uso: python benchmarks/fixtures.py record <url_da_playlist>")
+        sys.exit(1)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Teste de carga ponta a ponta do SpotShadow (sem rede externa)
+
+Dispara N clientes simultâneos que chamam POST /download e acompanham o job
+por GET /status até o fim. Reporta vazão, latências p50/p99 por endpoint,
+tempo por job e uso de recursos do processo do app.
+
+Com --spawn, o driver sobe sozinho o Spotify falso e o app configurado com os
+binários falsos (loadtest/fake_tools.py), numa pasta de trabalho temporária:
+
+    python loadtest/driver.py --spawn --clients 8 --jobs-per-client 2 \\
+        --playlist-size 50 --latency 0.2:0.8 --failure-rate 0.05
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_TOOLS = os.path.join(ROOT, 'loadtest', 'fake_tools.py')
+FAKE_SPOTIFY = os.path.join(ROOT, 'loadtest', 'fake_spotify.py')
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_http(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+class ProcessSampler:
+    """Amostrar CPU e memória (RSS) do app e dos seus filhos via /proc (Linux)"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.page = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.cpu_start = self.cpu_seconds()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def stat(self, pid):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return fields
+        except (OSError, IndexError):
+            return None
+
+    def tree(self):
+        """pids do app e de todos os descendentes vivos"""
+        children = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                fields = self.stat(entry)
+                if fields:
+                    children.setdefault(int(fields[1]), []).append(int(entry))
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(children.get(pid, []))
+        return pids
+
+    def cpu_seconds(self):
+        """CPU do app + filhos já finalizados (utime, stime, cutime, cstime)"""
+        fields = self.stat(self.pid)
+        if not fields:
+            return None
+        return sum(int(value) for value in fields[11:15]) / self.ticks
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            pids = self.tree()
+            rss = 0
+            for pid in pids:
+                fields = self.stat(pid)
+                if fields:
+                    rss += int(fields[21]) * self.page
+            self.samples.append({'time': time.time(), 'rss': rss, 'processes': len(pids),
+                                 'cpu': self.cpu_seconds()})
+
+    def start(self):
+        if os.path.isdir('/proc'):
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {'download': [], 'status': []}
+        self.job_times = []
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.tracks = 0
+
+    def add_latency(self, endpoint, seconds):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+
+
+def client(index, args, stats, deadline):
+    session = requests.Session()
+    # Cada cliente simulado tem o próprio "IP" (cotas e fila justa são por cliente)
+    session.headers['X-Forwarded-For'] = f'10.0.{index // 250}.{index % 250 + 1}'
+    for job_number in range(args.jobs_per_client):
+        url = f"https://open.spotify.com/playlist/loadtest{args.playlist_size}c{index}j{job_number}"
+        job_id = None
+        started = time.time()
+
+        # Enviar o job (repetindo enquanto o servidor recusar por cota)
+        while time.time() < deadline:
+            t0 = time.perf_counter()
+            try:
+                response = session.post(f"{args.base_url}/download", json={'url': url}, timeout=30)
+            except requests.RequestException:
+                with stats.lock:
+                    stats.errors += 1
+                time.sleep(1)
+                continue
+            stats.add_latency('download', time.perf_counter() - t0)
+            if response.status_code == 200:
+                job_id = response.json().get('job_id')
+                break
+            with stats.lock:
+                stats.rejected += 1
+            time.sleep(args.retry_interval)
+
+        if job_id is None:
+            return
+
+        # Acompanhar o job até terminar
+        while time.time() < deadline:
+            time.sleep(args.poll_interval)
+            t0 = time.perf_counter()
+            try:
+                response = session.get(f"{args.base_url}/status", params={'job': job_id}, timeout=30)
+            except requests.RequestException:
+                with stats.lock:
+                    stats.errors += 1
+                continue
+            stats.add_latency('status', time.perf_counter() - t0)
+            data = response.json()
+            if data.get('status') in ('completed', 'error', 'cancelled'):
+                with stats.lock:
+                    stats.job_times.append(time.time() - started)
+                    if data['status'] == 'completed':
+                        stats.completed += 1
+                        stats.tracks += data.get('downloaded_songs', 0)
+                    else:
+                        stats.failed += 1
+                break
+
+
+def spawn(args):
+    """Subir Spotify falso + app com binários falsos; retorna (processos, pasta)"""
+    workdir = tempfile.mkdtemp(prefix='spotshadow_load_')
+    spotify_port = free_port()
+    app_port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(app_port),
+        'HOST': '127.0.0.1',
+        'TRUST_PROXY_HEADERS': '1',
+        'SPOTDL_BIN': f'{sys.executable} {FAKE_TOOLS} spotdl',
+        'YTDLP_BIN': f'{sys.executable} {FAKE_TOOLS} yt-dlp',
+        'FFMPEG_BIN': f'{sys.executable} {FAKE_TOOLS} ffmpeg',
+        'FAKE_TRANSCODE_LATENCY': args.transcode_latency,
+        'SPOTIFY_WEB_URL': f'http://127.0.0.1:{spotify_port}',
+        'FAKE_LATENCY': args.latency,
+        'FAKE_FAILURE_RATE': str(args.failure_rate),
+        'FAKE_FILE_SIZE': str(args.file_size),
+        'PYTHONUNBUFFERED': '1',
+    })
+    log = open(os.path.join(workdir, 'app.log'), 'w')
+    spotify = subprocess.Popen([sys.executable, FAKE_SPOTIFY, '--port', str(spotify_port)],
+                               stdout=log, stderr=subprocess.STDOUT, env=env)
+    os.makedirs(os.path.join(workdir, 'downloads'), exist_ok=True)
+    app_proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'app.py')], cwd=workdir,
+                                stdout=log, stderr=subprocess.STDOUT, env=env)
+    args.base_url = f'http://127.0.0.1:{app_port}'
+    if not wait_http(args.base_url + '/status'):
+        raise RuntimeError(f"app não respondeu; veja {log.name}")
+    print(f"🚀 App em {args.base_url} (pasta {workdir}, log em {log.name})")
+    return [app_proc, spotify], workdir
+
+
+def fetch_pipeline(base_url):
+    """Métricas por estágio (download/conversão) expostas em /healthz"""
+    try:
+        return requests.get(f"{base_url}/healthz", timeout=10).json().get('pipeline')
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def report(stats, elapsed, sampler, pipeline=None):
+    def fmt(value):
+        return '-' if value is None else f"{value * 1000:.1f} ms"
+
+    print()
+    print("📊 Resultado")
+    print(f"   duração: {elapsed:.1f}s")
+    print(f"   jobs concluídos: {stats.completed}  com erro: {stats.failed}  "
+          f"recusados (cota): {stats.rejected}  falhas de conexão: {stats.errors}")
+    print(f"   vazão: {stats.completed / elapsed * 60:.2f} jobs/min, {stats.tracks / elapsed:.2f} músicas/s")
+    for endpoint, values in stats.latencies.items():
+        print(f"   {endpoint:<9} n={len(values):<6} p50={fmt(percentile(values, 50))}  "
+              f"p99={fmt(percentile(values, 99))}")
+    if stats.job_times:
+        print(f"   tempo por job: p50={percentile(stats.job_times, 50):.1f}s  "
+              f"p99={percentile(stats.job_times, 99):.1f}s")
+    if sampler and sampler.samples:
+        peak_rss = max(sample['rss'] for sample in sampler.samples)
+        peak_procs = max(sample['processes'] for sample in sampler.samples)
+        cpu_end = sampler.samples[-1]['cpu']
+        cpu = (cpu_end - sampler.cpu_start) if cpu_end is not None and sampler.cpu_start is not None else None
+        print(f"   memória (app + filhos): pico {peak_rss / 1024 / 1024:.1f} MiB, "
+              f"até {peak_procs} processos")
+        if cpu is not None:
+            print(f"   CPU consumida: {cpu:.1f}s ({cpu / elapsed * 100:.0f}% de um núcleo em média)")
+    for stage, data in (pipeline or {}).items():
+        avg = '-' if data.get('avg_seconds') is None else f"{data['avg_seconds']:.2f}s"
+        print(f"   estágio {stage:<9} workers={data['workers']:<3} itens={data['completed']:<6} "
+              f"médio={avg}  ocupação={data['utilization'] * 100:.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga do SpotShadow')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', action='store_true', help='subir app e Spotify falsos automaticamente')
+    parser.add_argument('--pid', type=int, help='pid do app para medir recursos (sem --spawn)')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--jobs-per-client', type=int, default=1)
+    parser.add_argument('--playlist-size', type=int, default=20)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--retry-interval', type=float, default=2.0)
+    parser.add_argument('--duration', type=float, default=600, help='tempo máximo do teste (s)')
+    parser.add_argument('--latency', default='0.5', help='latência por música dos binários falsos')
+    parser.add_argument('--transcode-latency', default='0.2', help='segundos de CPU por conversão do ffmpeg falso')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--file-size', type=int, default=4000000)
+    parser.add_argument('--keep', action='store_true', help='manter a pasta de trabalho do --spawn')
+    args = parser.parse_args()
+
+    processes, workdir = ([], None)
+    if args.spawn:
+        processes, workdir = spawn(args)
+    pid = processes[0].pid if processes else args.pid
+
+    sampler = ProcessSampler(pid).start() if pid else None
+    stats = Stats()
+    started = time.time()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=client, args=(i, args, stats, deadline), daemon=True)
+               for i in range(args.clients)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()) + 5)
+    finally:
+        elapsed = time.time() - started
+        if sampler:
+            sampler.stop()
+        report(stats, elapsed, sampler, fetch_pipeline(args.base_url))
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
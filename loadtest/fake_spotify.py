@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Substituto local do open.spotify.com para testes de carga
+
+Serve /oembed e as páginas /<tipo>/<id> e /embed/<tipo>/<id> (playlist, album
+e track) geradas por benchmarks/fixtures.py. Playlists e álbuns
+"loadtest<N>..." têm N músicas; cada /track/<id> é uma música só.
+
+Uso:
+    python loadtest/fake_spotify.py --port 8765
+    SPOTIFY_WEB_URL=http://127.0.0.1:8765 python app.py
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fixtures  # noqa: E402
+from loadtest.fake_tools import PLAYLIST_SIZE_RE, env_float, track_seed  # noqa: E402
+
+
+@lru_cache(maxsize=64)
+def pages_for(size, seed=42):
+    tracks = fixtures.make_tracks(size, seed)
+    return fixtures.playlist_page(tracks).encode('utf-8'), fixtures.embed_page(tracks).encode('utf-8')
+
+
+def playlist_size(playlist_id):
+    match = PLAYLIST_SIZE_RE.search(playlist_id)
+    return int(match.group(1)) if match else int(env_float('FAKE_PLAYLIST_SIZE', '20'))
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    # Latência de rede simulada por requisição (segundos)
+    delay = 0.0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split('/') if part]
+
+        if parts == ['oembed']:
+            url = parse_qs(parsed.query).get('url', [''])[0]
+            kind, playlist_id = url.rstrip('/').split('/')[-2:]
+            body = json.dumps({'title': f'{kind.capitalize()} {playlist_id}', 'type': 'rich'}).encode('utf-8')
+            return self.respond(200, body, 'application/json')
+
+        if len(parts) >= 2 and parts[-2] in ('playlist', 'album', 'track'):
+            if parts[-2] == 'track':
+                playlist_page, embed_page = pages_for(1, track_seed(parts[-1]))
+            else:
+                playlist_page, embed_page = pages_for(playlist_size(parts[-1]))
+            body = embed_page if parts[0] == 'embed' else playlist_page
+            return self.respond(200, body, 'text/html; charset=utf-8')
+
+        self.respond(404, b'not found', 'text/plain')
+
+    def respond(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spotify falso para testes de carga')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help='latência por requisição (s)')
+    args = parser.parse_args()
+
+    FakeSpotifyHandler.delay = args.delay
+    server = ThreadingHTTPServer((args.host, args.port), FakeSpotifyHandler)
+    print(f"🎭 Spotify falso em http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
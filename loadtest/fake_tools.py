@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Substitutos do spotdl e do yt-dlp para testes de carga offline
+
+Uso (o app aceita comandos com argumentos em SPOTDL_BIN / YTDLP_BIN / FFMPEG_BIN):
+    SPOTDL_BIN="python loadtest/fake_tools.py spotdl"
+    YTDLP_BIN="python loadtest/fake_tools.py yt-dlp"
+    FFMPEG_BIN="python loadtest/fake_tools.py ffmpeg"
+
+Comportamento configurável por variáveis de ambiente:
+    FAKE_LATENCY        segundos por música, fixo ("0.5") ou faixa ("0.2:1.5")
+    FAKE_LIST_LATENCY   segundos para listar uma playlist (--save-file/--list)
+    FAKE_TRANSCODE_LATENCY  segundos de CPU (ocupada de verdade) por conversão
+    FAKE_FAILURE_RATE   probabilidade (0-1) de uma música falhar
+    FAKE_FILE_SIZE      tamanho em bytes de cada arquivo gerado
+    FAKE_PLAYLIST_SIZE  músicas em playlists cujo id não indica o tamanho
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import make_tracks  # noqa: E402
+
+# Playlists (e álbuns) "loadtest<N>..." têm N músicas (ex.: /playlist/loadtest200c1j0)
+PLAYLIST_SIZE_RE = re.compile(r'loadtest(\d+)')
+# Músicas avulsas: /track/<id> ou spotify:track:<id>
+TRACK_ID_RE = re.compile(r'track[/:](\w+)')
+
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return float(default)
+
+
+def latency(name='FAKE_LATENCY', default='0.5'):
+    """Sortear uma latência a partir de "x" ou "min:max\""""
+    spec = os.environ.get(name, default)
+    if ':' in spec:
+        low, high = (float(part) for part in spec.split(':', 1))
+        return random.uniform(low, high)
+    return float(spec)
+
+
+def should_fail():
+    return random.random() < env_float('FAKE_FAILURE_RATE', '0')
+
+
+def write_file(path):
+    """Gravar arquivo de áudio falso do tamanho configurado"""
+    size = int(env_float('FAKE_FILE_SIZE', '4000000'))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    chunk = b'\0' * min(size, 1024 * 1024)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
+
+
+def option(args, name, default=None):
+    if name in args:
+        index = args.index(name)
+        if index + 1 < len(args):
+            return args[index + 1]
+    return default
+
+
+def sanitize(text):
+    text = "".join(char for char in text if char not in "/?\\*|<>")
+    return text.replace('"', "'").replace(":", "-").strip()
+
+
+def track_seed(track_id):
+    """Semente da música avulsa: o mesmo id gera a mesma música no spotdl e no Spotify falso"""
+    return sum(ord(char) for char in track_id)
+
+
+def playlist_tracks(query):
+    """Músicas de uma consulta: arquivo .spotdl, URL de playlist/álbum/música ou texto "Artista - Música" avulso"""
+    if query.endswith('.spotdl') and os.path.exists(query):
+        with open(query, encoding='utf-8') as f:
+            return [{'name': song['name'], 'artists': song['artists']} for song in json.load(f)]
+    if 'spotify' not in query and ' - ' in query:
+        artist, _, title = query.partition(' - ')
+        return [{'name': title, 'artists': [artist]}]
+    match = TRACK_ID_RE.search(query)
+    if match:
+        return make_tracks(1, seed=track_seed(match.group(1)))
+    match = PLAYLIST_SIZE_RE.search(query)
+    size = int(match.group(1)) if match else int(env_float('FAKE_PLAYLIST_SIZE', '20'))
+    return make_tracks(size)
+
+
+def fake_spotdl(args):
+    if '--version' in args:
+        print('4.2.5 (fake)')
+        return 0
+
+    # Consultas: argumentos posicionais que não são valor de opção
+    values = {args[i + 1] for i, arg in enumerate(args[:-1]) if arg.startswith('-')}
+    queries = [arg for arg in args if not arg.startswith('-') and arg not in values]
+    if not queries:
+        print('spotdl (fake): nenhuma consulta', file=sys.stderr)
+        return 1
+    tracks = [track for query in queries for track in playlist_tracks(query)]
+
+    save_file = option(args, '--save-file')
+    if save_file or '--list' in args:
+        time.sleep(latency('FAKE_LIST_LATENCY', '2'))
+        if save_file:
+            with open(save_file, 'w', encoding='utf-8') as f:
+                json.dump([
+                    {'name': track['name'], 'artists': track['artists'], 'artist': track['artists'][0],
+                     'song_id': f'{i:022d}', 'url': f'https://open.spotify.com/track/{i:022d}'}
+                    for i, track in enumerate(tracks)
+                ], f)
+        else:
+            for track in tracks:
+                print(f"{' & '.join(track['artists'])} - {track['name']}")
+        return 0
+
+    template = option(args, '--output', '{artists} - {title}.{output-ext}')
+    if '{' not in template:
+        template = os.path.join(template, '{artists} - {title}.{output-ext}')
+    output_format = option(args, '--format', 'mp3')
+    threads = int(option(args, '--threads', '4'))
+
+    def download(indexed):
+        index, track = indexed
+        time.sleep(latency())
+        display_name = f"{track['artists'][0]} - {track['name']}"
+        if should_fail():
+            print(f'LookupError: No results found for song: {display_name}', flush=True)
+            return False
+        path = (template.replace('{artists}', sanitize(', '.join(track['artists'])))
+                .replace('{title}', sanitize(track['name']))
+                .replace('{output-ext}', output_format))
+        write_file(path)
+        print(f'Downloaded "{display_name}": https://music.youtube.com/watch?v=fake{index}', flush=True)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        results = list(executor.map(download, enumerate(tracks)))
+    return 0 if any(results) or not results else 1
+
+
+def fake_ytdlp(args):
+    if '--version' in args:
+        print('2024.01.01 (fake)')
+        return 0
+
+    positional = [arg for arg in args if not arg.startswith('-')]
+    # Primeiro argumento posicional que não é valor de opção
+    values = {args[i + 1] for i, arg in enumerate(args[:-1]) if arg.startswith('-')}
+    query = next((arg for arg in positional if arg not in values), '')
+    title = re.sub(r'^\w+search\d*:', '', query).replace(' audio', '').strip() or 'faixa'
+
+    time.sleep(latency())
+    if should_fail():
+        print(f'ERROR: [fake] {title}: falha simulada', file=sys.stderr)
+        return 1
+
+    audio_format = option(args, '--audio-format', 'webm')
+    ext = 'opus' if audio_format == 'best' else audio_format
+    template = option(args, '--output', '%(title)s.%(ext)s')
+    path = template.replace('%(title)s', sanitize(title)).replace('%(ext)s', ext)
+    write_file(path)
+
+    # Um valor por --print, na ordem pedida (webpage_url e/ou filepath)
+    for i, arg in enumerate(args[:-1]):
+        if arg != '--print':
+            continue
+        if args[i + 1].endswith('webpage_url'):
+            print(query if query.startswith('http') else f'https://www.youtube.com/watch?v=fake-{sanitize(title)}')
+        elif args[i + 1].endswith('filepath'):
+            print(path)
+    return 0
+
+
+def fake_ffmpeg(args):
+    if '-version' in args:
+        print('ffmpeg version 6.0 (fake)')
+        return 0
+
+    source = option(args, '-i')
+    if not source or not os.path.exists(source):
+        print(f'{source}: No such file or directory', file=sys.stderr)
+        return 1
+
+    # Conversão consome CPU, não rede: ocupar o núcleo em vez de dormir
+    deadline = time.process_time() + latency('FAKE_TRANSCODE_LATENCY', '0.2')
+    while time.process_time() < deadline:
+        pass
+    write_file(args[-1])
+    return 0
+
+
+TOOLS = {'spotdl': fake_spotdl, 'yt-dlp': fake_ytdlp, 'ffmpeg': fake_ffmpeg}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in TOOLS:
+        print('Uso: fake_tools.py (spotdl|yt-dlp|ffmpeg) [argumentos...]', file=sys.stderr)
+        return 2
+    seed = os.environ.get('FAKE_SEED')
+    if seed:
+        random.seed(f"{seed}-{os.getpid()}")
+    tool, args = sys.argv[1], sys.argv[2:]
+    return TOOLS[tool](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
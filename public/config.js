@@ -13,7 +13,8 @@
             endpoints: {
                 download: '/download',
                 status: '/status',
-                downloadZip: '/download-zip'
+                downloadZip: '/download-zip',
+                jobs: '/jobs'
             }
         },
         
@@ -23,7 +24,8 @@
             endpoints: {
                 download: '/api/download',
                 status: '/api/status',
-                downloadZip: '/api/download-zip'
+                downloadZip: '/api/download-zip',
+                jobs: '/api/jobs'
             }
         }
     };
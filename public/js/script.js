@@ -52,10 +52,17 @@ document.addEventListener('keydown', e => {
     const progressText = document.getElementById('progressText');
     const downloadZipBtn = document.getElementById('downloadZipBtn');
     const playlistUrl = document.getElementById('playlistUrl');
+    const tracksPanel = document.getElementById('tracksPanel');
+    const tracksList = document.getElementById('tracksList');
+    const partialZipBtn = document.getElementById('partialZipBtn');
+    const cancelBtn = document.getElementById('cancelBtn');
+    const profileSelect = document.getElementById('profileSelect');
 
     // Variáveis de controle
     let statusInterval;
     let securityToken = null;
+    let currentJobId = null;
+    let shownTracks = 0;
 
     // Função para obter token de segurança
     async function getSecurityToken() {
@@ -82,6 +89,9 @@ document.addEventListener('keydown', e => {
         spinner.style.display = 'block';
         progressText.textContent = 'Obtendo token de segurança...';
         downloadZipBtn.style.display = 'none';
+        tracksPanel.style.display = 'none';
+        tracksList.innerHTML = '';
+        shownTracks = 0;
 
         try {
             // Obter token de segurança
@@ -96,7 +106,8 @@ document.addEventListener('keydown', e => {
                 },
                 body: JSON.stringify({ 
                     url: url,
-                    token: securityToken
+                    token: securityToken,
+                    profile: profileSelect.value
                 })
             });
 
@@ -106,6 +117,9 @@ document.addEventListener('keydown', e => {
                 throw new Error(data.error || 'Erro no servidor');
             }
 
+            currentJobId = data.job_id || null;
+            cancelBtn.style.display = currentJobId ? 'block' : 'none';
+
             // Iniciar polling do status
             startStatusPolling();
 
@@ -114,11 +128,35 @@ document.addEventListener('keydown', e => {
         }
     });
 
+function formatDuration(seconds) {
+    seconds = Math.round(seconds);
+    if (seconds < 60) return `${seconds}s`;
+    if (seconds < 3600) return `${Math.floor(seconds / 60)}min ${seconds % 60}s`;
+    return `${Math.floor(seconds / 3600)}h ${Math.floor(seconds % 3600 / 60)}min`;
+}
+
+// Ritmo e tempo restante calculados pelo servidor (média móvel por música)
+function formatRate(data) {
+    const parts = [];
+    if (data.eta_seconds !== null && data.eta_seconds !== undefined) {
+        parts.push(`⏱️ Faltam ~${formatDuration(data.eta_seconds)}`);
+    }
+    if (data.tracks_per_second) {
+        parts.push(`${(data.tracks_per_second * 60).toFixed(1)} músicas/min`);
+    }
+    if (data.bytes_per_second) {
+        parts.push(`${(data.bytes_per_second / (1024 * 1024)).toFixed(2)} MB/s`);
+    }
+    return parts.join(' · ');
+}
+
 // Função para iniciar o polling do status
 function startStatusPolling() {
     statusInterval = setInterval(async () => {
         try {
-            const response = await fetch(API_CONFIG.baseUrl + API_CONFIG.endpoints.status);
+            const statusUrl = API_CONFIG.baseUrl + API_CONFIG.endpoints.status +
+                (currentJobId ? `?job=${currentJobId}` : '');
+            const response = await fetch(statusUrl);
             const data = await response.json();
 
             // Atualizar texto de progresso
@@ -129,18 +167,31 @@ function startStatusPolling() {
                 progressMsg += ` (${data.downloaded_songs}/${data.total_songs})`;
             }
             
+            const rate = formatRate(data);
+            if (data.status === 'downloading' && rate) {
+                progressMsg += `\n${rate}`;
+            }
+            
             if (data.current_song) {
                 progressMsg += `\n🎵 ${data.current_song}`;
             }
             
             progressText.innerHTML = progressMsg.replace(/\n/g, '<br>');
 
+            // Novas músicas concluídas: atualizar lista de downloads individuais
+            if (data.status === 'downloading' && currentJobId && (data.downloaded_songs || 0) > shownTracks) {
+                refreshTracks();
+            }
+
             if (data.status === 'completed') {
                 clearInterval(statusInterval);
-                showCompleted();
+                showCompleted(data);
             } else if (data.status === 'error') {
                 clearInterval(statusInterval);
                 showError(data.error_message || 'Erro desconhecido');
+            } else if (data.status === 'cancelled') {
+                clearInterval(statusInterval);
+                showError('Download cancelado');
             }
         } catch (error) {
             clearInterval(statusInterval);
@@ -149,11 +200,54 @@ function startStatusPolling() {
     }, 1000);
 }
 
+// Função para listar as músicas já prontas do job
+async function refreshTracks() {
+    try {
+        const response = await fetch(`${API_CONFIG.baseUrl}${API_CONFIG.endpoints.jobs}/${currentJobId}/tracks`);
+        if (!response.ok) return;
+        const data = await response.json();
+        shownTracks = data.tracks.length;
+        tracksList.innerHTML = '';
+        data.tracks.forEach(track => {
+            const item = document.createElement('li');
+            const link = document.createElement('a');
+            link.href = API_CONFIG.baseUrl + API_CONFIG.endpoints.jobs + track.url.replace(/^\/jobs/, '');
+            link.textContent = `⬇️ ${track.song || track.name}`;
+            item.appendChild(link);
+            tracksList.appendChild(item);
+        });
+        tracksPanel.style.display = shownTracks > 0 ? 'block' : 'none';
+    } catch (error) {
+        // Lista é opcional: manter o polling principal
+    }
+}
+
+// Event listener para o ZIP parcial
+partialZipBtn.addEventListener('click', () => {
+    if (currentJobId) {
+        window.location.href = `${API_CONFIG.baseUrl}${API_CONFIG.endpoints.jobs}/${currentJobId}/partial-zip`;
+    }
+});
+
+// Event listener para cancelar o job em andamento
+cancelBtn.addEventListener('click', async () => {
+    if (!currentJobId) return;
+    cancelBtn.disabled = true;
+    try {
+        await fetch(`${API_CONFIG.baseUrl}${API_CONFIG.endpoints.jobs}/${currentJobId}`, { method: 'DELETE' });
+    } catch (error) {
+        cancelBtn.disabled = false;
+    }
+});
+
 // Função para mostrar download concluído
-function showCompleted() {
+function showCompleted(data) {
     status.className = 'status show completed';
     spinner.style.display = 'none';
     progressText.textContent = '✅ Download concluído!';
+    tracksPanel.style.display = 'none';
+    // Música avulsa vem como arquivo de áudio, sem ZIP
+    downloadZipBtn.textContent = data && data.kind === 'track' ? '🎵 Baixar música' : '📦 Baixar ZIP';
     downloadZipBtn.style.display = 'block';
     resetForm();
 }
@@ -170,11 +264,14 @@ function showError(message) {
 function resetForm() {
     downloadBtn.disabled = false;
     downloadBtn.textContent = 'Baixar Playlist';
+    cancelBtn.style.display = 'none';
+    cancelBtn.disabled = false;
 }
 
 // Event listener para o botão de download do ZIP
 downloadZipBtn.addEventListener('click', () => {
-    window.location.href = API_CONFIG.baseUrl + API_CONFIG.endpoints.downloadZip;
+    window.location.href = API_CONFIG.baseUrl + API_CONFIG.endpoints.downloadZip +
+        (currentJobId ? `?job=${currentJobId}` : '');
 });
 
     // Auto-focus no input quando a página carrega
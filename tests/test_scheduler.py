@@ -0,0 +1,91 @@
+"""
+Escalonador: divisão dos workers entre clientes e entre os jobs de um cliente
+
+Roda sem workers nem ferramentas externas: as unidades são só rótulos e o
+relógio é simulado (um segundo por unidade entregue).
+
+    python -m pytest tests/
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+class SchedulerFairnessTest(unittest.TestCase):
+
+    def setUp(self):
+        # create_job cria downloads/ e a área de trabalho na pasta atual
+        self.previous_cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp(prefix='spotshadow_test_')
+        os.chdir(self.workdir)
+        self.clock = 1000.0
+        patcher = mock.patch.object(app.time, 'time', lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app.scheduler_queues.clear()
+        app.scheduler_client_since.clear()
+
+    def tearDown(self):
+        app.scheduler_queues.clear()
+        app.scheduler_client_since.clear()
+        os.chdir(self.previous_cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def make_job(self, client, units=40, songs=100):
+        job = app.create_job('https://open.spotify.com/playlist/loadtest100', client)
+        job['status']['total_songs'] = songs
+        with app.scheduler_cond:
+            job['units'].extend((f'{client} {index}', None) for index in range(units))
+            job['pending_units'] += units
+            app.enqueue_job(job)
+        return job
+
+    def run_units(self, count):
+        served = []
+        for _ in range(count):
+            with app.scheduler_cond:
+                job, _ = app.next_unit()
+            served.append(job)
+            self.clock += 1
+        return served
+
+    def test_client_with_two_jobs_gets_the_same_share_as_client_with_one(self):
+        first = self.make_job('1.1.1.1')
+        second = self.make_job('1.1.1.1')
+        self.make_job('2.2.2.2')
+
+        served = self.run_units(30)
+
+        by_client = Counter(job['client'] for job in served)
+        self.assertEqual(by_client['1.1.1.1'], 15)
+        self.assertEqual(by_client['2.2.2.2'], 15)
+        # Dentro do cliente, os dois jobs dividem a parte dele
+        by_job = Counter(job['id'] for job in served)
+        self.assertEqual(by_job[first['id']], 8)
+        self.assertEqual(by_job[second['id']], 7)
+
+    def test_shorter_job_of_a_client_goes_first_within_it(self):
+        self.make_job('1.1.1.1', songs=200)
+        short = self.make_job('1.1.1.1', songs=10)
+        self.make_job('2.2.2.2', songs=10)
+        # Com espera zero toda razão de resposta vale 1
+        self.clock += 10
+
+        served = self.run_units(6)
+
+        ours = [job for job in served if job['client'] == '1.1.1.1']
+        self.assertEqual(len(ours), 3)
+        self.assertEqual(ours[0]['id'], short['id'])
+
+
+if __name__ == '__main__':
+    unittest.main()